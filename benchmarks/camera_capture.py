@@ -0,0 +1,58 @@
+"""Capture latency of a persistent camera session against starting the camera for every frame
+
+The fake backend simulates the start up cost (libcamera initialisation and exposure/white balance
+convergence) and per-frame cost, pass --backend picamera2 on a Raspberry Pi to measure the real camera.
+
+    python benchmarks/camera_capture.py --frames 20 --startup 1.5 --frame 0.2
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from raspberrycam.camera import CameraBackend, FakeBackend, Picamera2Backend, SessionCamera
+
+
+def per_frame_session(backend: CameraBackend, directory: Path, frames: int) -> float:
+    """Opens and closes the camera around every frame, as rpicam-still does"""
+    start = time.perf_counter()
+    for i in range(frames):
+        camera = SessionCamera(1024, 768, backend=backend, manage_power=False)
+        camera.capture_image(directory / f"per_frame_{i}.jpg")
+        camera.power_off()
+    return time.perf_counter() - start
+
+
+def persistent_session(backend: CameraBackend, directory: Path, frames: int) -> float:
+    """Keeps one session open for every frame"""
+    camera = SessionCamera(1024, 768, backend=backend, manage_power=False)
+    start = time.perf_counter()
+    for i in range(frames):
+        camera.capture_image(directory / f"persistent_{i}.jpg")
+    elapsed = time.perf_counter() - start
+    camera.power_off()
+    return elapsed
+
+
+def main(backend_name: str, frames: int, startup: float, frame: float) -> None:
+    if backend_name == "picamera2":
+        backend = Picamera2Backend()
+    else:
+        backend = FakeBackend(startup_seconds=startup, frame_seconds=frame)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Capturing {frames} frames with the {backend_name} backend")
+        for name, func in [("per-frame session", per_frame_session), ("persistent session", persistent_session)]:
+            elapsed = func(backend, Path(tmp), frames)
+            print(f"{name:>18}: {elapsed:.2f}s total, {elapsed / frames * 1000:.1f}ms per frame")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["fake", "picamera2"], default="fake")
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--startup", type=float, default=1.5, help="Simulated seconds to open the camera")
+    parser.add_argument("--frame", type=float, default=0.2, help="Simulated seconds to capture a frame")
+    args = parser.parse_args()
+    main(args.backend, args.frames, args.startup, args.frame)
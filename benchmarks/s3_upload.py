@@ -0,0 +1,69 @@
+"""Per-file upload latency against a local S3 stand-in (moto)
+
+Compares the old behaviour of assuming the role and building a client for every
+file with the cached credentials and client held by S3Manager.
+
+    python benchmarks/s3_upload.py --files 200
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import boto3
+from moto import mock_aws
+
+from raspberrycam.s3 import S3Manager, assume_role, upload_to_s3
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/raspberrycam-uploader"
+BUCKET_NAME = "raspberrycam-benchmark"
+
+
+def per_file_client(images: List[Path]) -> None:
+    """The previous behaviour: a role session and S3 client for every file"""
+    for image in images:
+        credentials = assume_role(ROLE_ARN, "testing", "testing")
+        upload_to_s3(image, BUCKET_NAME, credentials, object_name=f"images/{image.name}")
+
+
+def cached_client(images: List[Path]) -> None:
+    """One S3Manager holding its credentials and client across uploads"""
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    s3.assume_role()
+    for image in images:
+        s3.upload(image, BUCKET_NAME, f"images/{image.name}")
+
+
+def run(name: str, func: Callable[[List[Path]], None], images: List[Path]) -> None:
+    start = time.perf_counter()
+    func(images)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>16}: {elapsed:.2f}s total, {elapsed / len(images) * 1000:.1f}ms per file")
+
+
+def main(files: int, size: int) -> None:
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-2")
+    with mock_aws(), tempfile.TemporaryDirectory() as tmp:
+        boto3.client("s3").create_bucket(
+            Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": os.environ["AWS_DEFAULT_REGION"]}
+        )
+        images = []
+        for i in range(files):
+            image = Path(tmp) / f"image_{i:05d}.jpg"
+            image.write_bytes(os.urandom(size))
+            images.append(image)
+
+        print(f"Uploading {files} files of {size / 1024:.0f}KB")
+        run("per-file client", per_file_client, images)
+        run("cached client", cached_client, images)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--size", type=int, default=200 * 1024)
+    args = parser.parse_args()
+    main(files=args.files, size=args.size)
@@ -0,0 +1,37 @@
+"""Calls per second of FdriScheduler.get_state with and without the sun table
+
+    python benchmarks/scheduler_state.py --seconds 2
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from dateutil.tz import tzlocal
+
+from raspberrycam.location import Location
+from raspberrycam.scheduler import FdriScheduler
+
+
+def calls_per_second(scheduler: FdriScheduler, seconds: float) -> float:
+    """Queries the state every minute through a day until the time runs out"""
+    start_time = datetime(2025, 6, 6, tzinfo=tzlocal())
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        scheduler.get_state(start_time + timedelta(minutes=calls % 1440))
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def main(seconds: float) -> None:
+    for name, cache_size in [("uncached", 0), ("sun table", 32)]:
+        scheduler = FdriScheduler(Location(55.8626453, -3.2031049, cache_size=cache_size))
+        print(f"{name:>10}: {calls_per_second(scheduler, seconds):,.0f} get_state calls per second")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+    main(args.seconds)
@@ -1,20 +1,36 @@
 """This file is run when `python -m raspberrycam` is called"""
 
 import argparse
+import csv
 import logging
 import os
+import sys
+from datetime import date
+from pathlib import Path
+from typing import List, Optional
 
+import yaml
 from dotenv import load_dotenv
 from platformdirs import user_data_dir
 
-from raspberrycam.camera import LibCamera  # UPDATED: Import LibCamera instead of PiCamera
+from raspberrycam.bandwidth import RecompressionPolicy
+from raspberrycam.batching import BatchPolicy
+from raspberrycam.bundle import BundleMember, BundlePolicy, BundleReader
+from raspberrycam.camera import CaptureProfile, LibCamera, SessionCamera
+from raspberrycam.circuit import CircuitBreaker, tcp_probe
 from raspberrycam.config import load_config
 from raspberrycam.core import Raspberrycam
+from raspberrycam.exif import MetadataWriter
+from raspberrycam.filters import FramePipeline
 from raspberrycam.image import S3ImageManager
 from raspberrycam.location import Location
 from raspberrycam.logger import setup_logging
+from raspberrycam.manifest import CaptureManifest
+from raspberrycam.power import DeepSleepPolicy
+from raspberrycam.quota import DiskQuota
 from raspberrycam.s3 import S3Manager
 from raspberrycam.scheduler import FdriScheduler
+from raspberrycam.solar import Site, SitePlan, plan_sites
 
 # Read environment variables for AWS connection
 load_dotenv()
@@ -31,9 +47,29 @@ def main(debug: bool = False, interval: int = 10800) -> None:
         interval = config.interval
 
     location = Location(latitude=config.lat, longitude=config.lon)
-    scheduler = FdriScheduler(location)
-    # UPDATED: Use LibCamera class, set quality and dimensions as desired
-    camera = LibCamera(quality=95, image_width=1024, image_height=768)
+    schedule_offsets = config.schedule_offsets or {}
+    # Learned offsets are kept between runs, and across the nightly shutdown with deep sleep
+    offsets_file = Path(user_data_dir("raspberrycam")) / "schedule_offsets.json"
+    scheduler = FdriScheduler(
+        location, **schedule_offsets, offsets_file=offsets_file if schedule_offsets.get("learn_offsets") else None
+    )
+    if config.camera_backend == "picamera2":
+        # Keeps the camera running between captures
+        camera = SessionCamera(
+            quality=config.image_quality,
+            image_width=config.image_width,
+            image_height=config.image_height,
+            idle_timeout=config.camera_idle_timeout,
+        )
+    else:
+        # Starts rpicam-still for every capture
+        profile = CaptureProfile(**(config.capture_profile or {}))
+        camera = LibCamera(
+            quality=config.image_quality,
+            image_width=config.image_width,
+            image_height=config.image_height,
+            profile=profile,
+        )
 
     # Option to set these in .env - they will load automatically
     # These will fall back to empty strings if they're not set in environment
@@ -43,25 +79,119 @@ def main(debug: bool = False, interval: int = 10800) -> None:
     AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY", "")
 
     s3_manager = S3Manager(
-        role_arn=AWS_ROLE_ARN, access_key_id=AWS_ACCESS_KEY_ID, secret_access_key=AWS_SECRET_ACCESS_KEY
+        role_arn=AWS_ROLE_ARN,
+        access_key_id=AWS_ACCESS_KEY_ID,
+        secret_access_key=AWS_SECRET_ACCESS_KEY,
+        max_pool_connections=max(10, config.upload_workers),
+        # Stop trying while the connection is down, checking S3 can be reached before trying again
+        breaker=CircuitBreaker(probe=lambda: tcp_probe("s3.amazonaws.com")),
     )
     # The other config options form part of the filename
-    image_manager = S3ImageManager(AWS_BUCKET_NAME, s3_manager, user_data_dir("raspberrycam"), config)
+    image_manager = S3ImageManager(
+        AWS_BUCKET_NAME,
+        s3_manager,
+        user_data_dir("raspberrycam"),
+        config,
+        upload_workers=config.upload_workers,
+        recompression=RecompressionPolicy(**config.recompression) if config.recompression is not None else None,
+        thumbnail_width=config.thumbnail_width,
+        quota=DiskQuota(**config.disk_quota) if config.disk_quota is not None else None,
+        bundling=BundlePolicy(**config.bundling) if config.bundling is not None else None,
+        capture_manifest=CaptureManifest(Path(user_data_dir("raspberrycam")) / "manifests")
+        if config.capture_manifest
+        else None,
+    )
 
     log_level = logging.INFO
     if debug:
         log_level = logging.DEBUG
     setup_logging(filename=image_manager.log_file, level=log_level)
     app = Raspberrycam(
-        scheduler=scheduler, camera=camera, image_manager=image_manager, capture_interval=interval, debug=debug
+        scheduler=scheduler,
+        camera=camera,
+        image_manager=image_manager,
+        capture_interval=interval,
+        align_captures=config.align_captures,
+        batch_policy=BatchPolicy(**(config.upload_batch or {})),
+        deep_sleep=DeepSleepPolicy(**config.deep_sleep) if config.deep_sleep is not None else None,
+        frame_pipeline=FramePipeline.from_config(config.frame_filters) if config.frame_filters else None,
+        metadata_writer=MetadataWriter(config, location) if config.embed_metadata else None,
+        memory_capture=config.memory_capture,
+        debug=debug,
     )
     app.run()
 
 
+def plan(
+    sites_file: Optional[str] = None, start: Optional[date] = None, days: int = 365, image_size: float = 200
+) -> None:
+    """Prints the expected daylight hours, captures and data volume for each site as CSV
+
+    Args:
+        sites_file: YAML file with a list of sites under "sites", each with site, lat, lon and interval.
+            Defaults to the site in config/config.yaml
+        start: First day to plan, defaults to today
+        days: Number of days to plan
+        image_size: Expected size of each image in KB
+    """
+    if sites_file:
+        with open(sites_file, "r") as f:
+            sites: List[Site] = yaml.safe_load(f)["sites"]
+    else:
+        config = load_config("config/config.yaml")
+        sites = [{"site": config.site, "lat": config.lat, "lon": config.lon, "interval": config.interval}]
+
+    writer = csv.DictWriter(sys.stdout, fieldnames=list(SitePlan.__annotations__))
+    writer.writeheader()
+    writer.writerows(plan_sites(sites, start or date.today(), days, image_kilobytes=image_size))
+
+
+def read_bundle(object_name: str, output: Optional[str] = None, names: Optional[List[str]] = None) -> None:
+    """Lists the images in an uploaded bundle as CSV, or extracts them, without downloading the whole bundle
+
+    Args:
+        object_name: Key of the bundle in the bucket
+        output: Directory the images are extracted to, lists them if not given
+        names: Filenames of the images to extract, defaults to all of them
+    """
+    s3_manager = S3Manager(
+        role_arn=os.environ.get("AWS_ROLE_ARN", ""),
+        access_key_id=os.environ.get("AWS_ACCESS_KEY_ID", ""),
+        secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY", ""),
+    )
+    s3_manager.assume_role()
+    reader = BundleReader(s3_manager.client, os.environ.get("AWS_BUCKET_NAME", ""), object_name)
+    if output is None:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(BundleMember.__annotations__))
+        writer.writeheader()
+        writer.writerows(reader.manifest()["members"])
+    else:
+        os.makedirs(output, exist_ok=True)
+        for path in reader.extract(Path(output), names):
+            print(path)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--interval", type=int, default=10800)
 
+    subparsers = parser.add_subparsers(dest="command")
+    plan_parser = subparsers.add_parser("plan", help="Estimate daylight, captures and data volume per site")
+    plan_parser.add_argument("--sites", help="YAML file listing the sites, defaults to config/config.yaml")
+    plan_parser.add_argument("--start", type=date.fromisoformat, help="First day as YYYY-MM-DD, defaults to today")
+    plan_parser.add_argument("--days", type=int, default=365)
+    plan_parser.add_argument("--image-size", type=float, default=200, help="Expected image size in KB")
+
+    bundle_parser = subparsers.add_parser("bundle", help="List or extract the images in an uploaded bundle")
+    bundle_parser.add_argument("object_name", help="Key of the bundle in the bucket")
+    bundle_parser.add_argument("--extract", help="Directory the images are extracted to, lists them if not given")
+    bundle_parser.add_argument("--name", action="append", help="Image to extract, can be repeated, defaults to all")
+
     args = parser.parse_args()
-    main(debug=args.debug, interval=args.interval)
+    if args.command == "plan":
+        plan(sites_file=args.sites, start=args.start, days=args.days, image_size=args.image_size)
+    elif args.command == "bundle":
+        read_bundle(args.object_name, output=args.extract, names=args.name)
+    else:
+        main(debug=args.debug, interval=args.interval)
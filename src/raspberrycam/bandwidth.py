@@ -0,0 +1,141 @@
+"""Shrinks the upload backlog to fit a slow uplink, by measuring the throughput uploads
+achieve and recompressing older images so the backlog can be uploaded within a budget"""
+
+import logging
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+from raspberrycam import jpeg
+from raspberrycam.exif import EXIF_HEADER, resize_exif
+from raspberrycam.files import write_atomic
+from raspberrycam.journal import JournalEntry
+
+logger = logging.getLogger(__name__)
+
+
+class ThroughputMeter:
+    """Exponentially weighted moving average of upload throughput"""
+
+    alpha: float
+    """Weight of the newest measurement, from 0 to 1"""
+
+    rate: float | None
+    """Average throughput in bytes per second, None until something has been measured"""
+
+    def __init__(self, alpha: float = 0.3) -> None:
+        """
+        Args:
+            alpha: Weight of the newest measurement, from 0 to 1
+        """
+        self.alpha = alpha
+        self.rate = None
+
+    def record(self, size: int, seconds: float) -> None:
+        """Adds a measurement
+        Args:
+            size: Bytes sent
+            seconds: Time taken to send them
+        """
+        if size <= 0 or seconds <= 0:
+            return
+        rate = size / seconds
+        self.rate = rate if self.rate is None else self.alpha * rate + (1 - self.alpha) * self.rate
+
+
+def recompress_jpeg(image: Path, target_size: int, min_quality: int = 60, min_width: int = 320) -> int | None:
+    """Re-encodes an image to fit a target size, lowering the quality first and then the resolution
+    Args:
+        image: Path of the JPEG, replaced in place
+        target_size: Size in bytes to aim for
+        min_quality: Lowest JPEG quality used
+        min_width: Narrowest the image is scaled down to
+    Returns:
+        The new size in bytes, or None if the image was left alone
+    """
+    data = image.read_bytes()
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return None
+    original_size = len(data)
+
+    encoded = None
+    resized = False
+    for quality in [quality for quality in (85, 75) if quality > min_quality] + [min_quality]:
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok and len(encoded) <= target_size:
+            break
+    else:
+        # JPEG size is roughly proportional to the number of pixels
+        width = frame.shape[1]
+        scale = math.sqrt(target_size / len(encoded)) if len(encoded) else 1.0
+        scaled_width = max(min(min_width, width), round(width * scale))
+        scaled_height = max(1, round(frame.shape[0] * scaled_width / width))
+        frame = cv2.resize(frame, (scaled_width, scaled_height), interpolation=cv2.INTER_AREA)
+        resized = True
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, min_quality])
+
+    if encoded is None:
+        return None
+    try:
+        # The EXIF and XMP segments hold the capture metadata, which re-encoding drops
+        metadata = [data[segment.start : segment.end] for segment in jpeg.find_segments(data, jpeg.APP1, b"")]
+    except ValueError:
+        metadata = []
+    if resized:
+        # The EXIF would still give the dimensions from before scaling down
+        height, width = frame.shape[:2]
+        metadata = [
+            jpeg.app_segment(jpeg.APP1, resize_exif(segment[4:], width, height))
+            if segment[4:].startswith(EXIF_HEADER)
+            else segment
+            for segment in metadata
+        ]
+    recompressed = jpeg.splice(encoded.tobytes(), metadata)
+    if len(recompressed) >= original_size:
+        return None
+    write_atomic(image, recompressed)
+    return len(recompressed)
+
+
+@dataclass
+class RecompressionPolicy:
+    """Decides which backlog images to recompress so the backlog can be uploaded within a time
+    budget at the measured throughput. The newest images are always kept at full quality"""
+
+    budget: float = 3600
+    """Seconds the whole backlog should take to upload"""
+
+    keep_newest: int = 12
+    """Number of the newest images never recompressed"""
+
+    min_quality: int = 60
+    """Lowest JPEG quality used"""
+
+    min_width: int = 320
+    """Narrowest an image is scaled down to"""
+
+    def targets(self, backlog: List[JournalEntry], bytes_per_second: float) -> Dict[Path, int]:
+        """Works out the size each older image needs to shrink to
+        Args:
+            backlog: Images waiting to be uploaded, oldest first
+            bytes_per_second: Measured upload throughput
+        Returns:
+            The target size in bytes of each image that needs recompressing
+        """
+        budget_bytes = bytes_per_second * self.budget
+        total = sum(entry["size"] for entry in backlog)
+        if total <= budget_bytes:
+            return {}
+
+        older = backlog[: max(0, len(backlog) - self.keep_newest)]
+        if not older:
+            return {}
+        newest = total - sum(entry["size"] for entry in older)
+        # The older images share what's left of the budget equally
+        share = max(0.0, budget_bytes - newest) / len(older)
+        return {entry["path"]: int(share) for entry in older if entry["size"] > share}
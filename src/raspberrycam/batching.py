@@ -0,0 +1,85 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, time
+from typing import List, Optional, Tuple
+
+from raspberrycam.journal import BacklogStats
+
+logger = logging.getLogger(__name__)
+
+
+def parse_window(window: str) -> Tuple[time, time]:
+    """Parses an upload window
+    Args:
+        window: A window of local time in the format "HH:MM-HH:MM", may run past midnight
+    Returns:
+        The start and end times
+    """
+    start, end = window.split("-")
+    return time.fromisoformat(start.strip()), time.fromisoformat(end.strip())
+
+
+@dataclass
+class BatchPolicy:
+    """Decides when the backlog is uploaded. An upload starts as soon as any limit is reached,
+    or at any time inside an upload window. With no limits or windows every capture is uploaded"""
+
+    max_images: Optional[int] = None
+    """Upload once this many images are waiting"""
+
+    max_bytes: Optional[int] = None
+    """Upload once the waiting images add up to this many bytes"""
+
+    max_age: Optional[int] = None
+    """Upload once the oldest waiting image is this many seconds old"""
+
+    windows: List[str] = field(default_factory=list)
+    """Periods of local time, as "HH:MM-HH:MM", when the backlog is always uploaded"""
+
+    def __post_init__(self) -> None:
+        self._windows = [parse_window(window) for window in self.windows]
+
+    @property
+    def immediate(self) -> bool:
+        """Whether every capture is uploaded straight away"""
+        return self.max_images is None and self.max_bytes is None and self.max_age is None and not self.windows
+
+    def in_window(self, now: datetime) -> bool:
+        """Checks whether a time is inside an upload window
+        Args:
+            now: The local time to check
+        Returns:
+            True if the time is in any window
+        """
+        current = now.time()
+        for start, end in self._windows:
+            if start <= end and start <= current < end:
+                return True
+            # The window runs past midnight
+            if start > end and (current >= start or current < end):
+                return True
+        return False
+
+    def reason(self, backlog: BacklogStats, now: datetime) -> Optional[str]:
+        """Checks whether the backlog should be uploaded
+        Args:
+            backlog: Summary of the images waiting to be uploaded
+            now: The current time
+        Returns:
+            Why the backlog is due to be uploaded, or None if it isn't
+        """
+        if backlog["images"] == 0:
+            return None
+        if self.immediate:
+            return "new capture"
+        if self.max_images is not None and backlog["images"] >= self.max_images:
+            return f"{backlog['images']} images waiting"
+        if self.max_bytes is not None and backlog["bytes"] >= self.max_bytes:
+            return f"{backlog['bytes'] / 1024:.0f}KB waiting"
+        if self.max_age is not None and backlog["oldest"] is not None:
+            age = now.timestamp() - backlog["oldest"]
+            if age >= self.max_age:
+                return f"oldest image is {age:.0f}s old"
+        if self.in_window(now):
+            return "upload window"
+        return None
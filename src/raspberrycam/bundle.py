@@ -0,0 +1,259 @@
+"""Packs a batch of images into one uncompressed tar archive so a backlog is uploaded as a
+few large objects instead of one request per image. The archive is streamed straight from
+the pending images without writing a copy, and a JSON manifest records the byte offset of
+each image so it can be read back with a ranged GET instead of downloading the bundle"""
+
+import base64
+import hashlib
+import io
+import json
+import logging
+import tarfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, List, TypedDict
+
+from botocore.client import BaseClient
+
+from raspberrycam.journal import JournalEntry
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+"""Name of the manifest inside each bundle, it's the last member"""
+
+
+class BundleMember(TypedDict):
+    """Typed dictionary describing where an image is in a bundle"""
+
+    name: str
+    offset: int
+    """Byte offset of the image data from the start of the bundle"""
+    size: int
+    captured: float
+    sha256: str | None
+
+
+class BundleManifest(TypedDict):
+    """Typed dictionary describing the contents of a bundle"""
+
+    size: int
+    """Size of the whole bundle in bytes"""
+    members: List[BundleMember]
+
+
+@dataclass
+class BundlePolicy:
+    """Decides which pending images are uploaded together in a bundle"""
+
+    period: int = 3600
+    """Images captured in the same period of this many seconds share a bundle"""
+
+    min_images: int = 2
+    """Periods with fewer images than this are uploaded an image at a time"""
+
+    def groups(self, backlog: List[JournalEntry]) -> List[List[JournalEntry]]:
+        """Groups images into bundles by capture time
+        Args:
+            backlog: Images waiting to be uploaded, oldest first
+        Returns:
+            The images in each bundle, oldest first. Images not in a group are left out
+        """
+        periods: Dict[int, List[JournalEntry]] = {}
+        for entry in backlog:
+            periods.setdefault(int(entry["captured"] // self.period), []).append(entry)
+        return [entries for entries in periods.values() if len(entries) >= self.min_images]
+
+
+def _header(name: str, size: int, mtime: float) -> bytes:
+    """Encodes the tar header of a member"""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _padding(size: int) -> bytes:
+    """Zeros that pad member data to a whole tar block"""
+    return bytes(-size % tarfile.BLOCKSIZE)
+
+
+class BundleStream(io.RawIOBase):
+    """Read-only file object producing a tar of the given images, read from disk as it goes.
+    The layout, and so the manifest, is worked out before anything is read, so reading fails
+    if an image no longer matches the size and hash it was journaled with"""
+
+    manifest: BundleManifest
+    """Where each image is in the bundle"""
+
+    changed: Path | None
+    """Image that didn't match its journal entry, if reading failed because of one"""
+
+    def __init__(self, entries: List[JournalEntry]) -> None:
+        """
+        Args:
+            entries: Journal entries of the images, in the order they are added
+        """
+        super().__init__()
+        # Each segment is either bytes or a file copied in whole
+        self._segments: List[bytes | JournalEntry] = []
+        members: List[BundleMember] = []
+        offset = 0
+        for entry in entries:
+            header = _header(entry["path"].name, entry["size"], entry["captured"])
+            self._segments += [header, entry, _padding(entry["size"])]
+            offset += len(header)
+            members.append(
+                {
+                    "name": entry["path"].name,
+                    "offset": offset,
+                    "size": entry["size"],
+                    "captured": entry["captured"],
+                    "sha256": entry["sha256"],
+                }
+            )
+            offset += entry["size"] + len(_padding(entry["size"]))
+
+        manifest = json.dumps(members).encode()
+        header = _header(MANIFEST_NAME, len(manifest), max((entry["captured"] for entry in entries), default=0))
+        self._segments += [header, manifest, _padding(len(manifest))]
+        offset += len(header) + len(manifest) + len(_padding(len(manifest)))
+        # The end of archive marker, padded to a whole record like tarfile writes
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(offset + end) % tarfile.RECORDSIZE
+        self._segments.append(bytes(end))
+        self.manifest = {"size": offset + end, "members": members}
+
+        self.changed = None
+        self._index = 0
+        self._position = 0
+        self._file: BinaryIO | None = None
+        self._hash = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: bytearray) -> int:
+        view = memoryview(buffer)
+        while self._index < len(self._segments):
+            segment = self._segments[self._index]
+            if isinstance(segment, bytes):
+                count = min(len(view), len(segment) - self._position)
+                view[:count] = segment[self._position : self._position + count]
+            else:
+                if self._file is None:
+                    self._file = open(segment["path"], "rb")
+                    self._hash = hashlib.sha256()
+                count = self._file.readinto(view[: segment["size"] - self._position])
+                if count == 0 and self._position < segment["size"]:
+                    self._fail(segment, "is smaller than")
+                self._hash.update(view[:count])
+            self._position += count
+            if self._position == self._segment_size(segment):
+                if not isinstance(segment, bytes):
+                    self._verify(segment)
+                self._next_segment()
+            if count:
+                return count
+        return 0
+
+    def _verify(self, entry: JournalEntry) -> None:
+        """Checks an image that has been read in whole still matches its journal entry"""
+        assert self._file is not None
+        if self._file.read(1):
+            self._fail(entry, "is larger than")
+        if entry["sha256"] and base64.b64encode(self._hash.digest()).decode() != entry["sha256"]:
+            self._fail(entry, "doesn't have the hash of")
+
+    def _fail(self, entry: JournalEntry, reason: str) -> None:
+        self.changed = entry["path"]
+        raise IOError(f"{entry['path']} {reason} when it was journaled, so the bundle is invalid")
+
+    def _segment_size(self, segment: bytes | JournalEntry) -> int:
+        return len(segment) if isinstance(segment, bytes) else segment["size"]
+
+    def _next_segment(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._index += 1
+        self._position = 0
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
+
+
+class BundleReader:
+    """Reads images out of an uploaded bundle with ranged GETs, using its manifest"""
+
+    client: BaseClient
+    bucket_name: str
+    object_name: str
+    """Key of the bundle"""
+
+    def __init__(self, client: BaseClient, bucket_name: str, object_name: str) -> None:
+        """
+        Args:
+            client: S3 client
+            bucket_name: Name of the S3 bucket (Not the arn)
+            object_name: Key of the bundle
+        """
+        self.client = client
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self._manifest: BundleManifest | None = None
+
+    def manifest(self) -> BundleManifest:
+        """Downloads the manifest uploaded next to the bundle
+        Returns:
+            Where each image is in the bundle
+        """
+        if self._manifest is None:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=manifest_key(self.object_name))
+            self._manifest = json.loads(response["Body"].read())
+        return self._manifest
+
+    def read(self, name: str) -> bytes:
+        """Downloads one image from the bundle
+        Args:
+            name: Filename of the image
+        Returns:
+            Contents of the image
+        """
+        for member in self.manifest()["members"]:
+            if member["name"] == name:
+                byte_range = f"bytes={member['offset']}-{member['offset'] + member['size'] - 1}"
+                response = self.client.get_object(Bucket=self.bucket_name, Key=self.object_name, Range=byte_range)
+                return response["Body"].read()
+        raise KeyError(f"{name} isn't in {self.object_name}")
+
+    def extract(self, directory: Path, names: List[str] | None = None) -> List[Path]:
+        """Downloads images from the bundle into a directory
+        Args:
+            directory: Where the images are written
+            names: Filenames of the images, defaults to all of them
+        Returns:
+            Paths of the written images
+        """
+        if names is None:
+            names = [member["name"] for member in self.manifest()["members"]]
+        paths = []
+        for name in names:
+            path = Path(directory) / Path(name).name
+            path.write_bytes(self.read(name))
+            paths.append(path)
+        return paths
+
+
+def manifest_key(object_name: str) -> str:
+    """Gets the key the manifest of a bundle is uploaded to
+    Args:
+        object_name: Key of the bundle
+    Returns:
+        The key with a .json extension instead of .tar
+    """
+    return str(Path(object_name).with_suffix(".json"))
@@ -1,13 +1,48 @@
+import io
 import logging
 import os
 import subprocess
+import threading
+import time
 from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
 from pathlib import Path
+from typing import Any, Callable, Dict, List, TypeVar
 
-from picamzero import Camera
+# The camera libraries are only available on a Raspberry Pi
+try:
+    from libcamera import Transform
+    from picamera2 import Picamera2
+    from picamzero import Camera
+except ImportError:
+    Camera = Picamera2 = Transform = None
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+def load_camera_module() -> None:
+    """Loads the camera kernel module"""
+
+    try:
+        logger.info("Ensuring camera module is on")
+        subprocess.run(["sudo", "modprobe", "bcm2835-v4l2"], check=False)
+    except Exception as e:
+        logger.error(f"Failed to turn on camera: {e}")
+
+
+def unload_camera_module() -> None:
+    """Unloads the camera kernel modules"""
+
+    try:
+        if os.path.exists("/sys/module/bcm2835_v4l2"):
+            logger.info("Turning off camera module")
+            subprocess.run(["sudo", "rmmod", "bcm2835-v4l2"], check=False)
+            subprocess.run(["sudo", "rmmod", "bcm2835-isp"], check=False)
+    except Exception as e:
+        logger.error(f"Failed to turn off camera: {e}")
+
 
 class CameraInterface(ABC):
     """Abstract implementation of a camera."""
@@ -27,6 +62,13 @@ class CameraInterface(ABC):
         self.image_width = image_width
         self.image_height = image_height
 
+    def settings(self) -> Dict[str, Any]:
+        """Describes the settings the camera captures with, recorded with each image
+        Returns:
+            The settings by name, only those that are set
+        """
+        return {"width": self.image_width, "height": self.image_height}
+
     @abstractmethod
     def capture_image(self, filepath: Path, vflip: bool = True, hflip: bool = True) -> None:
         """Abstract method defined for capturing an image with the camera
@@ -38,7 +80,22 @@ class CameraInterface(ABC):
         """
 
 
-class DebugCamera(CameraInterface):
+class InMemoryCamera(CameraInterface):
+    """A camera that can also capture straight to memory"""
+
+    @abstractmethod
+    def capture_bytes(self, vflip: bool = True, hflip: bool = True) -> bytes | None:
+        """Captures an image as JPEG bytes without writing it to disk
+
+        Args:
+            vflip: Whether to flip the image vertically (upside down)
+            hflip: Whether to flip the image horizontally (mirror)
+        Returns:
+            The encoded image, or None if the capture failed
+        """
+
+
+class DebugCamera(InMemoryCamera):
     "Debug camera class used for end to end testing"
 
     def capture_image(self, filepath: Path, vflip: bool = False, hflip: bool = False) -> None:
@@ -74,6 +131,15 @@ class DebugCamera(CameraInterface):
         except Exception as e:
             logger.exception("Failed to write image", exc_info=e)
 
+    def capture_bytes(self, vflip: bool = False, hflip: bool = False) -> bytes | None:
+        """Captures a fake image in memory
+        Args:
+            vflip: Whether to flip the image vertically, defaults to False
+            hflip: Whether to flip the image horizontally, defaults to False
+        """
+        logger.info("Capturing image in memory")
+        return b"Pretend I'm an image"
+
 
 class PiCamera(CameraInterface):
     """Implementation for a Rasberry Pi camera module"""
@@ -113,18 +179,111 @@ class PiCamera(CameraInterface):
             logger.exception("Failed to write image", exc_info=e)
 
 
-class LibCamera(CameraInterface):
+@dataclass
+class CaptureProfile:
+    """Timing and processing options for rpicam-still, trading exposure convergence
+    against capture time. Options left as None use the rpicam-still defaults"""
+
+    timeout: int | None = None
+    """Milliseconds the camera runs before capturing, rpicam-still waits 5000 by default"""
+
+    immediate: bool = False
+    """Capture as soon as the camera starts, skipping the preview phase"""
+
+    nopreview: bool = False
+    """Don't open a preview window"""
+
+    shutter: int | None = None
+    """Fixed shutter speed in microseconds, locks the exposure"""
+
+    gain: float | None = None
+    """Fixed analogue gain, locks the gain"""
+
+    awb: str | None = None
+    """Auto white balance mode, e.g. daylight or cloudy"""
+
+    awbgains: str | None = None
+    """Fixed red and blue gains as "red,blue", locks the white balance"""
+
+    denoise: str | None = None
+    """Denoise mode, one of auto, off, cdn_off, cdn_fast or cdn_hq"""
+
+    encoding: str | None = None
+    """Output encoding, one of jpg, png, bmp, rgb or yuv420"""
+
+    def to_args(self) -> List[str]:
+        """Builds the rpicam-still arguments for this profile
+        Returns:
+            A list of command line arguments
+        """
+        args = []
+        if self.timeout is not None:
+            args += ["--timeout", str(self.timeout)]
+        if self.immediate:
+            args.append("--immediate")
+        if self.nopreview:
+            args.append("--nopreview")
+        for option in ["shutter", "gain", "awb", "awbgains", "denoise", "encoding"]:
+            value = getattr(self, option)
+            if value is not None:
+                args += [f"--{option}", str(value)]
+        return args
+
+
+class LibCamera(InMemoryCamera):
     quality: int
     """Image quality from 1-100"""
 
-    def __init__(self, quality: int, *args, **kwargs) -> None:
+    profile: CaptureProfile
+    """Timing and processing options for each capture"""
+
+    last_capture_seconds: float | None
+    """Wall time of the most recent capture in seconds"""
+
+    def __init__(self, quality: int, *args, profile: CaptureProfile | None = None, **kwargs) -> None:
         """
         Args:
             quality: The camera quality from 1-100
+            profile: Timing and processing options, defaults to the rpicam-still defaults
         """
         super().__init__(*args, **kwargs)
 
         self.quality = quality
+        self.profile = profile if profile is not None else CaptureProfile()
+        self.last_capture_seconds = None
+
+    def settings(self) -> Dict[str, Any]:
+        profile = {name: value for name, value in asdict(self.profile).items() if value not in (None, False)}
+        return {**super().settings(), "quality": self.quality, **profile}
+
+    def _command(self, output: str | Path, vflip: bool, hflip: bool) -> List[str | Path]:
+        """Builds the rpicam-still command
+        Args:
+            output: The output destination, "-" writes to stdout
+            vflip: Whether to flip the image vertically
+            hflip: Whether to flip the image horizontally
+        Returns:
+            The command and its arguments
+        """
+        cmd = [
+            "rpicam-still",
+            "--width",
+            str(self.image_width),
+            "--height",
+            str(self.image_height),
+            "--quality",
+            str(self.quality),
+            "-o",
+            output,
+            *self.profile.to_args(),
+        ]
+
+        # Add flip parameters if requested
+        if vflip:
+            cmd.append("--vflip")
+        if hflip:
+            cmd.append("--hflip")
+        return cmd
 
     def capture_image(self, filepath: Path, vflip: bool = True, hflip: bool = True) -> None:
         """Captures an image and writes it to file
@@ -144,50 +303,289 @@ class LibCamera(CameraInterface):
             flip_text = f"({', '.join(flip_description)})" if flip_description else ""
             logger.info(f"Capturing image{flip_text}")
 
-            cmd = [
-                "rpicam-still",
-                "--width",
-                str(self.image_width),
-                "--height",
-                str(self.image_height),
-                "--quality",
-                str(self.quality),
-                "-o",
-                filepath,
-            ]
-
-            # Add flip parameters if requested
-            if vflip:
-                cmd.append("--vflip")
-            if hflip:
-                cmd.append("--hflip")
-
-            subprocess.call(cmd)
+            start = time.monotonic()
+            subprocess.call(self._command(filepath, vflip, hflip))
+            self.last_capture_seconds = time.monotonic() - start
 
             if os.path.exists(filepath):
                 file_size = os.path.getsize(filepath) / 1024  # KB
-                logger.info(f"Image captured: {filepath} ({file_size:.2f}KB)")
+                logger.info(f"Image captured: {filepath} ({file_size:.2f}KB) in {self.last_capture_seconds:.2f}s")
             else:
                 logger.error("Image capture failed: file not created")
         except Exception as e:
             logger.error(f"Error capturing image: {e}")
 
-    def power_on(self) -> None:
-        """Turns on the physical camera"""
-
+    def capture_bytes(self, vflip: bool = True, hflip: bool = True) -> bytes | None:
+        """Captures an image with rpicam-still writing the JPEG to stdout
+        Args:
+            vflip: Whether to flip the image vertically, defaults to True
+            hflip: Whether to flip the image horizontally, defaults to True
+        Returns:
+            The encoded image, or None if the capture failed
+        """
         try:
-            logger.info("Ensuring camera module is on")
-            subprocess.run(["sudo", "modprobe", "bcm2835-v4l2"], check=False)
+            start = time.monotonic()
+            result = subprocess.run(self._command("-", vflip, hflip), capture_output=True, check=False)
+            self.last_capture_seconds = time.monotonic() - start
+            if result.returncode or not result.stdout:
+                logger.error(f"Image capture failed: {result.stderr.decode(errors='replace').strip()}")
+                return None
+            logger.info(
+                f"Image captured in memory ({len(result.stdout) / 1024:.2f}KB) in {self.last_capture_seconds:.2f}s"
+            )
+            return result.stdout
         except Exception as e:
-            logger.error(f"Failed to turn on camera: {e}")
+            logger.error(f"Error capturing image: {e}")
+            return None
+
+    def power_on(self) -> None:
+        """Turns on the physical camera"""
+        load_camera_module()
 
     def power_off(self) -> None:
         """Turns off the physical camera"""
+        unload_camera_module()
+
 
+class CameraBackend(ABC):
+    """A camera session that can stay open between captures"""
+
+    @abstractmethod
+    def open(self, image_width: int, image_height: int, quality: int, vflip: bool, hflip: bool) -> None:
+        """Opens and configures the camera, including exposure and white balance convergence
+        Args:
+            image_width: Width of image in pixels.
+            image_height: Height of image in pixels.
+            quality: JPEG quality from 1-100
+            vflip: Whether to flip the image vertically
+            hflip: Whether to flip the image horizontally
+        """
+
+    @abstractmethod
+    def capture(self, filepath: Path) -> None:
+        """Captures a frame from the open session to a JPEG file
+        Args:
+            filepath: The output destination
+        """
+
+    @abstractmethod
+    def capture_bytes(self) -> bytes:
+        """Captures a frame from the open session as JPEG bytes
+        Returns:
+            The encoded frame
+        """
+
+    @abstractmethod
+    def close(self) -> None:
+        """Closes the session and releases the camera"""
+
+
+class Picamera2Backend(CameraBackend):
+    """Camera session using picamera2, the camera keeps running between captures"""
+
+    _camera: Any = None
+
+    def open(self, image_width: int, image_height: int, quality: int, vflip: bool, hflip: bool) -> None:
+        if Picamera2 is None:
+            raise RuntimeError("picamera2 is not available on this machine")
+
+        self._camera = Picamera2()
+        config = self._camera.create_still_configuration(
+            main={"size": (image_width, image_height)}, transform=Transform(vflip=vflip, hflip=hflip)
+        )
+        self._camera.configure(config)
+        self._camera.options["quality"] = quality
+        self._camera.start()
+
+    def capture(self, filepath: Path) -> None:
+        self._camera.capture_file(str(filepath))
+
+    def capture_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        self._camera.capture_file(buffer, format="jpeg")
+        return buffer.getvalue()
+
+    def close(self) -> None:
+        if self._camera is not None:
+            self._camera.stop()
+            self._camera.close()
+            self._camera = None
+
+
+class FakeBackend(CameraBackend):
+    """Camera session that simulates the cost of starting the camera and capturing a frame,
+    used to benchmark capture overhead off the device"""
+
+    startup_seconds: float
+    """Time taken to open the camera and converge exposure"""
+
+    frame_seconds: float
+    """Time taken to capture and encode one frame"""
+
+    opens: int
+    """Number of times the session has been opened"""
+
+    def __init__(self, startup_seconds: float = 0.0, frame_seconds: float = 0.0) -> None:
+        """
+        Args:
+            startup_seconds: Time taken to open the camera and converge exposure
+            frame_seconds: Time taken to capture and encode one frame
+        """
+        self.startup_seconds = startup_seconds
+        self.frame_seconds = frame_seconds
+        self.opens = 0
+        self.is_open = False
+
+    def open(self, image_width: int, image_height: int, quality: int, vflip: bool, hflip: bool) -> None:
+        time.sleep(self.startup_seconds)
+        self.opens += 1
+        self.is_open = True
+
+    def capture(self, filepath: Path) -> None:
+        with open(filepath, "wb") as f:
+            f.write(self.capture_bytes())
+
+    def capture_bytes(self) -> bytes:
+        if not self.is_open:
+            raise RuntimeError("Camera session is not open")
+        time.sleep(self.frame_seconds)
+        # Start and end of image markers, enough to pass as an empty JPEG
+        return b"\xff\xd8\xff\xd9"
+
+    def close(self) -> None:
+        self.is_open = False
+
+
+class SessionCamera(InMemoryCamera):
+    """Camera that keeps one configured session open across captures instead of
+    starting the camera for every frame"""
+
+    backend: CameraBackend
+    """The camera session implementation"""
+
+    quality: int
+    """Image quality from 1-100"""
+
+    idle_timeout: float | None
+    """Seconds without a capture before the camera is powered off, None keeps it on"""
+
+    manage_power: bool
+    """Whether powering off also unloads the camera kernel module"""
+
+    def __init__(
+        self,
+        *args,
+        backend: CameraBackend | None = None,
+        quality: int = 95,
+        idle_timeout: float | None = None,
+        manage_power: bool = True,
+        **kwargs,
+    ) -> None:
+        """
+        Args:
+            backend: The camera session implementation, defaults to picamera2
+            quality: The camera quality from 1-100
+            idle_timeout: Seconds without a capture before the camera is powered off
+            manage_power: Whether powering off also unloads the camera kernel module
+        """
+        super().__init__(*args, **kwargs)
+        self.backend = backend if backend is not None else Picamera2Backend()
+        self.quality = quality
+        self.idle_timeout = idle_timeout
+        self.manage_power = manage_power
+
+        self._lock = threading.Lock()
+        self._flips: tuple[bool, bool] | None = None
+        self._idle_timer: threading.Timer | None = None
+        self._unloaded = False
+
+    def settings(self) -> Dict[str, Any]:
+        return {**super().settings(), "quality": self.quality}
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the camera session is currently open"""
+        return self._flips is not None
+
+    def capture_image(self, filepath: Path, vflip: bool = True, hflip: bool = True) -> None:
+        """Captures an image from the open session and writes it to file, opening it if needed
+        Args:
+            filepath: The output destination
+            vflip: Whether to flip the image vertically, defaults to False
+            hflip: Whether to flip the image horizontally, defaults to False
+        """
+        self._capture(lambda: self.backend.capture(filepath), vflip, hflip, str(filepath))
+
+    def capture_bytes(self, vflip: bool = True, hflip: bool = True) -> bytes | None:
+        """Captures an image from the open session as JPEG bytes, opening it if needed
+        Args:
+            vflip: Whether to flip the image vertically, defaults to True
+            hflip: Whether to flip the image horizontally, defaults to True
+        Returns:
+            The encoded image, or None if the capture failed
+        """
+        return self._capture(self.backend.capture_bytes, vflip, hflip, "memory")
+
+    def _capture(self, capture: Callable[[], T], vflip: bool, hflip: bool, destination: str) -> T | None:
+        """Runs a capture from the open session, opening it if needed
+        Args:
+            capture: Captures a frame from the backend
+            vflip: Whether to flip the image vertically
+            hflip: Whether to flip the image horizontally
+            destination: Where the frame goes, for logging
+        Returns:
+            The result of the capture, or None if it failed
+        """
         try:
-            if os.path.exists("/sys/modules/bcm2835_v4l2"):
-                logger.info("Turning off camera module")
-                subprocess.run(["sudo", "rmmod", "bcm2835-v4l2"], check=False)
-                subprocess.run(["sudo", "rmmod", "bcm2835-isp"], check=False)
+            with self._lock:
+                if self._idle_timer:
+                    self._idle_timer.cancel()
+
+                if self._flips != (vflip, hflip):
+                    # Flips are part of the session configuration
+                    self._close()
+                    if self._unloaded:
+                        # Powered off while idle, the modules have to be back before the camera opens
+                        load_camera_module()
+                        self._unloaded = False
+                    logger.info("Opening camera session")
+                    self.backend.open(self.image_width, self.image_height, self.quality, vflip, hflip)
+                    self._flips = (vflip, hflip)
+
+                start = time.monotonic()
+                result = capture()
+                logger.info(f"Image captured: {destination} in {time.monotonic() - start:.3f}s")
+
+                if self.idle_timeout is not None:
+                    self._idle_timer = threading.Timer(self.idle_timeout, self.power_off)
+                    self._idle_timer.daemon = True
+                    self._idle_timer.start()
+                return result
         except Exception as e:
-            logger.error(f"Failed to turn off camera: {e}")
+            logger.error(f"Error capturing image: {e}")
+            return None
+
+    def _close(self) -> None:
+        """Closes the session if it is open, the lock must be held"""
+        if self.is_open:
+            logger.info("Closing camera session")
+            self.backend.close()
+            self._flips = None
+
+    def power_on(self) -> None:
+        """Turns on the physical camera, the session is opened on the next capture"""
+        if self.manage_power:
+            with self._lock:
+                load_camera_module()
+                self._unloaded = False
+
+    def power_off(self) -> None:
+        """Closes the session and turns off the physical camera"""
+        with self._lock:
+            if self._idle_timer:
+                self._idle_timer.cancel()
+            self._close()
+            # Under the lock so a capture can't open the session while the modules are unloaded
+            if self.manage_power:
+                unload_camera_module()
+                self._unloaded = True
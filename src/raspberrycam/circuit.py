@@ -0,0 +1,166 @@
+import logging
+import random
+import socket
+import threading
+import time
+from enum import StrEnum
+from typing import Callable, Optional, TypedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(StrEnum):
+    """Enum for the states of a circuit breaker"""
+
+    CLOSED = "closed"
+    """Requests are made as normal"""
+    OPEN = "open"
+    """Requests are skipped until the backoff has passed"""
+    HALF_OPEN = "half_open"
+    """The backoff has passed and a single trial request decides whether to close again"""
+
+
+class CircuitSnapshot(TypedDict):
+    """Typed dictionary of the circuit breaker state for logging and metrics"""
+
+    state: CircuitState
+    failures: int
+    retry_in: float
+
+
+def tcp_probe(host: str, port: int = 443, timeout: float = 3.0) -> bool:
+    """Cheaply checks whether a host can be reached by opening a TCP connection
+    Args:
+        host: Host name to connect to
+        port: Port to connect to
+        timeout: Seconds to wait for the connection
+    Returns:
+        True if the connection was made
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class CircuitBreaker:
+    """Stops network requests after a failure and backs off exponentially, with jitter,
+    before probing the connection and trying again with a single trial request"""
+
+    base_delay: float
+    """Seconds to wait after the first failure"""
+
+    max_delay: float
+    """Longest wait between attempts in seconds"""
+
+    jitter: float
+    """Fraction of the delay that is randomised so devices don't retry in step"""
+
+    probe: Optional[Callable[[], bool]]
+    """Cheap connectivity check made before leaving the open state"""
+
+    trial_timeout: float
+    """Seconds before a trial request that never reported back is given up on and another is let through"""
+
+    state: CircuitState
+    """The current state"""
+
+    failures: int
+    """Number of consecutive failures"""
+
+    def __init__(
+        self,
+        base_delay: float = 30.0,
+        max_delay: float = 3600.0,
+        jitter: float = 0.25,
+        probe: Optional[Callable[[], bool]] = None,
+        trial_timeout: float = 600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        Args:
+            base_delay: Seconds to wait after the first failure
+            max_delay: Longest wait between attempts in seconds
+            jitter: Fraction of the delay that is randomised
+            probe: Cheap connectivity check made before leaving the open state
+            trial_timeout: Seconds before a trial request that never reported back is given up on
+            clock: Monotonic clock in seconds
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.probe = probe
+        self.trial_timeout = trial_timeout
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self._clock = clock
+        self._retry_at = 0.0
+        self._trial_thread: int | None = None
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Checks whether a request should be made. Once the backoff has passed only one thread
+        is let through to make the trial request, the same thread can check again as it makes it
+        Returns:
+            True if the circuit is closed, or this thread is making the trial request
+        """
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.HALF_OPEN:
+                if self._trial_thread == threading.get_ident():
+                    return True
+                if self._clock() < self._trial_started + self.trial_timeout:
+                    return False
+                logger.warning("Trial request never finished, letting another through")
+            elif self._clock() < self._retry_at:
+                return False
+            if self.probe is not None and not self.probe():
+                logger.info("Connectivity probe failed, staying offline")
+                self._open()
+                return False
+            logger.info("Backoff passed, trying the connection again")
+            self.state = CircuitState.HALF_OPEN
+            self._trial_thread = threading.get_ident()
+            self._trial_started = self._clock()
+            return True
+
+    def record_success(self) -> None:
+        """Records a successful request, closing the circuit"""
+        with self._lock:
+            if self.state != CircuitState.CLOSED:
+                logger.info(f"Connection restored after {self.failures} failures")
+            self.state = CircuitState.CLOSED
+            self.failures = 0
+            self._trial_thread = None
+
+    def record_failure(self) -> None:
+        """Records a failed request, opening the circuit. Requests that were already in flight
+        when it opened, such as the rest of a parallel batch, don't add to the backoff"""
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                return
+            if self.state == CircuitState.HALF_OPEN and self._trial_thread != threading.get_ident():
+                return
+            self._open()
+
+    def _open(self) -> None:
+        """Opens the circuit with the next backoff delay, the lock must be held"""
+        self._trial_thread = None
+        self.failures += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self._retry_at = self._clock() + delay
+        self.state = CircuitState.OPEN
+        logger.warning(f"Connection failed {self.failures} times, backing off for {delay:.0f}s")
+
+    def snapshot(self) -> CircuitSnapshot:
+        """Gets the current state for logging and metrics
+        Returns:
+            A dictionary of the state, consecutive failures and seconds until the next attempt
+        """
+        with self._lock:
+            retry_in = max(0.0, self._retry_at - self._clock()) if self.state == CircuitState.OPEN else 0.0
+            return {"state": self.state, "failures": self.failures, "retry_in": retry_in}
@@ -13,6 +13,25 @@ class Config:
     catchment: str
     direction: str
     interval: int
+    image_width: int = 1024
+    image_height: int = 768
+    image_quality: int = 95
+    thumbnail_width: Optional[int] = None
+    upload_workers: int = 1
+    align_captures: bool = False
+    camera_backend: str = "rpicam-still"
+    memory_capture: bool = False
+    camera_idle_timeout: Optional[float] = None
+    capture_profile: Optional[dict] = None
+    upload_batch: Optional[dict] = None
+    deep_sleep: Optional[dict] = None
+    frame_filters: Optional[dict] = None
+    schedule_offsets: Optional[dict] = None
+    recompression: Optional[dict] = None
+    disk_quota: Optional[dict] = None
+    bundling: Optional[dict] = None
+    capture_manifest: bool = False
+    embed_metadata: bool = False
 
 
 class ConfigurationError(Exception):
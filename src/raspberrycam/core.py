@@ -1,16 +1,29 @@
 import logging
+import queue
+import threading
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
 
 from dateutil.tz import tzlocal
 
 from raspberrycam import raspberrypi
-from raspberrycam.camera import CameraInterface
-from raspberrycam.image import S3ImageManager
-from raspberrycam.scheduler import FdriScheduler, ScheduleState
+from raspberrycam.batching import BatchPolicy
+from raspberrycam.camera import CameraInterface, InMemoryCamera
+from raspberrycam.exif import MetadataWriter
+from raspberrycam.files import commit, staging_path, write_atomic
+from raspberrycam.filters import FrameAction, FramePipeline
+from raspberrycam.image import InMemoryImage, S3ImageManager
+from raspberrycam.metadata import CaptureMetadata, make_metadata
+from raspberrycam.power import DeepSleepPolicy, PowerBackend, RaspberryPiPower
+from raspberrycam.scheduler import FdriScheduler, JitterStats, ScheduleState, next_capture_time
 
 logger = logging.getLogger(__name__)
 
+_FLUSH = object()
+"""Upload queue item asking for everything waiting to be uploaded regardless of the batch policy"""
+
 
 class Raspberrycam:
     """Core class for managing a RasberryPi camera deployment"""
@@ -24,9 +37,48 @@ class Raspberrycam:
     capture_interval: int
     """Frequency of image captures in seconds"""
 
+    align_captures: bool
+    """Capture at a fixed rate on wall-clock boundaries rather than waiting capture_interval after each capture"""
+
+    jitter: JitterStats
+    """How late aligned captures start compared to their slot"""
+
     image_manager: S3ImageManager
     """Image manager used to manipulate image files"""
 
+    upload_queue: "queue.Queue[Path | InMemoryImage | object | None]"
+    """Captured images waiting for the upload thread"""
+
+    memory_capture: bool
+    """Capture to memory and upload straight away, only writing images that can't be uploaded to disk"""
+
+    enqueue_timeout: float
+    """Seconds a capture waits for space in a full upload queue before leaving the image on disk"""
+
+    batch_policy: BatchPolicy
+    """Decides when the waiting images are uploaded"""
+
+    batch_check_interval: float
+    """Seconds between checks of the batch policy while images are waiting and nothing is captured"""
+
+    radio_on_seconds: float
+    """Total time spent uploading batches"""
+
+    deep_sleep: DeepSleepPolicy | None
+    """Decides whether to halt overnight and wake with the RTC, None stays on all night"""
+
+    power: PowerBackend
+    """Power controls used for deep sleep"""
+
+    governor: raspberrypi.GovernorController
+    """Controls the CPU governor, which is only raised to performance while uploading"""
+
+    frame_pipeline: FramePipeline | None
+    """Checks each captured frame before it's queued for upload, None keeps every frame"""
+
+    metadata_writer: MetadataWriter | None
+    """Embeds the capture metadata into each image, None leaves images as the camera wrote them"""
+
     _intervals_since_last_upload: int
     """Tracks how many images have been captured since the last upload,
         Allows the app to bulk upload images"""
@@ -37,7 +89,17 @@ class Raspberrycam:
         camera: CameraInterface,
         image_manager: S3ImageManager,
         capture_interval: int = 300,
-        sleep_interval: int = 300,
+        upload_queue_size: int = 100,
+        enqueue_timeout: float = 5.0,
+        align_captures: bool = False,
+        batch_policy: BatchPolicy | None = None,
+        batch_check_interval: float = 60.0,
+        deep_sleep: DeepSleepPolicy | None = None,
+        power: PowerBackend | None = None,
+        governor: raspberrypi.GovernorController | None = None,
+        frame_pipeline: FramePipeline | None = None,
+        metadata_writer: MetadataWriter | None = None,
+        memory_capture: bool = False,
         debug: bool = False,
     ) -> None:
         """
@@ -45,62 +107,423 @@ class Raspberrycam:
             scheduler: The scheduler used to control the RasberryPi state
             camera: The camera interface used
             image_manager: The image management object
+            upload_queue_size: Maximum number of captured images waiting to be uploaded
+            enqueue_timeout: Seconds to wait for space in a full upload queue
+            align_captures: Capture on wall-clock multiples of capture_interval, skipping missed slots
+            batch_policy: Decides when the waiting images are uploaded, defaults to after every capture
+            batch_check_interval: Seconds between checks of the batch policy while nothing is captured
+            deep_sleep: Decides whether to halt overnight, None stays on all night
+            power: Power controls used for deep sleep, defaults to the Raspberry Pi's
+            governor: Controls the CPU governor, defaults to the Raspberry Pi's
+            frame_pipeline: Checks each captured frame before it's queued, None keeps every frame
+            metadata_writer: Embeds the capture metadata into each image, None leaves them as they are
+            memory_capture: Capture to memory and upload straight away, only used without a batch policy
             debug: Flag to activate debug mode
         """
         self.scheduler = scheduler
         self.camera = camera
         self.capture_interval = capture_interval
-        self.sleep_interval = sleep_interval
         self.image_manager = image_manager
+        self.upload_queue = queue.Queue(maxsize=upload_queue_size)
+        self.enqueue_timeout = enqueue_timeout
+        self.align_captures = align_captures
+        self.jitter = JitterStats(capture_interval)
+        self._last_slot: datetime | None = None
+        self.batch_policy = batch_policy if batch_policy is not None else BatchPolicy()
+        self.batch_check_interval = batch_check_interval
+        self.radio_on_seconds = 0.0
+        self.deep_sleep = deep_sleep
+        self.power = power if power is not None else RaspberryPiPower(debug=debug)
+        self.governor = governor if governor is not None else raspberrypi.GovernorController(debug=debug)
+        self.frame_pipeline = frame_pipeline
+        self.metadata_writer = metadata_writer
+        self.memory_capture = memory_capture
+        if memory_capture and not isinstance(camera, InMemoryCamera):
+            logger.warning(f"Capturing to disk, {type(camera).__name__} can't capture to memory")
+            self.memory_capture = False
+        elif memory_capture and not self.batch_policy.immediate:
+            # Waiting for a batch would hold images in memory for hours
+            logger.warning("Capturing to disk, memory capture can't be used with an upload batch policy")
+            self.memory_capture = False
+        self._flushed = threading.Event()
+        self._woken_at: datetime | None = None
         self._intervals_since_last_upload = 0
         self.debug = debug
 
+        self._stop_event = threading.Event()
+        self._overflow = threading.Event()
+        self._upload_thread: threading.Thread | None = None
+
+    def start_uploader(self) -> None:
+        """Starts the background thread that uploads captured images"""
+        if self._upload_thread and self._upload_thread.is_alive():
+            return
+        self._upload_thread = threading.Thread(target=self._upload_worker, name="uploader", daemon=True)
+        self._upload_thread.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stops the main loop and the upload thread once it has finished its current batch
+        Args:
+            timeout: Seconds to wait for the upload thread to finish
+        """
+        self._stop_event.set()
+        if self._upload_thread:
+            try:
+                self.upload_queue.put_nowait(None)
+            except queue.Full:
+                # The upload thread sees the stop event once it drains the queue
+                pass
+            self._upload_thread.join(timeout)
+
+    def capture(self) -> Path | InMemoryImage | None:
+        """Captures an image and hands it to the upload thread
+        Returns:
+            The path of the new image, the image itself when capturing to memory, or None if
+            the capture failed or the frame was dropped
+        """
+        if self.memory_capture:
+            return self._capture_to_memory()
+        captured_at = datetime.now(timezone.utc)
+        image = self.image_manager.get_pending_image_path(captured_at)
+        # The camera writes to a hidden staging file that is renamed once it's complete
+        staging = staging_path(image)
+        # Flip the image vertically since the camera is mounted upside down
+        self.camera.capture_image(staging, vflip=True, hflip=True)
+        if not staging.exists():
+            return None
+        if self.frame_pipeline is not None:
+            verdict = self.frame_pipeline.process(staging)
+            if verdict["action"] != FrameAction.KEEP:
+                logger.info(f"Frame {image.name}: {verdict['action']} ({verdict['reason']})")
+            if "usable" in verdict:
+                self.scheduler.record_exposure(captured_at.astimezone(tzlocal()), verdict["usable"])
+            if verdict["action"] == FrameAction.DROP:
+                return None
+            if verdict["action"] == FrameAction.THUMBNAIL:
+                # Kept with the thumbnails, so it's partitioned as one rather than as a full size image
+                image = self.image_manager.thumbnail_path(image)
+                staging = staging.replace(staging_path(image))
+        metadata = self._capture_metadata(captured_at)
+        try:
+            if self.metadata_writer is not None:
+                # Rewriting the staging file leaves it complete under the final name either way
+                write_atomic(image, self._embed_metadata(staging.read_bytes(), metadata, image.name))
+            else:
+                commit(image)
+            self.image_manager.record_capture(image, metadata=metadata)
+        except OSError as e:
+            self._store_failed(image.name, e, staging, image)
+            return None
+        self._intervals_since_last_upload += 1
+
+        try:
+            self.upload_queue.put(image, timeout=self.enqueue_timeout)
+        except queue.Full:
+            # The image stays in the upload journal and is picked up by the next batch
+            logger.warning(f"Upload queue is full, leaving {image} on disk")
+            self._overflow.set()
+        return image
+
+    def _capture_to_memory(self) -> InMemoryImage | None:
+        """Captures an image to memory and hands it to the upload thread, see capture
+        Returns:
+            The image, or None if the capture failed or the frame was dropped
+        """
+        captured_at = datetime.now(timezone.utc)
+        name = self.image_manager.get_image_name(captured_at)
+        # Flip the image vertically since the camera is mounted upside down
+        data = self.camera.capture_bytes(vflip=True, hflip=True)
+        if not data:
+            return None
+        downgraded = False
+        if self.frame_pipeline is not None:
+            verdict, data = self.frame_pipeline.process_bytes(data)
+            if verdict["action"] != FrameAction.KEEP:
+                logger.info(f"Frame {name}: {verdict['action']} ({verdict['reason']})")
+            if "usable" in verdict:
+                self.scheduler.record_exposure(captured_at.astimezone(tzlocal()), verdict["usable"])
+            if data is None:
+                return None
+            downgraded = verdict["action"] == FrameAction.THUMBNAIL
+
+        metadata = self._capture_metadata(captured_at)
+        if self.metadata_writer is not None:
+            data = self._embed_metadata(data, metadata, name)
+        image = InMemoryImage(name, data, metadata, thumbnail=downgraded)
+        self._intervals_since_last_upload += 1
+        try:
+            self.upload_queue.put(image, timeout=self.enqueue_timeout)
+        except queue.Full:
+            try:
+                self.image_manager.spill(image)
+            except OSError as e:
+                self._store_failed(name, e, self.image_manager.spill_path(image))
+                return None
+            logger.warning(f"Upload queue is full, wrote {name} to disk")
+            self._overflow.set()
+        return image
+
+    def _store_failed(self, name: str, error: OSError, *leftovers: Path) -> None:
+        """Drops a capture that couldn't be written or recorded, usually because the disk is full,
+        and evicts from the backlog so the next capture has room
+        Args:
+            name: File name of the capture
+            error: Why it couldn't be stored
+            leftovers: Partly written files of the capture to delete
+        """
+        logger.error(f"Failed to store {name}, dropping it: {error}")
+        try:
+            for path in leftovers:
+                self.image_manager.remove_image(path)
+            self.image_manager.enforce_quota(disk_full=True)
+        except Exception as e:
+            logger.exception("Failed to free space for the next capture", exc_info=e)
+
+    def _capture_metadata(self, captured_at: datetime) -> CaptureMetadata:
+        """Describes a capture, recorded once and carried through to the upload
+        Args:
+            captured_at: When the capture started
+        Returns:
+            The capture time, sun elevation and camera settings
+        """
+        try:
+            sun_elevation = self.scheduler.location.sun_elevation(captured_at)
+        except Exception as e:
+            logger.warning(f"Failed to work out the sun elevation: {e}")
+            sun_elevation = None
+        return make_metadata(captured_at, sun_elevation, self.camera.settings())
+
+    def _embed_metadata(self, data: bytes, metadata: CaptureMetadata, name: str) -> bytes:
+        """Embeds the capture metadata into an image, keeping the image as it is if that fails
+        Args:
+            data: The JPEG
+            metadata: How and when the image was captured
+            name: Name of the image for logging
+        Returns:
+            The JPEG with the metadata, or the original if it couldn't be added
+        """
+        try:
+            return self.metadata_writer.embed(data, metadata)
+        except Exception as e:
+            logger.warning(f"Failed to embed metadata in {name}: {e}")
+            return data
+
+    def _wait_for_next_slot(self) -> bool:
+        """Waits until the next fixed-rate capture slot, slots that have already passed are skipped
+        Returns:
+            True if the camera should capture now, False if the state should be checked again
+        """
+        now = datetime.now(tzlocal())
+        slot = next_capture_time(now, self.capture_interval, after=self._last_slot)
+        wait = (slot - now).total_seconds()
+        logger.debug(f"Waiting {wait:.3f}s for capture slot {slot}")
+        if self._stop_event.wait(wait):
+            return False
+        if self.scheduler.get_state(slot) == ScheduleState.OFF:
+            return False
+
+        self._last_slot = slot
+        lateness = self.jitter.record(slot, datetime.now(tzlocal()))
+        logger.info(f"Capture slot {slot} started {lateness * 1000:.1f}ms late, {self.jitter.summary()}")
+        return True
+
+    def _upload_worker(self) -> None:
+        """Consumes the upload queue, uploading the batch of waiting images whenever the batch policy says so"""
+
+        # Anything left from a previous run starts the batch
+        batch: List[Path] = self.image_manager.get_pending_images()
+        self._intervals_since_last_upload = len(batch)
+        stopping = flushing = False
+        while True:
+            try:
+                reason = "flush" if flushing and batch else self._batch_due(batch)
+                if reason:
+                    batch = self._upload(list(dict.fromkeys(batch)), reason)
+            except Exception as e:
+                # The thread has to outlive a failing journal or disk, the batch is tried again later
+                logger.exception("Failed to upload batch", exc_info=e)
+            if flushing:
+                self._flushed.set()
+            if stopping:
+                break
+
+            # Without new captures the policy is checked again periodically, for backlog age and upload windows
+            timeout = None if self.batch_policy.immediate or not batch else self.batch_check_interval
+            try:
+                items = [self.upload_queue.get(timeout=timeout)]
+            except queue.Empty:
+                items = []
+
+            # Drain everything else already waiting into the same batch
+            while True:
+                try:
+                    items.append(self.upload_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = None in items or self._stop_event.is_set()
+            flushing = _FLUSH in items
+            batch += [item for item in items if isinstance(item, Path)]
+            try:
+                # Images in memory can't wait for a batch, anything that fails to upload joins it on disk
+                batch += self._upload_from_memory([item for item in items if isinstance(item, InMemoryImage)])
+
+                if self._overflow.is_set():
+                    # Images that didn't fit in the queue are only in the journal
+                    batch = self.image_manager.get_pending_images()
+                    self._overflow.clear()
+            except Exception as e:
+                logger.exception("Failed to queue captured images for upload", exc_info=e)
+
+    def flush_uploads(self, timeout: float | None = None) -> bool:
+        """Uploads everything waiting regardless of the batch policy and waits for it to finish
+        Args:
+            timeout: Seconds to wait for the upload
+        Returns:
+            True if the upload finished in time
+        """
+        if not self._upload_thread or not self._upload_thread.is_alive():
+            return False
+        self._flushed.clear()
+        try:
+            self.upload_queue.put(_FLUSH, timeout=timeout)
+        except queue.Full:
+            return False
+        return self._flushed.wait(timeout)
+
+    def _try_deep_sleep(self, now: datetime) -> bool:
+        """Halts the device until just before the next ON time, if the deep sleep policy says it's worth it.
+        Everything waiting is uploaded first
+        Args:
+            now: The current time
+        Returns:
+            True if the device was told to halt
+        """
+        if self.deep_sleep is None:
+            return False
+        # Already halted for this night, only happens with simulated power controls
+        if self._woken_at is not None and now < self._woken_at:
+            return False
+
+        decision = self.deep_sleep.decide(now, self.scheduler.get_next_on_time(now))
+        outcome = f"until {decision['wake_time']}" if decision["sleep"] else "skipped"
+        logger.info(
+            f"Deep sleep {outcome}: {decision['reason']} "
+            f"(idle {decision['idle_joules']:.0f}J, deep sleep {decision['deep_sleep_joules']:.0f}J)"
+        )
+        if not decision["sleep"]:
+            return False
+
+        self.flush_uploads(timeout=600)
+        self._woken_at = decision["wake_time"]
+        self.power.schedule_wakeup(decision["wake_time"])
+        self.power.shutdown()
+        return True
+
+    def _batch_due(self, batch: List[Path]) -> str | None:
+        """Checks the batch policy
+        Args:
+            batch: Images waiting to be uploaded
+        Returns:
+            Why the batch should be uploaded now, or None if it should wait
+        """
+        if not batch:
+            return None
+        if self.batch_policy.immediate:
+            return "new capture"
+        return self.batch_policy.reason(self.image_manager.get_backlog_stats(), datetime.now(tzlocal()))
+
+    def _upload(self, images: List[Path], reason: str = "") -> List[Path]:
+        """Uploads a batch of images and reports how long the connection was in use
+        Args:
+            images: Images to upload
+            reason: Why the batch is being uploaded
+        Returns:
+            The images that were kept on disk after a failed upload, all of them if the upload failed
+        """
+        if not images:
+            return []
+        start = time.monotonic()
+        try:
+            with self.governor.boost(raspberrypi.GovernorMode.PERFORMANCE):
+                results = self.image_manager.upload_images(images, debug=self.debug)
+        except Exception as e:
+            logger.exception("Failed to upload images", exc_info=e)
+            # Kept for the next batch rather than waiting for a restart to find them in the journal
+            return images
+
+        radio_on = time.monotonic() - start
+        self.radio_on_seconds += radio_on
+        kept = [result["image"] for result in results if not result["deleted"]]
+        logger.info(
+            f"Upload batch of {len(images)} images ({reason}) after {self._intervals_since_last_upload} captures, "
+            f"radio on for {radio_on:.1f}s, {self.radio_on_seconds:.1f}s in total"
+        )
+        self._intervals_since_last_upload = len(kept)
+        return kept
+
+    def _upload_from_memory(self, images: List[InMemoryImage]) -> List[Path]:
+        """Uploads images captured to memory
+        Args:
+            images: Images to upload
+        Returns:
+            The images that were written to disk after a failed upload
+        """
+        if not images:
+            return []
+        start = time.monotonic()
+        results = []
+        with self.governor.boost(raspberrypi.GovernorMode.PERFORMANCE):
+            for image in images:
+                try:
+                    results += self.image_manager.upload_capture(image, debug=self.debug)
+                except Exception as e:
+                    logger.exception(f"Failed to upload {image.name}", exc_info=e)
+            # Once for everything drained from the queue, rather than a request per image
+            self.image_manager.sync_manifest(debug=self.debug)
+
+        radio_on = time.monotonic() - start
+        self.radio_on_seconds += radio_on
+        kept = [result["image"] for result in results if not result["deleted"]]
+        logger.info(
+            f"Uploaded {len(images)} images from memory, {len(kept)} written to disk, "
+            f"radio on for {radio_on:.1f}s, {self.radio_on_seconds:.1f}s in total"
+        )
+        self._intervals_since_last_upload = max(0, self._intervals_since_last_upload - len(images) + len(kept))
+        return kept
+
     def run(self) -> None:
         """Runs main loop of code until exited"""
 
-        raspberrypi.set_governer(raspberrypi.GovernorMode.ONDEMAND, debug=self.debug)
-        while True:
+        self.governor.set(raspberrypi.GovernorMode.ONDEMAND)
+        if not self.debug:
+            try:
+                self.image_manager.reconcile_uploads()
+            except Exception as e:
+                logger.exception("Failed to check for images that were already uploaded", exc_info=e)
+        self.start_uploader()
+        while not self._stop_event.is_set():
             now = datetime.now(tzlocal())
             state = self.scheduler.get_state(now)
 
             if state == ScheduleState.OFF:
-                sleep_for = self.sleep_interval
-                # Instead of exiting, wait until the next ON time
+                # Instead of exiting, sleep straight through to the next ON time in one sleep.
+                # The schedule is checked again on waking, in case the clock jumped overnight
                 logger.info("Camera is in OFF state (nighttime), waiting...")
-                next_on_time = self.scheduler.get_next_on_time(now)
-                logger.info(f"Next ON time: {next_on_time}")
-
-                # Sleep until close to the next ON time
-                sleep_duration = (next_on_time - now).total_seconds()
-                if sleep_duration > 0:
-                    # Sleep for most of the duration, but wake up occasionally to check
-                    # In case of time changes, system restarts, etc.
-                    logger.debug(f"waiting for {sleep_duration}")
-                    while sleep_duration > sleep_for:  # 5 minutes
-                        logger.debug(f"sleeping for {sleep_for} seconds")
-                        time.sleep(sleep_for)
-                        sleep_duration -= sleep_for
-                        # Re-check the time in case something changed
-                        now = datetime.now(tzlocal())
-                        if self.scheduler.get_state(now) == ScheduleState.ON:
-                            break
-                        next_on_time = self.scheduler.get_next_on_time(now)
-                        sleep_duration = (next_on_time - now).total_seconds()
-                        logger.debug(f"now waiting for {sleep_duration}")
-
-                    # Sleep the remaining time
-                    if sleep_duration > 0:
-                        time.sleep(sleep_duration)
-                        logger.debug(f"sleeping for {sleep_duration}")
+                self._try_deep_sleep(now)
+                self.scheduler.sleep_until_next_transition(now, wait=self._stop_event.wait)
                 continue  # Go back to the start of the loop to check state again
 
-            # Camera is ON - take pictures
-            logger.info("Camera is in ON state, capturing image...")
-            # Flip the image vertically since the camera is mounted upside down
-            self.camera.capture_image(self.image_manager.get_pending_image_path(), vflip=True, hflip=True)
+            # Camera is ON - take pictures, uploads happen in the background
+            if self.align_captures and not self._wait_for_next_slot():
+                continue
 
-            if len(self.image_manager.get_pending_images()) > 0:
-                raspberrypi.set_governer(raspberrypi.GovernorMode.PERFORMANCE, debug=self.debug)
-                self.image_manager.upload_pending(debug=self.debug)
+            logger.info("Camera is in ON state, capturing image...")
+            try:
+                self.capture()
+            except Exception as e:
+                # Keep capturing, the camera or disk may recover by the next interval
+                logger.exception("Capture failed", exc_info=e)
 
-            time.sleep(self.capture_interval)
+            if not self.align_captures:
+                self._stop_event.wait(self.capture_interval)
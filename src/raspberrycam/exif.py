@@ -0,0 +1,281 @@
+"""Builds EXIF and XMP metadata for each capture and splices it into the JPEG as APP1
+segments, so the metadata is attached without decoding or re-encoding the image"""
+
+import json
+import struct
+from typing import List, TypedDict
+from xml.sax.saxutils import quoteattr
+
+from raspberrycam import jpeg
+from raspberrycam.config import Config
+from raspberrycam.location import Location
+from raspberrycam.metadata import CaptureMetadata, capture_time
+
+EXIF_HEADER = b"Exif\x00\x00"
+"""Start of the payload of an EXIF segment"""
+
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+"""Start of the payload of an XMP segment"""
+
+XMP_NAMESPACE = "https://github.com/NERC-CEH/FDRI_RaspberryPi_Scripts/ns/1.0/"
+"""Namespace of the site and capture properties in the XMP"""
+
+# TIFF field types
+_BYTE = 1
+_ASCII = 2
+_SHORT = 3
+_LONG = 4
+_RATIONAL = 5
+_UNDEFINED = 7
+
+# TIFF tags
+_IMAGE_WIDTH = 0x0100
+_IMAGE_LENGTH = 0x0101
+_IMAGE_DESCRIPTION = 0x010E
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_EXPOSURE_TIME = 0x829A
+_ISO = 0x8827
+_EXIF_VERSION = 0x9000
+_DATE_TIME_ORIGINAL = 0x9003
+_OFFSET_TIME_ORIGINAL = 0x9011
+_PIXEL_X_DIMENSION = 0xA002
+_PIXEL_Y_DIMENSION = 0xA003
+_GPS_VERSION = 0x0000
+_GPS_LATITUDE_REF = 0x0001
+_GPS_LATITUDE = 0x0002
+_GPS_LONGITUDE_REF = 0x0003
+_GPS_LONGITUDE = 0x0004
+
+Entry = tuple[int, int, int, bytes]
+"""A TIFF field as its tag, type, count and little-endian value"""
+
+
+class SiteInfo(TypedDict):
+    """Typed dictionary describing where the camera is"""
+
+    catchment: str
+    site: str
+    direction: str
+    latitude: float
+    longitude: float
+
+
+def _ascii(tag: int, text: str) -> Entry:
+    value = text.encode("ascii", "replace") + b"\x00"
+    return tag, _ASCII, len(value), value
+
+
+def _rationals(tag: int, *values: tuple[int, int]) -> Entry:
+    return tag, _RATIONAL, len(values), b"".join(struct.pack("<II", *value) for value in values)
+
+
+def _degrees(value: float) -> tuple[tuple[int, int], ...]:
+    """Converts an angle to degrees, minutes and seconds to a ten thousandth of a second"""
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = (value - degrees - minutes / 60) * 3600
+    return (degrees, 1), (minutes, 1), (round(seconds * 10000), 10000)
+
+
+def _ifd_size(entries: List[Entry]) -> int:
+    """Bytes taken by an image file directory and the values that don't fit in its entries"""
+    return 6 + 12 * len(entries) + sum(len(value) + len(value) % 2 for _, _, _, value in entries if len(value) > 4)
+
+
+def _ifd(entries: List[Entry], offset: int) -> bytes:
+    """Encodes an image file directory followed by the values that don't fit in its entries
+    Args:
+        entries: The fields
+        offset: Where the directory starts from the start of the TIFF header
+    Returns:
+        The encoded directory, with no next directory
+    """
+    entries = sorted(entries)
+    table = bytearray(struct.pack("<H", len(entries)))
+    values = bytearray()
+    values_offset = offset + 6 + 12 * len(entries)
+    for tag, field_type, count, value in entries:
+        if len(value) <= 4:
+            table += struct.pack("<HHI", tag, field_type, count) + value.ljust(4, b"\x00")
+        else:
+            table += struct.pack("<HHII", tag, field_type, count, values_offset + len(values))
+            # Values start on a word boundary
+            values += value + b"\x00" * (len(value) % 2)
+    table += struct.pack("<I", 0)
+    return bytes(table + values)
+
+
+def build_exif(metadata: CaptureMetadata, site: SiteInfo) -> bytes:
+    """Builds the payload of an EXIF segment with the capture time, location and exposure
+    Args:
+        metadata: How and when the image was captured
+        site: Where the camera is
+    Returns:
+        The payload, starting with the EXIF header
+    """
+    captured = capture_time(metadata)
+    camera = metadata["camera"]
+
+    exif = [
+        (_EXIF_VERSION, _UNDEFINED, 4, b"0232"),
+        _ascii(_DATE_TIME_ORIGINAL, captured.strftime("%Y:%m:%d %H:%M:%S")),
+        _ascii(_OFFSET_TIME_ORIGINAL, "+00:00"),
+    ]
+    if camera.get("shutter"):
+        # Microseconds
+        exif.append(_rationals(_EXPOSURE_TIME, (int(camera["shutter"]), 1_000_000)))
+    if camera.get("gain"):
+        exif.append((_ISO, _SHORT, 1, struct.pack("<H", min(65535, round(float(camera["gain"]) * 100)))))
+
+    gps = [
+        (_GPS_VERSION, _BYTE, 4, bytes([2, 3, 0, 0])),
+        _ascii(_GPS_LATITUDE_REF, "N" if site["latitude"] >= 0 else "S"),
+        _rationals(_GPS_LATITUDE, *_degrees(site["latitude"])),
+        _ascii(_GPS_LONGITUDE_REF, "E" if site["longitude"] >= 0 else "W"),
+        _rationals(_GPS_LONGITUDE, *_degrees(site["longitude"])),
+    ]
+
+    description = f"catchment={site['catchment']} site={site['site']} direction={site['direction']}"
+    ifd0: List[Entry] = [_ascii(_IMAGE_DESCRIPTION, description)]
+    # The pointers are a fixed size, so the directories can be laid out before they're known
+    ifd0 += [(_EXIF_IFD, _LONG, 1, bytes(4)), (_GPS_IFD, _LONG, 1, bytes(4))]
+    exif_offset = 8 + _ifd_size(ifd0)
+    gps_offset = exif_offset + _ifd_size(exif)
+    ifd0[1:] = [
+        (_EXIF_IFD, _LONG, 1, struct.pack("<I", exif_offset)),
+        (_GPS_IFD, _LONG, 1, struct.pack("<I", gps_offset)),
+    ]
+
+    tiff = b"II*\x00" + struct.pack("<I", 8) + _ifd(ifd0, 8) + _ifd(exif, exif_offset) + _ifd(gps, gps_offset)
+    return EXIF_HEADER + tiff
+
+
+def _resize_ifd(tiff: bytearray, order: str, offset: int, sizes: dict[int, int]) -> int | None:
+    """Sets the dimension fields of an image file directory in place
+    Args:
+        tiff: The TIFF structure
+        order: Byte order of the TIFF as a struct prefix
+        offset: Where the directory starts from the start of the TIFF header
+        sizes: New value of each dimension tag
+    Returns:
+        Offset of the EXIF directory if this directory points to one
+    """
+    exif_offset = None
+    (count,) = struct.unpack_from(order + "H", tiff, offset)
+    for i in range(count):
+        entry = offset + 2 + 12 * i
+        tag, field_type, n = struct.unpack_from(order + "HHI", tiff, entry)
+        if tag == _EXIF_IFD:
+            (exif_offset,) = struct.unpack_from(order + "I", tiff, entry + 8)
+        elif tag in sizes and n == 1 and field_type in (_SHORT, _LONG):
+            # Values that fit are stored in the entry, starting at its first byte
+            struct.pack_into(order + ("H" if field_type == _SHORT else "I"), tiff, entry + 8, sizes[tag])
+    return exif_offset
+
+
+def resize_exif(payload: bytes, width: int, height: int) -> bytes:
+    """Updates the image dimensions in an EXIF payload, for an image that has been resized
+    Args:
+        payload: The payload of the EXIF segment, starting with the EXIF header
+        width: New width in pixels
+        height: New height in pixels
+    Returns:
+        The payload with the ImageWidth, ImageLength, PixelXDimension and PixelYDimension of the
+        main image set, unchanged if it can't be read
+    """
+    tiff = bytearray(payload[len(EXIF_HEADER) :])
+    order = {b"II": "<", b"MM": ">"}.get(bytes(tiff[:2]))
+    if not payload.startswith(EXIF_HEADER) or order is None:
+        return payload
+    sizes = {_IMAGE_WIDTH: width, _IMAGE_LENGTH: height, _PIXEL_X_DIMENSION: width, _PIXEL_Y_DIMENSION: height}
+    try:
+        # The next directory after the first describes the EXIF thumbnail, which is left alone
+        exif_offset = _resize_ifd(tiff, order, struct.unpack_from(order + "I", tiff, 4)[0], sizes)
+        if exif_offset is not None:
+            _resize_ifd(tiff, order, exif_offset, sizes)
+    except struct.error:
+        return payload
+    return EXIF_HEADER + bytes(tiff)
+
+
+def _xmp_degrees(value: float, positive: str, negative: str) -> str:
+    """Formats an angle as XMP GPS coordinates, degrees and decimal minutes"""
+    degrees = int(abs(value))
+    minutes = (abs(value) - degrees) * 60
+    return f"{degrees},{minutes:.6f}{positive if value >= 0 else negative}"
+
+
+def build_xmp(metadata: CaptureMetadata, site: SiteInfo) -> bytes:
+    """Builds the payload of an XMP segment, with the site, sun elevation and camera settings
+    along with the standard capture time and location properties
+    Args:
+        metadata: How and when the image was captured
+        site: Where the camera is
+    Returns:
+        The payload, starting with the XMP header
+    """
+    properties = {
+        "exif:DateTimeOriginal": capture_time(metadata).isoformat(),
+        "exif:GPSLatitude": _xmp_degrees(site["latitude"], "N", "S"),
+        "exif:GPSLongitude": _xmp_degrees(site["longitude"], "E", "W"),
+        "pcam:Catchment": site["catchment"],
+        "pcam:Site": site["site"],
+        "pcam:Direction": site["direction"],
+        "pcam:CameraSettings": json.dumps(metadata["camera"], sort_keys=True),
+    }
+    if metadata["sun_elevation"] is not None:
+        properties["pcam:SunElevation"] = str(metadata["sun_elevation"])
+    attributes = "".join(f"\n   {name}={quoteattr(str(value))}" for name, value in properties.items())
+    packet = (
+        '<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+        ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+        '  <rdf:Description rdf:about=""\n'
+        '   xmlns:exif="http://ns.adobe.com/exif/1.0/"\n'
+        f'   xmlns:pcam="{XMP_NAMESPACE}"{attributes}/>\n'
+        " </rdf:RDF>\n"
+        "</x:xmpmeta>\n"
+        '<?xpacket end="w"?>'
+    )
+    return XMP_HEADER + packet.encode()
+
+
+class MetadataWriter:
+    """Embeds capture metadata into JPEGs. An EXIF segment is added unless the camera already
+    wrote one, which is kept since it describes the exposure in more detail, and any XMP
+    segment is replaced"""
+
+    site: SiteInfo
+    """Where the camera is"""
+
+    def __init__(self, config: Config, location: Location) -> None:
+        """
+        Args:
+            config: Site configuration giving the catchment, site and direction
+            location: Location of the camera
+        """
+        self.site = {
+            "catchment": config.catchment,
+            "site": config.site,
+            "direction": config.direction,
+            "latitude": location.latitude,
+            "longitude": location.longitude,
+        }
+
+    def embed(self, data: bytes, metadata: CaptureMetadata) -> bytes:
+        """Splices the metadata into a JPEG, the image data is left as it is
+        Args:
+            data: The JPEG
+            metadata: How and when the image was captured
+        Returns:
+            The JPEG with the metadata
+        """
+        exif = jpeg.find_segments(data, jpeg.APP1, EXIF_HEADER)
+        # EXIF has to come before XMP, so the camera's is moved in front of the new XMP
+        inserted = [data[segment.start : segment.end] for segment in exif]
+        if not exif:
+            inserted.append(jpeg.app_segment(jpeg.APP1, build_exif(metadata, self.site)))
+        inserted.append(jpeg.app_segment(jpeg.APP1, build_xmp(metadata, self.site)))
+        return jpeg.splice(data, inserted, removed=exif + jpeg.find_segments(data, jpeg.APP1, XMP_HEADER))
@@ -0,0 +1,103 @@
+"""Crash safe file handling for the pending directories. Files are written under a hidden
+staging name and renamed once complete, so a half written file is never picked up"""
+
+import base64
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import TypedDict
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+"""Bytes read at a time when hashing a file"""
+
+
+class Digests(TypedDict):
+    """Typed dictionary of the content hashes of a file"""
+
+    md5: str
+    """Hex MD5, the ETag S3 gives an object uploaded in a single part"""
+    sha256: str
+    """Base64 SHA-256, the form S3 takes as a checksum"""
+
+
+def staging_path(path: Path) -> Path:
+    """Gets the hidden name a file is written under before it's complete. The extension is
+    kept since some writers use it to pick the format
+    Args:
+        path: The final path of the file
+    Returns:
+        The staging path in the same directory
+    """
+    return path.with_name(f".{path.name}")
+
+
+def is_staging(path: Path) -> bool:
+    """Checks whether a path is a staging file"""
+    return Path(path).name.startswith(".")
+
+
+def commit(path: Path) -> None:
+    """Renames a completely written staging file to its final path
+    Args:
+        path: The final path of the file
+    """
+    os.replace(staging_path(path), path)
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """Writes a file under its staging name and renames it
+    Args:
+        path: Path of the file
+        data: Contents of the file
+    """
+    staging_path(path).write_bytes(data)
+    commit(path)
+
+
+def remove_staging(directory: Path) -> int:
+    """Deletes staging files left behind by a crash
+    Args:
+        directory: The directory to clean up
+    Returns:
+        Number of files deleted
+    """
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and is_staging(Path(entry.path)):
+            os.remove(entry.path)
+            removed += 1
+    if removed:
+        logger.info(f"Removed {removed} partly written files from {directory}")
+    return removed
+
+
+def bytes_digests(data: bytes) -> Digests:
+    """Hashes data held in memory
+    Args:
+        data: The data to hash
+    Returns:
+        The MD5 and SHA-256 of the data
+    """
+    return {
+        "md5": hashlib.md5(data).hexdigest(),
+        "sha256": base64.b64encode(hashlib.sha256(data).digest()).decode(),
+    }
+
+
+def file_digests(path: Path) -> Digests:
+    """Hashes a file in one streaming pass
+    Args:
+        path: The file to hash
+    Returns:
+        The MD5 and SHA-256 of the file
+    """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            md5.update(chunk)
+            sha256.update(chunk)
+    return {"md5": md5.hexdigest(), "sha256": base64.b64encode(sha256.digest()).decode()}
@@ -0,0 +1,305 @@
+"""Checks run on each frame after it's captured, deciding whether it's worth keeping.
+The checks work on a small grayscale preview that the JPEG decoder produces at a
+fraction of the cost of decoding the full image"""
+
+import logging
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from enum import StrEnum
+from pathlib import Path
+from typing import List, NotRequired, TypedDict
+
+import cv2
+import numpy as np
+
+from raspberrycam.files import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class FrameAction(StrEnum):
+    """What happens to a captured frame"""
+
+    KEEP = "keep"
+    FLAG = "flag"
+    """Kept and uploaded, but reported as unusable"""
+    THUMBNAIL = "thumbnail"
+    DROP = "drop"
+
+
+class FrameVerdict(TypedDict):
+    """Typed dictionary describing what happened to a captured frame"""
+
+    action: FrameAction
+    reason: str
+    usable: NotRequired[bool]
+    """Whether the frame was well exposed, set when the exposure was checked"""
+
+
+def load_preview(image: Path) -> np.ndarray | None:
+    """Decodes a grayscale preview at 1/8 scale
+    Args:
+        image: Path of the JPEG
+    Returns:
+        A 2D uint8 array, or None if the image can't be decoded
+    """
+    return cv2.imread(str(image), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+
+def difference_hash(preview: np.ndarray, size: int = 8) -> np.ndarray:
+    """Perceptual hash of whether each cell of a size x size grid is brighter than its neighbour
+    Args:
+        preview: A 2D grayscale image
+        size: Number of rows and comparisons per row
+    Returns:
+        A flat boolean array of size * size bits
+    """
+    small = cv2.resize(preview, (size + 1, size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return (small[:, 1:] > small[:, :-1]).ravel()
+
+
+def decode_preview(data: bytes) -> np.ndarray | None:
+    """Decodes a grayscale preview at 1/8 scale from JPEG bytes, see load_preview
+    Args:
+        data: The encoded image
+    Returns:
+        A 2D uint8 array, or None if the image can't be decoded
+    """
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+
+def encode_thumbnail(frame: np.ndarray, width: int = 320, quality: int = 70) -> bytes:
+    """Encodes a smaller, more compressed copy of a frame
+    Args:
+        frame: The decoded frame
+        width: Width of the thumbnail in pixels, the aspect ratio is kept
+        quality: JPEG quality from 1-100
+    Returns:
+        The encoded thumbnail
+    """
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    thumbnail = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", thumbnail, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Can't encode a thumbnail")
+    return encoded.tobytes()
+
+
+def thumbnail_bytes(data: bytes, width: int = 320, quality: int = 70) -> bytes:
+    """Makes a thumbnail of an image held in memory
+    Args:
+        data: The encoded image
+        width: Width of the thumbnail in pixels, the aspect ratio is kept
+        quality: JPEG quality from 1-100
+    Returns:
+        The encoded thumbnail
+    """
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Can't decode the image")
+    return encode_thumbnail(frame, width, quality)
+
+
+def make_thumbnail(image: Path, width: int = 320, quality: int = 70, destination: Path | None = None) -> None:
+    """Writes a smaller, more compressed copy of an image
+    Args:
+        image: Path of the image
+        width: Width of the thumbnail in pixels, the aspect ratio is kept
+        quality: JPEG quality from 1-100
+        destination: Path of the thumbnail, defaults to replacing the image
+    """
+    frame = cv2.imread(str(image))
+    if frame is None:
+        raise ValueError(f"Can't decode {image}")
+    encoded = encode_thumbnail(frame, width, quality)
+
+    write_atomic(destination if destination is not None else image, encoded)
+
+
+class FrameFilter(ABC):
+    """A check run on each captured frame"""
+
+    @abstractmethod
+    def check(self, preview: np.ndarray) -> FrameVerdict:
+        """Checks a frame
+        Args:
+            preview: Grayscale preview of the frame
+        Returns:
+            What should happen to the frame and why
+        """
+
+    def kept(self, preview: np.ndarray) -> None:
+        """Called once every filter has passed a frame
+        Args:
+            preview: Grayscale preview of the frame
+        """
+
+
+@dataclass
+class DuplicateFilter(FrameFilter):
+    """Skips frames that look the same as the last frame kept, such as on overcast days
+    or in static scenes. At least one frame in every max_skipped + 1 is always kept"""
+
+    threshold: int = 4
+    """Frames whose hash differs from the last kept frame in fewer bits than this are duplicates, out of 64"""
+
+    max_skipped: int = 11
+    """Most duplicates skipped in a row before a frame is kept anyway"""
+
+    action: FrameAction = FrameAction.DROP
+    """What happens to duplicates, dropped or downgraded to a thumbnail"""
+
+    def __post_init__(self) -> None:
+        self.action = FrameAction(self.action)
+        self._reference: np.ndarray | None = None
+        self._skipped = 0
+
+    def check(self, preview: np.ndarray) -> FrameVerdict:
+        if self._reference is None:
+            return {"action": FrameAction.KEEP, "reason": "first frame"}
+
+        distance = int(np.count_nonzero(difference_hash(preview) != self._reference))
+        if distance >= self.threshold:
+            return {"action": FrameAction.KEEP, "reason": f"changed by {distance} bits"}
+        if self._skipped >= self.max_skipped:
+            return {"action": FrameAction.KEEP, "reason": f"kept after {self._skipped} duplicates"}
+
+        self._skipped += 1
+        return {"action": self.action, "reason": f"duplicate, changed by {distance} bits"}
+
+    def kept(self, preview: np.ndarray) -> None:
+        self._reference = difference_hash(preview)
+        self._skipped = 0
+
+
+@dataclass
+class ExposureFilter(FrameFilter):
+    """Rejects frames that are mostly black or blown out, such as the first and last captures
+    of the day. Uses a histogram of the preview rather than the full image"""
+
+    dark_level: int = 20
+    """Pixels at or below this brightness count as black, out of 255"""
+
+    bright_level: int = 245
+    """Pixels at or above this brightness count as blown out, out of 255"""
+
+    max_dark_fraction: float = 0.8
+    """Frames with more than this fraction of black pixels are too dark"""
+
+    max_bright_fraction: float = 0.3
+    """Frames with more than this fraction of blown out pixels are over-exposed"""
+
+    action: FrameAction = FrameAction.DROP
+    """What happens to badly exposed frames, dropped or flagged"""
+
+    def __post_init__(self) -> None:
+        self.action = FrameAction(self.action)
+
+    def check(self, preview: np.ndarray) -> FrameVerdict:
+        histogram = np.bincount(preview.ravel(), minlength=256)
+        dark = histogram[: self.dark_level + 1].sum() / preview.size
+        bright = histogram[self.bright_level :].sum() / preview.size
+
+        if dark > self.max_dark_fraction:
+            return {"action": self.action, "reason": f"too dark, {dark:.0%} black", "usable": False}
+        if bright > self.max_bright_fraction:
+            return {"action": self.action, "reason": f"over-exposed, {bright:.0%} blown out", "usable": False}
+        return {"action": FrameAction.KEEP, "reason": "", "usable": True}
+
+
+class FramePipeline:
+    """Runs each captured frame through a list of filters, the first one that doesn't
+    keep the frame decides what happens to it"""
+
+    filters: List[FrameFilter]
+    """Checks run in order on each frame"""
+
+    thumbnail_width: int
+    """Width in pixels of frames downgraded to thumbnails"""
+
+    def __init__(self, filters: List[FrameFilter], thumbnail_width: int = 320) -> None:
+        """
+        Args:
+            filters: Checks run in order on each frame
+            thumbnail_width: Width in pixels of frames downgraded to thumbnails
+        """
+        self.filters = filters
+        self.thumbnail_width = thumbnail_width
+
+    @classmethod
+    def from_config(cls, settings: dict) -> "FramePipeline":
+        """Builds a pipeline from the frame_filters config setting
+        Args:
+            settings: Options for each filter, keyed on the filter name, and thumbnail_width
+        Returns:
+            A pipeline running the configured filters
+        """
+        filters: List[FrameFilter] = []
+        # Exposure first, so badly exposed frames never become the reference for duplicates
+        if "exposure" in settings:
+            filters.append(ExposureFilter(**(settings["exposure"] or {})))
+        if "duplicates" in settings:
+            filters.append(DuplicateFilter(**(settings["duplicates"] or {})))
+        return cls(filters, thumbnail_width=settings.get("thumbnail_width", 320))
+
+    def check(self, preview: np.ndarray) -> FrameVerdict:
+        """Runs the filters on a frame
+        Args:
+            preview: Grayscale preview of the frame
+        Returns:
+            What should happen to the frame and why
+        """
+        verdict: FrameVerdict = {"action": FrameAction.KEEP, "reason": ""}
+        usable = None
+        for frame_filter in self.filters:
+            verdict = frame_filter.check(preview)
+            usable = verdict.get("usable", usable)
+            if verdict["action"] != FrameAction.KEEP:
+                break
+        else:
+            for frame_filter in self.filters:
+                frame_filter.kept(preview)
+        if usable is not None:
+            verdict["usable"] = usable
+        return verdict
+
+    def process(self, image: Path) -> FrameVerdict:
+        """Checks a captured frame, deleting it or replacing it with a thumbnail if a filter says so.
+        Flagged frames are left as they are
+        Args:
+            image: Path of the frame
+        Returns:
+            What happened to the frame and why
+        """
+        preview = load_preview(image)
+        if preview is None:
+            # Better to keep something that can't be checked than lose it
+            logger.warning(f"Can't decode {image}, keeping it unchecked")
+            return {"action": FrameAction.KEEP, "reason": "unreadable"}
+
+        verdict = self.check(preview)
+        if verdict["action"] == FrameAction.DROP:
+            os.remove(image)
+        elif verdict["action"] == FrameAction.THUMBNAIL:
+            make_thumbnail(image, self.thumbnail_width)
+        return verdict
+
+    def process_bytes(self, data: bytes) -> tuple[FrameVerdict, bytes | None]:
+        """Checks a frame captured in memory, see process
+        Args:
+            data: The encoded frame
+        Returns:
+            What happened to the frame and why, and the frame to keep or None if it was dropped
+        """
+        preview = decode_preview(data)
+        if preview is None:
+            logger.warning("Can't decode the captured frame, keeping it unchecked")
+            return {"action": FrameAction.KEEP, "reason": "unreadable"}, data
+
+        verdict = self.check(preview)
+        if verdict["action"] == FrameAction.DROP:
+            return verdict, None
+        if verdict["action"] == FrameAction.THUMBNAIL:
+            return verdict, thumbnail_bytes(data, self.thumbnail_width)
+        return verdict, data
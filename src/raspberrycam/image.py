@@ -1,15 +1,56 @@
+import io
+import json
 import logging
 import os
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List
+from typing import List, TypedDict
 
+from raspberrycam import jpeg
+from raspberrycam.bandwidth import RecompressionPolicy, ThroughputMeter, recompress_jpeg
+from raspberrycam.bundle import BundleMember, BundlePolicy, BundleStream, manifest_key
+from raspberrycam.circuit import CircuitState
 from raspberrycam.config import Config
+from raspberrycam.files import Digests, bytes_digests, file_digests, remove_staging, write_atomic
+from raspberrycam.filters import make_thumbnail, thumbnail_bytes
+from raspberrycam.journal import BacklogStats, JournalEntry, UploadJournal
+from raspberrycam.manifest import CaptureManifest, make_record
+from raspberrycam.metadata import NAME_TIME_FORMAT, CaptureMetadata, capture_time, name_time
+from raspberrycam.quota import DiskQuota
 from raspberrycam.s3 import S3Manager
 
 logger = logging.getLogger(__name__)
 
 
+class UploadResult(TypedDict):
+    """Typed dictionary describing the outcome of uploading one image"""
+
+    image: Path
+    object_name: str
+    uploaded: bool
+    deleted: bool
+
+
+@dataclass
+class InMemoryImage:
+    """An image captured to memory, only written to disk if it can't be uploaded"""
+
+    name: str
+    """Filename the image is given in the bucket and on disk"""
+
+    data: bytes
+    """The encoded image"""
+
+    metadata: CaptureMetadata | None = None
+    """How and when the image was captured"""
+
+    thumbnail: bool = False
+    """Whether the frame was downgraded to a thumbnail, it's then only uploaded as a thumbnail"""
+
+
 class ImageManager:
     """Class for managing images"""
 
@@ -17,53 +58,176 @@ class ImageManager:
     """Base directory of program"""
     pending_directory: Path
     """Directory of images to be uploaded"""
+    thumbnail_directory: Path
+    """Directory of thumbnails to be uploaded, named the same as their image"""
     log_directory: Path
     """Directory for logs"""
+    journal: UploadJournal
+    """Persistent record of the images waiting to be uploaded"""
+    quota: DiskQuota | None
+    """Byte budget for the images waiting to be uploaded, None lets them fill the disk"""
 
-    def __init__(self, base_directory: Path, config: Config, delete_cache: bool = True) -> None:
+    def __init__(
+        self, base_directory: Path, config: Config, delete_cache: bool = True, quota: DiskQuota | None = None
+    ) -> None:
         """
         Args:
             base_directory: Base directory of the program
+            quota: Byte budget for the images waiting to be uploaded, thumbnails aren't counted
         """
         if not isinstance(base_directory, Path):
             base_directory = Path(base_directory)
         self.base_directory = base_directory
         self.pending_directory = base_directory / "pending_uploads"
+        self.thumbnail_directory = base_directory / "pending_thumbnails"
         self.log_directory = base_directory / "logs"
         self.log_file = self.log_directory / "log.log"
-        # Whether to keep a local cache in event of network / service failure
+        # Whether to keep a local cache in event of network / service failure. Images are kept whatever
+        # this says while uploads are backing off, since they weren't tried
         self.delete_cache = delete_cache
         # Installation-specific file naming conventions set in config.yaml
         self.config = config
+        self.quota = quota
 
         self._initialize_directories()
+        for directory in [self.pending_directory, self.thumbnail_directory]:
+            remove_staging(directory)
+        self.journal = UploadJournal(self.base_directory / "uploads.db")
+        self.journal.reconcile(self.pending_directory)
+        self.journal.reconcile(self.thumbnail_directory)
+        self.enforce_quota()
 
     def _initialize_directories(self) -> None:
         """Creates app directories if they don't exist already"""
-        for path in [self.base_directory, self.pending_directory, self.log_directory]:
+        for path in [self.base_directory, self.pending_directory, self.thumbnail_directory, self.log_directory]:
             if not path.exists():
                 os.makedirs(path)
 
     def get_pending_image_path(self, *args, **kwargs) -> Path:
-        """Gets a new image filepath with a timestamp
+        """Gets a new image filepath with a timestamp, see get_image_name
         Returns:
             A path in the pending image folder
         """
         return self.pending_directory / self.get_image_name(*args, **kwargs)
 
-    def get_pending_images(self) -> List[Path]:
-        """Get a list of pending paths
+    def thumbnail_path(self, image: Path) -> Path:
+        """Gets the path of an image's thumbnail
+        Args:
+            image: Path of the image
+        Returns:
+            A path in the pending thumbnail folder
+        """
+        return self.thumbnail_directory / Path(image).name
+
+    def is_thumbnail(self, image: Path) -> bool:
+        """Checks whether a pending path is a thumbnail
+        Args:
+            image: Path of the image
+        Returns:
+            True if the path is in the pending thumbnail folder
+        """
+        return Path(image).parent == self.thumbnail_directory
+
+    def get_pending_images(self, limit: int | None = None) -> List[Path]:
+        """Get a list of pending paths from the upload journal, thumbnails first and then oldest first
+        Args:
+            limit: Maximum number of paths to return
         Returns:
             A list of Path objects
         """
-        return [self.pending_directory / x for x in os.listdir(self.pending_directory.absolute())]
+        images = [entry["path"] for entry in self.journal.pending()]
+        images.sort(key=lambda image: not self.is_thumbnail(image))
+        return images[:limit]
+
+    def get_backlog_stats(self) -> BacklogStats:
+        """Summarises the images waiting to be uploaded, not counting thumbnails
+        Returns:
+            The number of images, their total size and the oldest capture time
+        """
+        return self.journal.stats(self.pending_directory)
+
+    def record_capture(
+        self, image: Path, digests: Digests | None = None, metadata: CaptureMetadata | None = None
+    ) -> None:
+        """Adds a completely written image to the upload journal, evicting older images if
+        the quota is exceeded
+        Args:
+            image: Path of the new image
+            digests: Content hashes of the image, it is hashed if they aren't given
+            metadata: How and when the image was captured
+        """
+        self.journal.add(image, digests=digests or file_digests(image), metadata=metadata)
+        self.enforce_quota()
+
+    def enforce_quota(self, disk_full: bool = False) -> List[Path]:
+        """Deletes images chosen by the quota's eviction policy if the backlog is over budget.
+        Uses the sizes recorded in the journal, so nothing is listed or statted
+        Args:
+            disk_full: The disk filled up before the backlog reached its quota, evicts as if it just had
+        Returns:
+            The images deleted
+        """
+        if self.quota is None:
+            if disk_full:
+                logger.error("Disk is full and there's no quota to evict images by")
+            return []
+        used = self.journal.stats(self.pending_directory)["bytes"]
+        max_bytes = min(self.quota.max_bytes, used - 1) if disk_full else self.quota.max_bytes
+        if used <= max_bytes:
+            return []
+
+        backlog = [entry for entry in self.journal.pending() if not self.is_thumbnail(entry["path"])]
+        evicted = self.quota.select(backlog, used, max_bytes)
+        for image in evicted:
+            # The thumbnail is kept, it costs little and still shows the scene
+            self.remove_image(image)
+        logger.warning(
+            f"Backlog of {used / 1024 / 1024:.1f}MB is over its {max_bytes / 1024 / 1024:.1f}MB quota, "
+            f"evicted {len(evicted)} images"
+        )
+        return evicted
+
+    def spill(self, image: InMemoryImage) -> Path:
+        """Writes an image captured to memory into the pending directory and records it
+        Args:
+            image: The image in memory
+        Returns:
+            Path of the written image
+        """
+        path = self.spill_path(image)
+        write_atomic(path, image.data)
+        self.record_capture(path, digests=bytes_digests(image.data), metadata=image.metadata)
+        return path
+
+    def spill_path(self, image: InMemoryImage) -> Path:
+        """Gets the path an image captured to memory is written to if it isn't uploaded
+        Args:
+            image: The image in memory
+        Returns:
+            A path in the pending thumbnail folder if the frame was downgraded, the pending image folder otherwise
+        """
+        path = self.pending_directory / image.name
+        return self.thumbnail_path(path) if image.thumbnail else path
+
+    def remove_image(self, image: Path) -> None:
+        """Deletes an image and its journal entry
+        Args:
+            image: Path of the image
+        """
+        if os.path.exists(image):
+            os.remove(image)
+        self.journal.remove(image)
 
-    def get_image_name(self) -> str:
-        """Gets a filename using the SE_CARGN_01_PCAM_E format with timestamp
+    def get_image_name(self, captured: datetime | None = None) -> str:
+        """Gets a filename using the SE_CARGN_01_PCAM_E format with a UTC timestamp
+        Args:
+            captured: When the image was captured, defaults to now
         Returns:
             A filename string in format: SE_CARGN_01_PCAM_E_YYYYMMDD_HHMMSS
         """
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if captured is None:
+            captured = datetime.now(timezone.utc)
+        timestamp = captured.astimezone(timezone.utc).strftime(NAME_TIME_FORMAT)
         config = self.config
         # TODO should 01 be part of the camera ID?
         # https://github.com/NERC-CEH/FDRI_RaspberryPi_Scripts/issues/12
@@ -78,25 +242,187 @@ class S3ImageManager(ImageManager):
     s3_manager: S3Manager
     """S3 manager object for handling credentials and uploads"""
 
-    def __init__(self, bucket_name: str, s3_manager: S3Manager, *args, **kwargs) -> None:
+    upload_workers: int
+    """Number of images uploaded concurrently"""
+
+    throughput: ThroughputMeter
+    """Measured upload throughput"""
+
+    recompression: RecompressionPolicy | None
+    """Shrinks older backlog images to fit the measured throughput, None uploads them as captured"""
+
+    thumbnail_width: int | None
+    """Width in pixels of the thumbnail made of each capture, None doesn't make them"""
+
+    bundling: BundlePolicy | None
+    """Groups full size images into bundles uploaded as one object, None uploads them one at a time"""
+
+    capture_manifest: CaptureManifest | None
+    """Per-day manifests of the uploaded images, None doesn't keep them"""
+
+    def __init__(
+        self,
+        bucket_name: str,
+        s3_manager: S3Manager,
+        *args,
+        upload_workers: int = 1,
+        recompression: RecompressionPolicy | None = None,
+        thumbnail_width: int | None = None,
+        bundling: BundlePolicy | None = None,
+        capture_manifest: CaptureManifest | None = None,
+        **kwargs,
+    ) -> None:
         """
         Args:
             bucket_name: S3 bucket that is written to
             s3_manager: The S3 management object
-
+            upload_workers: Number of images uploaded concurrently, 1 uploads them one at a time
+            recompression: Shrinks older backlog images to fit the measured throughput
+            thumbnail_width: Width in pixels of a thumbnail made of each capture and uploaded
+                ahead of the full size images, None doesn't make them
+            bundling: Groups full size images into bundles uploaded as one object
+            capture_manifest: Per-day manifests of the uploaded images, uploaded after each batch
         """
         self.bucket_name = bucket_name
         self.s3_manager = s3_manager
+        self.upload_workers = max(1, upload_workers)
+        self.throughput = ThroughputMeter()
+        self.recompression = recompression
+        self.thumbnail_width = thumbnail_width
+        self.bundling = bundling
+        self.capture_manifest = capture_manifest
         super().__init__(*args, **kwargs)
 
-    def partition_path(self, image: str) -> None:
+    def image_capture_time(self, image: Path) -> datetime:
+        """Gets when an image was captured, from the upload journal, or from its name if it isn't
+        journaled such as a bundle. Names before the capture time was put in them in UTC are in
+        local time, but those images were journaled with the time they were written
+        Args:
+            image: Path of the image, thumbnail or bundle
+        Returns:
+            An aware UTC datetime, now if the capture time isn't known
+        """
+        entry = self.journal.get(Path(image))
+        if entry is not None and entry["metadata"]:
+            return capture_time(entry["metadata"])
+        if entry is not None:
+            return datetime.fromtimestamp(entry["captured"], timezone.utc)
+        captured = name_time(Path(image).name)
+        if captured is not None:
+            return captured
+        return datetime.now(timezone.utc)
+
+    def partition_path(self, image: str, captured: datetime | None = None) -> str:
         """Accepts an absolute path to the image
-        Returns the partitioned path with just the filename appended"""
+        Returns the partitioned path with just the filename appended, dated by the UTC day
+        the image was captured rather than when it's uploaded"""
         config = self.config
         filename = Path(image).name
-        return f"catchment={config.catchment}/site={config.site}/compound=01/type=PCAM/direction={config.direction}/date={datetime.now().strftime('%Y-%m-%d')}/{filename}"  # noqa: E501
+        image_type = "PCAM_THUMB" if self.is_thumbnail(image) else "PCAM"
+        if captured is None:
+            captured = self.image_capture_time(Path(image))
+        day = captured.astimezone(timezone.utc).strftime("%Y-%m-%d")
+        return f"catchment={config.catchment}/site={config.site}/compound=01/type={image_type}/direction={config.direction}/date={day}/{filename}"  # noqa: E501
+
+    def capture_manifest_key(self, day: str) -> str:
+        """Gets the key of the manifest of the images uploaded on a day
+        Args:
+            day: The day as YYYY-MM-DD
+        Returns:
+            A key in its own type partition, next to the images of the day
+        """
+        config = self.config
+        filename = f"{config.catchment}_{config.site}_01_PCAM_{config.direction}_{day.replace('-', '')}.jsonl"
+        return f"catchment={config.catchment}/site={config.site}/compound=01/type=PCAM_MANIFEST/direction={config.direction}/date={day}/{filename}"  # noqa: E501
+
+    def record_capture(
+        self,
+        image: Path,
+        digests: Digests | None = None,
+        metadata: CaptureMetadata | None = None,
+        thumbnail: bool = True,
+    ) -> None:
+        """Adds a completely written image to the upload journal, along with its thumbnail
+        Args:
+            image: Path of the new image
+            digests: Content hashes of the image, it is hashed if they aren't given
+            metadata: How and when the image was captured
+            thumbnail: Whether to make a thumbnail, False for images whose thumbnail is handled. Thumbnails
+                don't get one
+        """
+        super().record_capture(image, digests=digests, metadata=metadata)
+        if self.thumbnail_width is None or not thumbnail or self.is_thumbnail(image):
+            return
+        thumbnail = self.thumbnail_path(image)
+        try:
+            make_thumbnail(image, self.thumbnail_width, destination=thumbnail)
+        except Exception as e:
+            logger.warning(f"Failed to make a thumbnail of {image}: {e}")
+            return
+        self.journal.add(thumbnail, digests=file_digests(thumbnail), metadata=metadata)
+
+    def reconcile_uploads(self) -> List[Path]:
+        """Removes pending images that are already in the bucket with the same contents, such as
+        when the app stopped between an upload and deleting the file. Each partition is listed
+        once and the ETags compared with the MD5 of the files. Images in a bundle whose tar and
+        manifest were both uploaded are compared with the manifest instead
+        Returns:
+            The images that were already uploaded
+        """
+        by_prefix: dict[str, list] = {}
+        for entry in self.journal.pending():
+            object_name = self.partition_path(entry["path"])
+            by_prefix.setdefault(object_name.rsplit("/", 1)[0] + "/", []).append((entry, object_name))
+
+        uploaded = []
+        unmatched = []
+        bundled: dict[str, BundleMember] = {}
+        for prefix, entries in by_prefix.items():
+            etags = self.s3_manager.list_etags(self.bucket_name, prefix)
+            if etags is None:
+                # Offline, everything is uploaded again later as normal
+                break
+            bundled.update(self._bundle_members(etags))
+            for entry, object_name in entries:
+                if not entry["path"].exists():
+                    continue
+                md5 = entry["md5"] or file_digests(entry["path"])["md5"]
+                if object_name in etags and etags[object_name] == md5:
+                    self.remove_image(entry["path"])
+                    uploaded.append(entry["path"])
+                elif not self.is_thumbnail(entry["path"]):
+                    unmatched.append(entry)
 
-    def upload_pending(self, debug: bool = False) -> None:
+        # A bundle is in the partition of its first image, so every listing is checked first
+        for entry in unmatched:
+            member = bundled.get(entry["path"].name)
+            if member is None or member["size"] != entry["size"]:
+                continue
+            if member["sha256"] == (entry["sha256"] or file_digests(entry["path"])["sha256"]):
+                self.remove_image(entry["path"])
+                uploaded.append(entry["path"])
+
+        if uploaded:
+            logger.info(f"{len(uploaded)} pending images were already uploaded, removed them")
+        return uploaded
+
+    def _bundle_members(self, etags: dict[str, str]) -> dict[str, BundleMember]:
+        """Downloads the manifests of the complete bundles in a listing
+        Args:
+            etags: ETags of the objects in a partition, by key
+        Returns:
+            The images in the bundles, by filename
+        """
+        members: dict[str, BundleMember] = {}
+        for object_name in etags:
+            if not object_name.endswith(".tar") or manifest_key(object_name) not in etags:
+                continue
+            manifest = self.s3_manager.download_bytes(self.bucket_name, manifest_key(object_name))
+            if manifest is not None:
+                members.update((member["name"], member) for member in json.loads(manifest)["members"])
+        return members
+
+    def upload_pending(self, debug: bool = False) -> List[UploadResult]:
         """Upload files from the pending directory to S3
         Files are deleted after a successful upload
 
@@ -104,25 +430,378 @@ class S3ImageManager(ImageManager):
 
         Args:
             debug: Flag to enable debugging mode
+        Returns:
+            A list of results, one per pending image
         """
         pending_images = self.get_pending_images()
-        if len(pending_images) > 0:
-            self.s3_manager.assume_role()
-            for image in pending_images:
-                try:
-                    bucket_path = self.partition_path(image)
-
-                    upload_successful = False
-                    if debug:
-                        logger.debug(f"Pretended to upload image {image} to bucket {self.bucket_name}")
-                    else:
-                        upload_successful = self.s3_manager.upload(image, self.bucket_name, bucket_path)
-                    if upload_successful or self.delete_cache:
-                        os.remove(image)
-
-                except Exception as e:
-                    logger.exception(f"Failed to upload image: {image}", exc_info=e)
-        # Note on removing images due to size constraint as images are <200 kb with 10 gb it would take
-        # ~20 years to fill
-        else:
+        # The disk quota, if set, stops a long outage filling the card
+        if len(pending_images) == 0:
             logger.info("No images to upload")
+            return []
+
+        return self.upload_images(pending_images, debug=debug)
+
+    def upload_images(self, images: List[Path], debug: bool = False) -> List[UploadResult]:
+        """Upload a list of images, using up to upload_workers threads that share one S3 client.
+        The thumbnails of the images are uploaded first, then the full size images, bundled
+        together if there is a bundling policy
+        Args:
+            images: Absolute paths of the images to upload
+            debug: Flag to enable debugging mode
+        Returns:
+            A list of results, thumbnails first, then bundled images and then in the same order as the images
+        """
+        full_size = [image for image in images if not self.is_thumbnail(image)]
+        thumbnails = [image for image in images if self.is_thumbnail(image)]
+        thumbnails += [self.thumbnail_path(image) for image in full_size if self.thumbnail_path(image).exists()]
+        thumbnails = list(dict.fromkeys(thumbnails))
+
+        self.recompress_backlog()
+        sizes = {image: os.path.getsize(image) for image in thumbnails + full_size if os.path.exists(image)}
+        start = time.monotonic()
+        self.s3_manager.assume_role()
+        # Every thumbnail is finished before the first full size image starts
+        results = self._upload_tier(thumbnails, debug)
+        results += self._upload_bundles(full_size, debug)
+        bundled = {result["image"] for result in results}
+        results += self._upload_tier([image for image in full_size if image not in bundled], debug)
+        elapsed = time.monotonic() - start
+
+        uploaded = sum(result["uploaded"] for result in results)
+        sent = sum(sizes.get(result["image"], 0) for result in results if result["uploaded"])
+        if not debug:
+            self.throughput.record(sent, elapsed)
+        logger.info(f"Uploaded {uploaded}/{len(results)} images ({sent / 1024:.0f}KB) in {elapsed:.2f}s")
+        if self.s3_manager.breaker is not None:
+            logger.info(f"Upload circuit breaker: {self.s3_manager.breaker.snapshot()}")
+        self.sync_manifest(debug)
+        return results
+
+    def upload_capture(self, image: InMemoryImage, debug: bool = False) -> List[UploadResult]:
+        """Uploads an image straight from memory, along with its thumbnail first. Anything that
+        can't be uploaded is written to the pending directories to be uploaded later, unless the
+        cache isn't kept. The capture manifest isn't uploaded, call sync_manifest after the batch
+        Args:
+            image: The image in memory
+            debug: Flag to enable debugging mode
+        Returns:
+            The results, thumbnail first
+        """
+        self.s3_manager.assume_role()
+        if image.thumbnail:
+            # Downgraded to a thumbnail already, it's only uploaded as one
+            return [self._upload_bytes(self.spill_path(image), image.data, image.metadata, debug)]
+        results = []
+        if self.thumbnail_width is not None:
+            try:
+                thumbnail = thumbnail_bytes(image.data, self.thumbnail_width)
+                results.append(
+                    self._upload_bytes(self.thumbnail_path(Path(image.name)), thumbnail, image.metadata, debug)
+                )
+            except Exception as e:
+                logger.warning(f"Failed to make a thumbnail of {image.name}: {e}")
+        results.append(self._upload_bytes(self.pending_directory / image.name, image.data, image.metadata, debug))
+        return results
+
+    def sync_manifest(self, debug: bool = False) -> None:
+        """Uploads the manifests of the days that changed
+        Args:
+            debug: Flag to enable debugging mode, nothing is uploaded
+        """
+        if self.capture_manifest is None or debug:
+            return
+        try:
+            self.capture_manifest.sync(self.s3_manager, self.bucket_name, self.capture_manifest_key)
+        except Exception as e:
+            logger.exception("Failed to upload the capture manifest", exc_info=e)
+
+    def _add_to_manifest(
+        self,
+        object_name: str,
+        image: Path,
+        size: int,
+        captured: float,
+        sha256: str | None,
+        header: bytes | None = None,
+        offset: int | None = None,
+        metadata: CaptureMetadata | None = None,
+    ) -> None:
+        """Records an uploaded image in the capture manifest, if one is kept
+        Args:
+            object_name: Key of the object holding the image
+            image: Path of the image
+            size: Size of the image in bytes
+            captured: Unix time of the capture
+            sha256: Base64 SHA-256 of the image
+            header: Start of the image, read for its dimensions, the image is read for them if not given
+            offset: Byte offset of the image in its bundle
+            metadata: How and when the image was captured
+        """
+        if self.capture_manifest is None:
+            return
+        try:
+            if header is None:
+                header = jpeg.read_header(image)
+            self.capture_manifest.append(
+                make_record(object_name, image.name, size, captured, sha256, header, offset, metadata=metadata)
+            )
+        except Exception as e:
+            logger.exception(f"Failed to add {image.name} to the capture manifest", exc_info=e)
+
+    def _upload_bytes(
+        self, image: Path, data: bytes, metadata: CaptureMetadata | None = None, debug: bool = False
+    ) -> UploadResult:
+        """Uploads an image from memory, writing it to disk if the upload fails
+        Args:
+            image: Path the image is written to if it isn't uploaded
+            data: The encoded image
+            metadata: How and when the image was captured
+            debug: Flag to enable debugging mode
+        Returns:
+            The result of the upload, deleted if the image isn't on disk
+        """
+        result: UploadResult = {"image": image, "object_name": "", "uploaded": False, "deleted": False}
+        digests = bytes_digests(data)
+        captured = capture_time(metadata) if metadata else self.image_capture_time(image)
+        try:
+            result["object_name"] = self.partition_path(image, captured)
+            if debug:
+                logger.debug(f"Pretended to upload image {image.name} to bucket {self.bucket_name}")
+                result["uploaded"] = True
+            elif self.s3_manager.available():
+                result["uploaded"] = self.s3_manager.upload_bytes(
+                    data, self.bucket_name, result["object_name"], checksum_sha256=digests["sha256"]
+                )
+                if not result["uploaded"] and self.delete_cache:
+                    result["deleted"] = True
+                    return result
+            if result["uploaded"]:
+                self._add_to_manifest(
+                    result["object_name"],
+                    image,
+                    len(data),
+                    captured.timestamp(),
+                    digests["sha256"],
+                    header=data,
+                    metadata=metadata,
+                )
+                result["deleted"] = True
+                return result
+        except Exception as e:
+            logger.exception(f"Failed to upload image: {image.name}", exc_info=e)
+
+        # Offline or failed, keep it for a later batch. Its thumbnail is uploaded or spilled separately
+        write_atomic(image, data)
+        self.record_capture(image, digests=digests, metadata=metadata, thumbnail=False)
+        return result
+
+    def recompress_backlog(self) -> int:
+        """Recompresses older backlog images when the backlog won't upload within the
+        recompression budget at the measured throughput
+        Returns:
+            Number of bytes saved
+        """
+        if self.recompression is None or self.throughput.rate is None:
+            return 0
+        breaker = self.s3_manager.breaker
+        if breaker is not None and breaker.state == CircuitState.OPEN:
+            # Nothing can be uploaded, so there's nothing to gain yet
+            return 0
+
+        saved = 0
+        # Thumbnails are already small
+        backlog = [entry for entry in self.journal.pending() if not self.is_thumbnail(entry["path"])]
+        targets = self.recompression.targets(backlog, self.throughput.rate)
+        for entry in backlog:
+            # Each image is only re-encoded once, again would add generation loss for little gain
+            if entry["path"] not in targets or entry["recompressed"]:
+                continue
+            try:
+                size = recompress_jpeg(
+                    entry["path"],
+                    targets[entry["path"]],
+                    min_quality=self.recompression.min_quality,
+                    min_width=self.recompression.min_width,
+                )
+            except Exception as e:
+                logger.exception(f"Failed to recompress {entry['path']}", exc_info=e)
+                continue
+            if size is not None:
+                saved += entry["size"] - size
+                self.journal.update_file(entry["path"], file_digests(entry["path"]))
+            self.journal.mark_recompressed(entry["path"])
+
+        if saved:
+            logger.info(
+                f"Recompressed backlog by {saved / 1024:.0f}KB to fit {self.throughput.rate / 1024:.1f}KB/s uplink"
+            )
+        return saved
+
+    def _upload_tier(self, images: List[Path], debug: bool = False) -> List[UploadResult]:
+        """Uploads images one per request, using up to upload_workers threads
+        Args:
+            images: Absolute paths of the images
+            debug: Flag to enable debugging mode
+        Returns:
+            A list of results in the same order as the images
+        """
+        if self.upload_workers > 1 and len(images) > 1:
+            with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+                return list(executor.map(lambda image: self._upload_image(image, debug), images))
+        return [self._upload_image(image, debug) for image in images]
+
+    def _upload_bundles(self, images: List[Path], debug: bool = False) -> List[UploadResult]:
+        """Uploads the images the bundling policy groups together
+        Args:
+            images: Absolute paths of full size images
+            debug: Flag to enable debugging mode
+        Returns:
+            A result for each image that was in a bundle
+        """
+        if self.bundling is None:
+            return []
+        wanted = set(images)
+        backlog = []
+        for entry in self.journal.pending():
+            if entry["path"] not in wanted or not entry["path"].exists():
+                continue
+            if entry["path"].stat().st_size != entry["size"]:
+                # Rewritten since it was journaled, the bundle layout has to use the new size and hash
+                logger.warning(f"{entry['path']} changed size since it was journaled, hashing it again")
+                self.journal.update_file(entry["path"], file_digests(entry["path"]))
+                backlog.append(self.journal.get(entry["path"]) or entry)
+            else:
+                backlog.append(entry)
+        results = []
+        for entries in self.bundling.groups(backlog):
+            results += self._upload_bundle(entries, debug)
+        return results
+
+    def _upload_bundle(self, entries: List[JournalEntry], debug: bool = False) -> List[UploadResult]:
+        """Uploads images as a tar streamed from disk, followed by its manifest. The images are only
+        removed once both are uploaded, or the tar failed and the cache isn't kept. An image that
+        changed while it was read fails the whole bundle, so it's uploaded again with the next batch
+        Args:
+            entries: Journal entries of the images, oldest first
+            debug: Flag to enable debugging mode
+        Returns:
+            The result of each image, all uploaded or none
+        """
+        images = [entry["path"] for entry in entries]
+        object_name = self.partition_path(self.pending_directory / f"{images[0].stem}_{len(images)}.tar")
+        results: List[UploadResult] = [
+            {"image": image, "object_name": object_name, "uploaded": False, "deleted": False} for image in images
+        ]
+        bundle = BundleStream(entries)
+        try:
+            if debug:
+                logger.debug(f"Pretended to upload bundle of {len(images)} images to bucket {self.bucket_name}")
+                uploaded = True
+            elif not self.s3_manager.available():
+                return results
+            else:
+                # Buffered so every read returns as much as was asked for, as the S3 transfer expects
+                with io.BufferedReader(bundle) as stream:
+                    uploaded = self.s3_manager.upload_stream(stream, self.bucket_name, object_name)
+                if bundle.changed is not None:
+                    # The transfer swallows the read error, but nothing of the bundle can be trusted
+                    self.journal.update_file(bundle.changed, file_digests(bundle.changed))
+                    raise IOError(f"{bundle.changed} changed while it was being bundled")
+                if uploaded and not self.s3_manager.upload_bytes(
+                    json.dumps(bundle.manifest).encode(), self.bucket_name, manifest_key(object_name)
+                ):
+                    # Kept whatever the cache setting, so the bundle is uploaded again along with its manifest
+                    logger.warning(f"Failed to upload the manifest of {object_name}, keeping its images")
+                    for image in images:
+                        self.journal.record_failure(image, "bundle manifest upload failed")
+                    return results
+        except Exception as e:
+            logger.exception(f"Failed to upload bundle: {object_name}", exc_info=e)
+            for image in images:
+                self.journal.record_failure(image, str(e))
+            return results
+
+        for result, entry, member in zip(results, entries, bundle.manifest["members"]):
+            result["uploaded"] = uploaded
+            if uploaded and self.capture_manifest is not None:
+                self._add_to_manifest(
+                    object_name,
+                    entry["path"],
+                    entry["size"],
+                    entry["captured"],
+                    entry["sha256"],
+                    offset=member["offset"],
+                    metadata=entry["metadata"],
+                )
+            if uploaded or self.delete_cache:
+                self.remove_image(result["image"])
+                result["deleted"] = True
+            else:
+                self.journal.record_failure(result["image"], "bundle upload failed")
+        return results
+
+    def _checksum(self, image: Path) -> str | None:
+        """Gets the SHA-256 of a pending image from the journal, hashing it if it isn't known
+        Args:
+            image: Path of the image
+        Returns:
+            The base64 SHA-256, or None if the file is missing
+        """
+        entry = self.journal.get(image)
+        if entry is not None and entry["sha256"]:
+            return entry["sha256"]
+        if not os.path.exists(image):
+            return None
+        digests = file_digests(image)
+        if entry is not None:
+            self.journal.update_file(image, digests)
+        return digests["sha256"]
+
+    def _upload_image(self, image: Path, debug: bool = False) -> UploadResult:
+        """Uploads a single image and removes it if it was uploaded or the cache isn't kept
+        Args:
+            image: Absolute path of the image
+            debug: Flag to enable debugging mode
+        Returns:
+            The result of the upload
+        """
+        result: UploadResult = {"image": image, "object_name": "", "uploaded": False, "deleted": False}
+        try:
+            bucket_path = self.partition_path(image)
+            result["object_name"] = bucket_path
+
+            if debug:
+                logger.debug(f"Pretended to upload image {image} to bucket {self.bucket_name}")
+            elif not self.s3_manager.available():
+                # Offline and backing off, keep the image without counting an attempt, even if the cache
+                # isn't kept, since nothing failed
+                return result
+            else:
+                result["uploaded"] = self.s3_manager.upload(
+                    image, self.bucket_name, bucket_path, checksum_sha256=self._checksum(image)
+                )
+            if result["uploaded"] and self.capture_manifest is not None:
+                entry = self.journal.get(image)
+                if entry is not None:
+                    self._add_to_manifest(
+                        bucket_path,
+                        image,
+                        entry["size"],
+                        entry["captured"],
+                        entry["sha256"],
+                        metadata=entry["metadata"],
+                    )
+                else:
+                    self._add_to_manifest(
+                        bucket_path, image, os.path.getsize(image), self.image_capture_time(image).timestamp(), None
+                    )
+            if result["uploaded"] or self.delete_cache:
+                self.remove_image(image)
+                result["deleted"] = True
+            else:
+                self.journal.record_failure(image, "upload failed")
+
+        except Exception as e:
+            logger.exception(f"Failed to upload image: {image}", exc_info=e)
+            self.journal.record_failure(image, str(e))
+        return result
@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, TypedDict
+
+from raspberrycam.files import Digests, is_staging
+from raspberrycam.metadata import CaptureMetadata, capture_time
+
+logger = logging.getLogger(__name__)
+
+
+class JournalEntry(TypedDict):
+    """Typed dictionary for an image waiting to be uploaded"""
+
+    path: Path
+    captured: float
+    size: int
+    attempts: int
+    last_error: str | None
+    md5: str | None
+    sha256: str | None
+    metadata: CaptureMetadata | None
+    recompressed: bool
+    """Whether the image has been through backlog recompression"""
+
+
+class BacklogStats(TypedDict):
+    """Typed dictionary summarising the images waiting to be uploaded"""
+
+    images: int
+    bytes: int
+    oldest: float | None
+    """Unix time of the oldest pending capture"""
+
+
+class UploadJournal:
+    """Persistent queue of captured images waiting to be uploaded, stored in SQLite so the
+    pending directory never has to be listed"""
+
+    database: Path
+    """Path to the SQLite database"""
+
+    def __init__(self, database: Path) -> None:
+        """
+        Args:
+            database: Path to the SQLite database, created if it doesn't exist
+        """
+        self.database = database
+        self._lock = threading.Lock()
+        # Shared between the capture and upload threads, access is serialised with the lock
+        self._connection = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+        # Write ahead logging needs fewer syncs to the SD card than the default rollback journal
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS pending (
+                path TEXT PRIMARY KEY,
+                captured REAL NOT NULL,
+                size INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )"""
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS pending_captured ON pending (captured)")
+        # Journals from before content hashes and capture metadata were recorded
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(pending)")}
+        for column in ["md5", "sha256", "metadata"]:
+            if column not in columns:
+                self._connection.execute(f"ALTER TABLE pending ADD COLUMN {column} TEXT")
+        if "recompressed" not in columns:
+            self._connection.execute("ALTER TABLE pending ADD COLUMN recompressed INTEGER NOT NULL DEFAULT 0")
+
+    def add(
+        self,
+        image: Path,
+        captured: Optional[float] = None,
+        digests: Optional[Digests] = None,
+        metadata: Optional[CaptureMetadata] = None,
+    ) -> None:
+        """Records a completely written image
+        Args:
+            image: Path to the image
+            captured: Unix time of the capture, defaults to the time in the metadata or now
+            digests: Content hashes of the image, if they are known
+            metadata: How and when the image was captured, if it's known
+        """
+        if captured is None:
+            captured = capture_time(metadata).timestamp() if metadata else time.time()
+        md5, sha256 = (digests["md5"], digests["sha256"]) if digests else (None, None)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pending (path, captured, size, md5, sha256, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(image), captured, os.path.getsize(image), md5, sha256, json.dumps(metadata) if metadata else None),
+            )
+
+    def get(self, image: Path) -> Optional[JournalEntry]:
+        """Gets the entry of a pending image
+        Args:
+            image: Path to the image
+        Returns:
+            The journal entry, or None if the image isn't pending
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT path, captured, size, attempts, last_error, md5, sha256, metadata, recompressed "
+                "FROM pending WHERE path = ?",
+                (str(image),),
+            ).fetchone()
+        return self._entry(row) if row else None
+
+    def remove(self, image: Path) -> None:
+        """Removes an image that has been uploaded or deleted
+        Args:
+            image: Path to the image
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM pending WHERE path = ?", (str(image),))
+
+    def update_file(self, image: Path, digests: Optional[Digests] = None) -> None:
+        """Records the new size and content hashes of an image that has been rewritten
+        Args:
+            image: Path to the image
+            digests: Content hashes of the new contents, if they are known
+        """
+        md5, sha256 = (digests["md5"], digests["sha256"]) if digests else (None, None)
+        with self._lock:
+            self._connection.execute(
+                "UPDATE pending SET size = ?, md5 = ?, sha256 = ? WHERE path = ?",
+                (os.path.getsize(image), md5, sha256, str(image)),
+            )
+
+    def mark_recompressed(self, image: Path) -> None:
+        """Records that an image has been through backlog recompression, so it isn't re-encoded again
+        Args:
+            image: Path to the image
+        """
+        with self._lock:
+            self._connection.execute("UPDATE pending SET recompressed = 1 WHERE path = ?", (str(image),))
+
+    def record_failure(self, image: Path, error: str) -> None:
+        """Records a failed upload attempt
+        Args:
+            image: Path to the image
+            error: Description of the failure
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE pending SET attempts = attempts + 1, last_error = ? WHERE path = ?", (error, str(image))
+            )
+
+    def pending(self, limit: Optional[int] = None) -> List[JournalEntry]:
+        """Gets the images waiting to be uploaded, oldest capture first
+        Args:
+            limit: Maximum number of images to return
+        Returns:
+            A list of journal entries
+        """
+        query = (
+            "SELECT path, captured, size, attempts, last_error, md5, sha256, metadata, recompressed FROM pending "
+            "ORDER BY captured, path"
+        )
+        params: tuple = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        return [self._entry(row) for row in rows]
+
+    @staticmethod
+    def _entry(row: tuple) -> JournalEntry:
+        """Converts a database row to a journal entry"""
+        path, captured, size, attempts, last_error, md5, sha256, metadata, recompressed = row
+        return {
+            "path": Path(path),
+            "captured": captured,
+            "size": size,
+            "attempts": attempts,
+            "last_error": last_error,
+            "md5": md5,
+            "sha256": sha256,
+            "metadata": json.loads(metadata) if metadata else None,
+            "recompressed": bool(recompressed),
+        }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def total_size(self) -> int:
+        """Total size in bytes of the pending images"""
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM pending").fetchone()[0]
+
+    def stats(self, directory: Optional[Path] = None) -> BacklogStats:
+        """Summarises the pending images
+        Args:
+            directory: Only count images in this directory, defaults to all of them
+        Returns:
+            The number of images, their total size and the oldest capture time
+        """
+        query = "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(captured) FROM pending"
+        params: tuple = ()
+        if directory is not None:
+            prefix = os.path.join(directory, "")
+            query += " WHERE substr(path, 1, ?) = ?"
+            params = (len(prefix), prefix)
+        with self._lock:
+            images, size, oldest = self._connection.execute(query, params).fetchone()
+        return {"images": images, "bytes": size, "oldest": oldest}
+
+    def reconcile(self, directory: Path) -> None:
+        """Brings the journal in line with the directory, only needed at start up.
+        Images on disk that aren't journaled are added and entries in the directory whose file
+        is gone are dropped
+        Args:
+            directory: The pending images directory
+        """
+        on_disk = {}
+        for entry in os.scandir(directory):
+            # Partly written files are still under their staging name
+            if entry.is_file() and not is_staging(Path(entry.path)) and entry.stat().st_size > 0:
+                on_disk[str(Path(entry.path))] = entry.stat()
+
+        with self._lock:
+            journaled = {
+                row[0]
+                for row in self._connection.execute("SELECT path FROM pending")
+                if Path(row[0]).parent == directory
+            }
+            missing = journaled - on_disk.keys()
+            added = on_disk.keys() - journaled
+            self._connection.executemany("DELETE FROM pending WHERE path = ?", [(path,) for path in missing])
+            self._connection.executemany(
+                "INSERT INTO pending (path, captured, size) VALUES (?, ?, ?)",
+                [(path, on_disk[path].st_mtime, on_disk[path].st_size) for path in added],
+            )
+
+        if missing or added:
+            logger.info(f"Upload journal reconciled: {len(added)} images added, {len(missing)} missing images dropped")
+
+    def close(self) -> None:
+        """Closes the database connection"""
+        with self._lock:
+            self._connection.close()
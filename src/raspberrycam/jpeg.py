@@ -0,0 +1,155 @@
+"""Reads the structure of JPEG files without decoding them. A JPEG is a list of marker
+segments, each a 0xFF byte, a marker byte and, for most markers, a two byte big-endian length
+that counts itself, followed by the entropy coded image data after the start of scan"""
+
+from pathlib import Path
+from typing import Iterator, List, NamedTuple
+
+SOI = 0xD8
+"""Start of image"""
+SOS = 0xDA
+"""Start of scan, the image data follows its header"""
+EOI = 0xD9
+"""End of image"""
+APP0 = 0xE0
+"""Application segment used by JFIF, which has to come first"""
+APP1 = 0xE1
+"""Application segment used by EXIF and XMP"""
+
+MAX_PAYLOAD = 65533
+"""Largest payload of a segment, its length field counts itself"""
+
+_STANDALONE = {0x01, *range(0xD0, 0xD8), SOI, EOI}
+"""Markers without a length or contents"""
+
+HEADER_SIZE = 256 * 1024
+"""Bytes read from the start of a file to be sure of its header, the segments before the image
+data are a few of at most 64KB each"""
+
+_START_OF_FRAME = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+"""Markers whose segment holds the image dimensions"""
+
+
+class Segment(NamedTuple):
+    """A marker segment in the JPEG header"""
+
+    marker: int
+    start: int
+    """Offset of the 0xFF byte"""
+    end: int
+    """Offset just past the segment"""
+
+
+def segments(data: bytes) -> Iterator[Segment]:
+    """Iterates over the marker segments before the image data, ending with the start of scan
+    Args:
+        data: The JPEG, or at least its header
+    Returns:
+        The segments in the order they appear
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG")
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            raise ValueError(f"Expected a marker at byte {position}")
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            position += 1
+            continue
+        if marker in _STANDALONE:
+            yield Segment(marker, position, position + 2)
+            position += 2
+            continue
+        end = position + 2 + int.from_bytes(data[position + 2 : position + 4], "big")
+        yield Segment(marker, position, end)
+        if marker == SOS:
+            return
+        position = end
+
+
+def dimensions(data: bytes) -> tuple[int, int] | None:
+    """Reads the width and height of a JPEG from its header
+    Args:
+        data: The JPEG, or at least its header
+    Returns:
+        The width and height in pixels, or None if they can't be found
+    """
+    try:
+        for segment in segments(data):
+            if segment.marker in _START_OF_FRAME and segment.start + 9 <= len(data):
+                height = int.from_bytes(data[segment.start + 5 : segment.start + 7], "big")
+                width = int.from_bytes(data[segment.start + 7 : segment.start + 9], "big")
+                return width, height
+    except ValueError:
+        return None
+    return None
+
+
+def read_header(path: Path) -> bytes:
+    """Reads the start of a JPEG file, enough for its header without reading the whole image
+    Args:
+        path: The JPEG
+    Returns:
+        Up to HEADER_SIZE bytes from the start of the file
+    """
+    with open(path, "rb") as f:
+        return f.read(HEADER_SIZE)
+
+
+def app_segment(marker: int, payload: bytes) -> bytes:
+    """Encodes an application segment
+    Args:
+        marker: The marker, e.g. APP1
+        payload: Contents of the segment, starting with its identifying header
+    Returns:
+        The encoded segment
+    """
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Segment payload of {len(payload)} bytes is over the {MAX_PAYLOAD} byte limit")
+    return bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def find_segments(data: bytes, marker: int, header: bytes) -> List[Segment]:
+    """Finds the segments with a marker whose payload starts with a header, such as the EXIF
+    segment, which is APP1 starting with Exif and two zero bytes
+    Args:
+        data: The JPEG
+        marker: The marker to look for
+        header: What the payload starts with
+    Returns:
+        The matching segments
+    """
+    return [
+        segment
+        for segment in segments(data)
+        if segment.marker == marker and data[segment.start + 4 : segment.start + 4 + len(header)] == header
+    ]
+
+
+def splice(data: bytes, inserted: List[bytes], removed: List[Segment] | None = None) -> bytes:
+    """Inserts segments into a JPEG without decoding it, after the start of image and any
+    JFIF segment, and removes others. The image data is copied as it is
+    Args:
+        data: The JPEG
+        inserted: Encoded segments to insert, see app_segment
+        removed: Segments of the JPEG to leave out
+    Returns:
+        The new JPEG
+    """
+    view = memoryview(data)
+    position = 2
+    for segment in segments(data):
+        if segment.marker != APP0:
+            break
+        position = segment.end
+
+    pieces: List[bytes | memoryview] = [view[:position], *inserted]
+    for segment in sorted(removed or [], key=lambda segment: segment.start):
+        if segment.start < position:
+            raise ValueError("Can't remove a segment from before the insertion point")
+        pieces.append(view[position : segment.start])
+        position = segment.end
+    pieces.append(view[position:])
+    return b"".join(pieces)
@@ -1,9 +1,11 @@
 import logging
-from datetime import date, datetime
-from typing import TypedDict
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time, tzinfo
+from typing import Hashable, TypedDict
 
 from astral import Observer
-from astral.sun import sun
+from astral.sun import elevation, sun
 from dateutil.tz import tzlocal
 
 logger = logging.getLogger(__name__)
@@ -27,26 +29,102 @@ class SunStats(TypedDict):
     dusk: datetime
 
 
+def _tz_key(tz: tzinfo | None) -> Hashable:
+    """Gets a hashable key for a timezone, some (e.g. dateutil's tzlocal) can't be hashed"""
+    try:
+        hash(tz)
+        return tz
+    except TypeError:
+        return repr(tz)
+
+
+class SunTable:
+    """Bounded least recently used table of sun statistics, keyed on location and date"""
+
+    maxsize: int
+    """Maximum number of dates kept, 0 disables the table"""
+
+    hits: int
+    """Number of lookups answered from the table"""
+
+    misses: int
+    """Number of lookups that needed a solar calculation"""
+
+    def __init__(self, maxsize: int = 32) -> None:
+        """
+        Args:
+            maxsize: Maximum number of dates kept, 0 disables the table
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._table: OrderedDict[Hashable, SunStats] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, observer: Observer, date: date) -> SunStats:
+        """Gets sun statistics, calculating them if they aren't in the table
+        Args:
+            observer: An observer or location to query
+            date: The date to query, a datetime returns times in its timezone
+        Returns:
+            A dictionary of sun statistics
+        """
+        if isinstance(date, datetime):
+            # Only the day and timezone affect the result, so every time of day shares one entry
+            date = datetime.combine(date.date(), time(), date.tzinfo)
+            key = (observer.latitude, observer.longitude, observer.elevation, date.date(), _tz_key(date.tzinfo))
+        else:
+            key = (observer.latitude, observer.longitude, observer.elevation, date, None)
+
+        with self._lock:
+            stats = self._table.get(key)
+            if stats is not None:
+                self.hits += 1
+                self._table.move_to_end(key)
+                return SunStats(**stats)
+
+        stats = Location._get_sun_stats(observer, date)
+        with self._lock:
+            self.misses += 1
+            if self.maxsize > 0:
+                self._table[key] = stats
+                while len(self._table) > self.maxsize:
+                    self._table.popitem(last=False)
+        return SunStats(**stats)
+
+
 class Location(Observer):
     """Location object used to calculate sun statistics"""
 
-    def __init__(self, latitude: float, longitude: float, *args, **kwargs):
+    def __init__(self, latitude: float, longitude: float, *args, cache_size: int = 32, **kwargs):
         """
         Args:
             latitude: The location latitude
             longitude: The location longitude
+            cache_size: Number of dates of sun statistics kept, 0 calculates them on every call
         """
         super().__init__(*args, **kwargs, latitude=latitude, longitude=longitude)
+        self.sun_table = SunTable(cache_size)
 
     def get_sun_stats(self, date: date) -> SunStats:
-        """Gets sun statistics at this location for a given date
+        """Gets sun statistics at this location for a given date, from the sun table
+        if they have been calculated before
         Args:
             date: The date to query
         Returns:
             A dictionary of sun statistics
         """
 
-        return Location._get_sun_stats(self, date)
+        return self.sun_table.get(self, date)
+
+    def sun_elevation(self, time: datetime) -> float:
+        """Gets the angle of the sun above the horizon at this location
+        Args:
+            time: The time to query, a naive time is taken as UTC
+        Returns:
+            The elevation in degrees, negative when the sun is below the horizon
+        """
+        return elevation(self, time)
 
     @staticmethod
     def _get_sun_stats(observer: Observer, date: date) -> SunStats:
@@ -0,0 +1,205 @@
+"""Keeps a manifest of the images uploaded each day, one JSON object per line, so downstream
+consumers can read one small object per day instead of listing the partitions. Records are
+appended locally as images are uploaded and each changed day is uploaded after a batch"""
+
+import json
+import logging
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, List, NotRequired, Set, TypedDict
+
+from raspberrycam import jpeg
+from raspberrycam.files import write_atomic
+from raspberrycam.metadata import CaptureMetadata
+from raspberrycam.s3 import S3Manager
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestRecord(TypedDict):
+    """Typed dictionary describing one uploaded image"""
+
+    key: str
+    """Key of the object holding the image, a bundle if offset is set"""
+    name: str
+    type: str
+    """The type partition of the key, PCAM or PCAM_THUMB"""
+    captured: str
+    """Capture time as an ISO 8601 UTC timestamp"""
+    size: int
+    sha256: str | None
+    offset: NotRequired[int]
+    """Byte offset of the image in its bundle"""
+    width: NotRequired[int]
+    height: NotRequired[int]
+    sun_elevation: NotRequired[float | None]
+    """Degrees of the sun above the horizon when the image was captured"""
+    camera: NotRequired[dict]
+    """Settings the camera captured with"""
+
+
+def _partition(key: str, name: str) -> str | None:
+    """Reads the value of a name=value partition from a key"""
+    match = re.search(rf"(?:^|/){name}=([^/]+)/", key)
+    return match.group(1) if match else None
+
+
+def make_record(
+    key: str,
+    name: str,
+    size: int,
+    captured: float,
+    sha256: str | None,
+    header: bytes | None = None,
+    offset: int | None = None,
+    metadata: CaptureMetadata | None = None,
+) -> ManifestRecord:
+    """Describes an uploaded image from what's journaled about it, nothing is decoded
+    Args:
+        key: Key of the object holding the image
+        name: Filename of the image
+        size: Size of the image in bytes
+        captured: Unix time of the capture
+        sha256: Base64 SHA-256 of the image
+        header: Start of the image, at least up to its image data, adds the width and height
+        offset: Byte offset of the image in its bundle, None if it's its own object
+        metadata: How and when the image was captured, adds the sun elevation and camera settings
+    Returns:
+        The manifest record
+    """
+    record: ManifestRecord = {
+        "key": key,
+        "name": name,
+        "type": _partition(key, "type") or "",
+        "captured": datetime.fromtimestamp(captured, timezone.utc).isoformat(),
+        "size": size,
+        "sha256": sha256,
+    }
+    if offset is not None:
+        record["offset"] = offset
+    if metadata is not None:
+        record["sun_elevation"] = metadata["sun_elevation"]
+        record["camera"] = metadata["camera"]
+    dimensions = jpeg.dimensions(header) if header is not None else None
+    if dimensions is not None:
+        record["width"], record["height"] = dimensions
+    return record
+
+
+class CaptureManifest:
+    """Per-day manifests of uploaded images, kept locally as JSON Lines and uploaded after each batch"""
+
+    directory: Path
+    """Where the manifest of each day is kept"""
+
+    keep_days: int
+    """Days the local manifests are kept for"""
+
+    def __init__(self, directory: Path, keep_days: int = 7) -> None:
+        """
+        Args:
+            directory: Where the manifest of each day is kept
+            keep_days: Days the local manifests are kept for, older ones are deleted at start up
+        """
+        self.directory = Path(directory)
+        self.keep_days = keep_days
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._merged: Set[str] = set()
+
+        # The days are the UTC date partitions of the keys
+        oldest = (datetime.now(timezone.utc).date() - timedelta(days=keep_days)).isoformat()
+        for path in self.directory.glob("*.jsonl"):
+            if path.stem < oldest:
+                path.unlink()
+        # Anything appended before a restart may not have been uploaded
+        self._changed: Set[str] = {path.stem for path in self.directory.glob("*.jsonl")}
+
+    def path(self, day: str) -> Path:
+        """Gets the local manifest of a day
+        Args:
+            day: The day as YYYY-MM-DD
+        Returns:
+            Path of the JSON Lines file
+        """
+        return self.directory / f"{day}.jsonl"
+
+    def append(self, record: ManifestRecord) -> None:
+        """Adds an uploaded image to the manifest of the day it's partitioned under
+        Args:
+            record: Description of the image
+        """
+        day = _partition(record["key"], "date")
+        if day is None:
+            logger.warning(f"No date partition in {record['key']}, left out of the manifest")
+            return
+        with self._lock:
+            with open(self.path(day), "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self._changed.add(day)
+
+    def records(self, day: str) -> List[ManifestRecord]:
+        """Reads the local manifest of a day
+        Args:
+            day: The day as YYYY-MM-DD
+        Returns:
+            The records in the order they were added
+        """
+        path = self.path(day)
+        if not path.exists():
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def sync(self, s3_manager: S3Manager, bucket_name: str, key_for_day: Callable[[str], str]) -> List[str]:
+        """Uploads the manifest of each day that changed. The first time a day is uploaded, records
+        already in the bucket that aren't known locally are merged in, so a lost local manifest
+        doesn't drop them
+        Args:
+            s3_manager: The S3 management object
+            bucket_name: S3 bucket that is written to
+            key_for_day: Gives the key of the manifest of a day
+        Returns:
+            The days uploaded
+        """
+        with self._lock:
+            changed = sorted(self._changed)
+        uploaded = []
+        for day in changed:
+            key = key_for_day(day)
+            if day not in self._merged:
+                # Downloaded without the lock, so captures can still be appended meanwhile
+                remote = s3_manager.download_bytes(bucket_name, key)
+                if remote is None:
+                    # Offline, uploading now could overwrite records that aren't known locally
+                    break
+                with self._lock:
+                    self._merge(day, remote)
+                    self._merged.add(day)
+            with self._lock:
+                data = self.path(day).read_bytes()
+                self._changed.discard(day)
+            if s3_manager.upload_bytes(data, bucket_name, key):
+                uploaded.append(day)
+            else:
+                with self._lock:
+                    self._changed.add(day)
+                break
+        return uploaded
+
+    def _merge(self, day: str, remote: bytes) -> None:
+        """Adds records from the uploaded manifest of a day that aren't in the local one"""
+        local = self.records(day)
+        known = {(record["key"], record["name"]) for record in local}
+        missing = []
+        for line in remote.decode().splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if (record["key"], record["name"]) not in known:
+                missing.append(record)
+        if missing:
+            lines = [json.dumps(record) + "\n" for record in missing + local]
+            write_atomic(self.path(day), "".join(lines).encode())
@@ -0,0 +1,63 @@
+"""Metadata recorded once when an image is captured and carried through to its upload, so
+the object key, the capture manifest and the image itself all agree on when it was taken"""
+
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, TypedDict
+
+NAME_TIME_FORMAT = "%Y%m%d_%H%M%S"
+"""Format of the UTC capture time at the end of image names"""
+
+
+class CaptureMetadata(TypedDict):
+    """Typed dictionary describing how and when an image was captured"""
+
+    captured: str
+    """Capture time as an ISO 8601 UTC timestamp"""
+    sun_elevation: float | None
+    """Degrees of the sun above the horizon at the site, negative below it"""
+    camera: Dict[str, Any]
+    """Settings the camera captured with"""
+
+
+def make_metadata(captured: datetime, sun_elevation: float | None, camera: Dict[str, Any]) -> CaptureMetadata:
+    """Describes a capture
+    Args:
+        captured: When the image was captured, a naive time is taken as local time
+        sun_elevation: Degrees of the sun above the horizon at the site
+        camera: Settings the camera captured with
+    Returns:
+        The capture metadata
+    """
+    return {
+        "captured": captured.astimezone(timezone.utc).isoformat(),
+        "sun_elevation": round(sun_elevation, 2) if sun_elevation is not None else None,
+        "camera": camera,
+    }
+
+
+def capture_time(metadata: CaptureMetadata) -> datetime:
+    """Gets the capture time of an image from its metadata
+    Args:
+        metadata: The capture metadata
+    Returns:
+        An aware UTC datetime
+    """
+    return datetime.fromisoformat(metadata["captured"]).astimezone(timezone.utc)
+
+
+def name_time(name: str) -> datetime | None:
+    """Reads the capture time from an image name, or from the name of a bundle or thumbnail
+    that starts with it
+    Args:
+        name: Filename such as SE_CARGN_01_PCAM_E_20260601_123000.jpg
+    Returns:
+        An aware UTC datetime, or None if the name has no capture time
+    """
+    match = re.search(r"_(\d{8}_\d{6})(?:_|\.|$)", name)
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1), NAME_TIME_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
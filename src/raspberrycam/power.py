@@ -0,0 +1,125 @@
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, TypedDict
+
+from raspberrycam import raspberrypi
+
+logger = logging.getLogger(__name__)
+
+
+class DeepSleepDecision(TypedDict):
+    """Typed dictionary describing whether to halt for the night"""
+
+    sleep: bool
+    wake_time: datetime
+    reason: str
+    idle_joules: float
+    """Estimated energy used staying on until the next ON time"""
+    deep_sleep_joules: float
+    """Estimated energy used halting, booting and waiting for the next ON time"""
+
+
+@dataclass
+class DeepSleepPolicy:
+    """Decides whether to halt the device overnight and wake it with the RTC, based on a
+    simple energy model of staying idle against halting and booting again"""
+
+    wake_margin: float = 300
+    """Seconds before the next ON time to wake, allowing for the device to boot"""
+
+    min_sleep: float = 3600
+    """Shortest time worth halting for in seconds"""
+
+    idle_watts: float = 2.0
+    """Power drawn while idling"""
+
+    halted_watts: float = 0.3
+    """Power drawn while halted"""
+
+    boot_joules: float = 120
+    """Energy used shutting down and booting again"""
+
+    def decide(self, now: datetime, next_on_time: datetime) -> DeepSleepDecision:
+        """Decides whether to halt until the next ON time
+        Args:
+            now: The current time
+            next_on_time: When the camera next needs to be running
+        Returns:
+            The decision, when to wake and the energy estimates it was based on
+        """
+        wake_time = next_on_time - timedelta(seconds=self.wake_margin)
+        halted = (wake_time - now).total_seconds()
+        idle_joules = self.idle_watts * max(0.0, (next_on_time - now).total_seconds())
+        deep_sleep_joules = self.halted_watts * max(0.0, halted) + self.boot_joules + self.idle_watts * self.wake_margin
+
+        decision: DeepSleepDecision = {
+            "sleep": False,
+            "wake_time": wake_time,
+            "reason": "",
+            "idle_joules": idle_joules,
+            "deep_sleep_joules": deep_sleep_joules,
+        }
+        if halted < self.min_sleep:
+            decision["reason"] = f"only {halted:.0f}s until the wake time"
+        elif deep_sleep_joules >= idle_joules:
+            decision["reason"] = "halting would use more energy than staying on"
+        else:
+            decision["sleep"] = True
+            decision["reason"] = f"saves an estimated {idle_joules - deep_sleep_joules:.0f}J"
+        return decision
+
+
+class PowerBackend(ABC):
+    """Abstract implementation of the device power controls"""
+
+    @abstractmethod
+    def schedule_wakeup(self, wake_time: datetime) -> None:
+        """Sets the real time clock to wake the device
+        Args:
+            wake_time: The time to wake up
+        """
+
+    @abstractmethod
+    def shutdown(self) -> None:
+        """Halts the device"""
+
+
+class RaspberryPiPower(PowerBackend):
+    """Power controls using rtcwake and shutdown on a Raspberry Pi"""
+
+    def __init__(self, debug: bool = False) -> None:
+        """
+        Args:
+            debug: Flag for setting debug mode, nothing is scheduled or shut down
+        """
+        self.debug = debug
+
+    def schedule_wakeup(self, wake_time: datetime) -> None:
+        raspberrypi.schedule_wakeup(wake_time, debug=self.debug)
+
+    def shutdown(self) -> None:
+        raspberrypi.shutdown(debug=self.debug)
+
+
+class SimulatedPower(PowerBackend):
+    """Power controls that record what would have happened, for testing without hardware"""
+
+    wakeups: List[datetime]
+    """Wake times that were scheduled"""
+
+    shutdowns: int
+    """Number of times the device would have halted"""
+
+    def __init__(self) -> None:
+        self.wakeups = []
+        self.shutdowns = 0
+
+    def schedule_wakeup(self, wake_time: datetime) -> None:
+        logger.info(f"Simulated wakeup scheduled at {wake_time}")
+        self.wakeups.append(wake_time)
+
+    def shutdown(self) -> None:
+        logger.info("Simulated shutdown")
+        self.shutdowns += 1
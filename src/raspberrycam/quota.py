@@ -0,0 +1,134 @@
+"""Keeps the images waiting to be uploaded within a disk budget, evicting some of them
+when an outage lasts long enough to fill it"""
+
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, List, Type
+
+from raspberrycam.journal import JournalEntry
+
+logger = logging.getLogger(__name__)
+
+
+class EvictionPolicy(ABC):
+    """Chooses which waiting images to delete to free space"""
+
+    @abstractmethod
+    def select(self, candidates: List[JournalEntry], excess: int) -> List[Path]:
+        """Chooses images to delete
+        Args:
+            candidates: Images that may be deleted, oldest first
+            excess: Number of bytes to free
+        Returns:
+            The images to delete, freeing at least excess bytes if there are enough candidates
+        """
+
+
+def _take(entries: List[JournalEntry], excess: int) -> List[Path]:
+    """Takes entries in order until they add up to excess bytes"""
+    selected = []
+    for entry in entries:
+        if excess <= 0:
+            break
+        selected.append(entry["path"])
+        excess -= entry["size"]
+    return selected
+
+
+class OldestFirst(EvictionPolicy):
+    """Deletes the oldest images"""
+
+    def select(self, candidates: List[JournalEntry], excess: int) -> List[Path]:
+        return _take(candidates, excess)
+
+
+class ThinOut(EvictionPolicy):
+    """Deletes every other image, oldest first, halving the frame rate of the oldest part of
+    the backlog before touching the newer part. Repeats until enough is freed"""
+
+    def select(self, candidates: List[JournalEntry], excess: int) -> List[Path]:
+        selected: List[Path] = []
+        remaining = list(candidates)
+        while excess > 0 and len(remaining) > 1:
+            thinned = set(_take(remaining[1::2], excess))
+            excess -= sum(entry["size"] for entry in remaining if entry["path"] in thinned)
+            selected += [entry["path"] for entry in remaining if entry["path"] in thinned]
+            remaining = [entry for entry in remaining if entry["path"] not in thinned]
+        return selected
+
+
+def _seconds_from_noon(captured: float) -> float:
+    """Seconds between a capture and midday local time on the same day"""
+    time = datetime.fromtimestamp(captured)
+    return abs((time - time.replace(hour=12, minute=0, second=0, microsecond=0)).total_seconds())
+
+
+class KeepDailyNoon(EvictionPolicy):
+    """Deletes everything except the image closest to midday (local time) of each day,
+    oldest days first, then the remaining midday images oldest first"""
+
+    def select(self, candidates: List[JournalEntry], excess: int) -> List[Path]:
+        noon: Dict[date, JournalEntry] = {}
+        for entry in candidates:
+            day = datetime.fromtimestamp(entry["captured"]).date()
+            if day not in noon or _seconds_from_noon(entry["captured"]) < _seconds_from_noon(noon[day]["captured"]):
+                noon[day] = entry
+
+        kept = {entry["path"] for entry in noon.values()}
+        others = [entry for entry in candidates if entry["path"] not in kept]
+        selected = _take(others, excess)
+        excess -= sum(entry["size"] for entry in others[: len(selected)])
+        return selected + _take([entry for entry in candidates if entry["path"] in kept], excess)
+
+
+EVICTION_POLICIES: Dict[str, Type[EvictionPolicy]] = {
+    "oldest": OldestFirst,
+    "thin": ThinOut,
+    "daily_noon": KeepDailyNoon,
+}
+"""Eviction policies by the name used in the config"""
+
+
+@dataclass
+class DiskQuota:
+    """Byte budget for the images waiting to be uploaded. Once it's exceeded, images are
+    deleted by the eviction policy until the backlog is back under the low water mark"""
+
+    max_bytes: int
+    """Most bytes of images kept waiting"""
+
+    policy: str | EvictionPolicy = "oldest"
+    """The eviction policy, or its name in EVICTION_POLICIES"""
+
+    low_water: float = 0.9
+    """Fraction of max_bytes evicted down to, so eviction doesn't run on every capture"""
+
+    keep_newest: int = 1
+    """Number of the newest images never evicted"""
+
+    def __post_init__(self) -> None:
+        if isinstance(self.policy, EvictionPolicy):
+            self._policy = self.policy
+        elif self.policy in EVICTION_POLICIES:
+            self._policy = EVICTION_POLICIES[self.policy]()
+        else:
+            raise ValueError(f"Unknown eviction policy {self.policy}, expected one of {list(EVICTION_POLICIES)}")
+
+    def select(self, backlog: List[JournalEntry], used: int, max_bytes: int | None = None) -> List[Path]:
+        """Chooses images to evict
+        Args:
+            backlog: Images waiting to be uploaded, oldest first
+            used: Total size of the backlog in bytes
+            max_bytes: Budget to use instead of the configured one, such as when the disk filled up first
+        Returns:
+            The images to evict, empty if the backlog is within the budget
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        if used <= max_bytes:
+            return []
+        candidates = backlog[: max(0, len(backlog) - self.keep_newest)]
+        return self._policy.select(candidates, used - int(max_bytes * self.low_water))
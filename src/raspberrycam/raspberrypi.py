@@ -1,10 +1,16 @@
 import logging
 import subprocess
+from contextlib import contextmanager
 from datetime import datetime
 from enum import StrEnum
+from pathlib import Path
+from typing import Iterator, List
 
 logger = logging.getLogger(__name__)
 
+CPU_SYSFS_ROOT = Path("/sys/devices/system/cpu")
+"""Directory holding the per-CPU cpufreq settings"""
+
 
 class GovernorMode(StrEnum):
     """Enum for allowed governor states in a RasberryPi"""
@@ -16,30 +22,101 @@ class GovernorMode(StrEnum):
     CONSERVATIVE = "conservative"
 
 
+class GovernorController:
+    """Keeps track of the CPU governor and only changes it when the mode is different.
+    The sysfs files are written directly, falling back to sudo tee without permission"""
+
+    sysfs_root: Path
+    """Directory holding the per-CPU cpufreq settings"""
+
+    mode: GovernorMode | None
+    """The current mode, None if it isn't known"""
+
+    def __init__(self, sysfs_root: Path = CPU_SYSFS_ROOT, debug: bool = False) -> None:
+        """
+        Args:
+            sysfs_root: Directory holding the per-CPU cpufreq settings
+            debug: Flag for setting debug mode, nothing is written
+        """
+        self.sysfs_root = sysfs_root
+        self.debug = debug
+        self.mode = None if debug else self.read()
+
+    def governor_files(self) -> List[Path]:
+        """Gets the scaling governor file of every CPU"""
+        return sorted(self.sysfs_root.glob("cpu[0-9]*/cpufreq/scaling_governor"))
+
+    def read(self) -> GovernorMode | None:
+        """Reads the current mode from the first CPU
+        Returns:
+            The mode, or None if it can't be read
+        """
+        try:
+            files = self.governor_files()
+            return GovernorMode(files[0].read_text().strip()) if files else None
+        except (OSError, ValueError):
+            return None
+
+    def set(self, mode: GovernorMode) -> None:
+        """Sets the governor mode, doing nothing if it is already set
+        Args:
+            mode: A GovernorMode enum
+        """
+        try:
+            if not isinstance(mode, GovernorMode):
+                raise TypeError("mode is not a valid GovernorMode.")
+            if mode == self.mode:
+                return
+
+            logger.info(f"Setting CPU governor to {mode.value}.")
+            if self.debug:
+                logger.info("Governor set")
+                self.mode = mode
+                return
+
+            files = self.governor_files()
+            if not files:
+                raise RuntimeError(f"No CPU governors found in {self.sysfs_root}")
+            try:
+                for governor_file in files:
+                    governor_file.write_text(mode.value)
+            except PermissionError:
+                # Only root can write to sysfs
+                subprocess.run(
+                    ["sudo", "tee", *files], input=mode.value, text=True, stdout=subprocess.DEVNULL, check=True
+                )
+            self.mode = mode
+        except Exception as e:
+            self.mode = None
+            logger.exception("Failed to set CPU governor", exc_info=e)
+
+    @contextmanager
+    def boost(self, mode: GovernorMode = GovernorMode.PERFORMANCE) -> Iterator[None]:
+        """Context manager that switches to a mode and back to the previous one afterwards
+        Args:
+            mode: The mode to use inside the context
+        """
+        previous = self.mode or GovernorMode.ONDEMAND
+        self.set(mode)
+        try:
+            yield
+        finally:
+            self.set(previous)
+
+
+_controllers: dict[bool, GovernorController] = {}
+"""Shared controllers used by set_governer, keyed on debug mode"""
+
+
 def set_governer(mode: GovernorMode, debug: bool = False) -> None:
     """Sets the governor mode.
     Args:
         mode: A GovernorMode enum
         debug: Flag for setting debug mode
     """
-
-    try:
-        if not isinstance(mode, GovernorMode):
-            raise TypeError("mode is not a valid GovernorMode.")
-
-        logger.info(f"Setting CPU governor to {mode.value}.")
-        if debug:
-            logger.info("Governor set")
-            return
-
-        result = subprocess.call(
-            f"echo '{mode}' | sudo tee /sys/devices/system/cpu/cpu*/cpufreq/scaling_governor", shell=True
-        )
-
-        if result:
-            raise RuntimeError(f"Failed to set governer to {mode}")
-    except Exception as e:
-        logger.exception("Failed to set CPU governor", exc_info=e)
+    if debug not in _controllers:
+        _controllers[debug] = GovernorController(debug=debug)
+    _controllers[debug].set(mode)
 
 
 def shutdown(debug: bool = False) -> None:
@@ -58,7 +135,7 @@ def shutdown(debug: bool = False) -> None:
         subprocess.run("sync", shell=True, check=False)
 
         # Execute shutdown command
-        subprocess.run("sudo shutdown -h now", check=False)
+        subprocess.run(["sudo", "shutdown", "-h", "now"], check=False)
     except Exception as e:
         logger.error(f"Failed to shutdown: {e}")
 
@@ -75,6 +152,7 @@ def schedule_wakeup(wake_time: datetime, debug: bool = False) -> None:
         logger.info(f"Scheduling wakeup at {wake_time.strftime('%Y-%m-%d %H:%M:%S')}")
         if debug:
             logger.debug("Wakeup time set")
+            return
         subprocess.run(f"sudo rtcwake -m no -t {str(epoch_time)}", shell=True, check=False)
     except Exception as e:
         logger.error(f"Failed to schedule wakeup: {e}")
@@ -1,14 +1,49 @@
 import logging
 import os
+import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Optional, TypedDict
+from typing import BinaryIO, Callable, Dict, List, Optional, TypedDict
 
 import boto3
 import boto3.session
-from botocore.exceptions import NoCredentialsError
+from botocore.client import BaseClient
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import (
+    ClientError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    NoCredentialsError,
+    ReadTimeoutError,
+)
+
+from raspberrycam.circuit import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
+CONNECTION_ERRORS = (EndpointConnectionError, ConnectTimeoutError, ReadTimeoutError)
+"""Errors that mean S3 couldn't be reached, as opposed to a request S3 refused"""
+
+ErrorHandler = Optional[Callable[[Exception], None]]
+"""Called with the exception when a request fails"""
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """Checks whether a request failed because S3 couldn't be reached, looking through any
+    exceptions it was raised from, since transfers wrap the original error
+    Args:
+        error: The exception raised by the request
+    Returns:
+        True for connection and timeout errors
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, CONNECTION_ERRORS):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
 
 class AWSCredentials(TypedDict):
     """Typed dictionary for AWS credentials"""
@@ -16,6 +51,7 @@ class AWSCredentials(TypedDict):
     access_key_id: str
     secret_access_key: str
     session_token: str
+    expiration: datetime | None
 
 
 def assume_role(
@@ -24,6 +60,7 @@ def assume_role(
     secret_access_key: str,
     session_name: str = "raspberrycam-session",
     duration_seconds: int = 3600,
+    on_error: ErrorHandler = None,
 ) -> AWSCredentials | None:
     """
     Assume the AWS IAM role for S3 access
@@ -35,6 +72,7 @@ def assume_role(
         secret_access_key: The access key secret
         session_name: The name assigned to the session
         duration_seconds: Length of the session in seconds
+        on_error: Called with the exception if the role couldn't be assumed
     Returns:
         None or a credentials dictionary
     """
@@ -60,14 +98,49 @@ def assume_role(
             "access_key_id": credentials["AccessKeyId"],
             "secret_access_key": credentials["SecretAccessKey"],
             "session_token": credentials["SessionToken"],
+            # The role can't outlive the requested duration, fall back to it if STS doesn't say
+            "expiration": credentials.get(
+                "Expiration", datetime.now(timezone.utc) + timedelta(seconds=duration_seconds)
+            ),
         }
     except Exception as e:
         logger.error(f"Error assuming role: {e}")
+        if on_error is not None:
+            on_error(e)
         return None
 
 
+def create_s3_client(credentials: AWSCredentials, max_pool_connections: int = 10) -> BaseClient:
+    """Creates an S3 client that keeps its connections alive between uploads
+    Args:
+        credentials: Credential dictionary to authenticate with
+        max_pool_connections: Size of the HTTP connection pool shared by the client
+    Returns:
+        A boto3 S3 client
+    """
+    session = boto3.session.Session(
+        aws_access_key_id=credentials["access_key_id"],
+        aws_secret_access_key=credentials["secret_access_key"],
+        aws_session_token=credentials["session_token"],
+    )
+    return session.client(
+        "s3",
+        config=BotoConfig(
+            tcp_keepalive=True,
+            max_pool_connections=max_pool_connections,
+            s3={"multipart_threshold": 10 * 1024 * 1024},  # Only use multipart for files >10MB
+        ),
+    )
+
+
 def upload_to_s3(
-    file_path: Path, bucket_name: str, credentials: AWSCredentials, object_name: Optional[str] = None
+    file_path: Path,
+    bucket_name: str,
+    credentials: AWSCredentials,
+    object_name: Optional[str] = None,
+    s3_client: Optional[BaseClient] = None,
+    checksum_sha256: Optional[str] = None,
+    on_error: ErrorHandler = None,
 ) -> bool:
     """Uploads a file to an S3 bucket
     Args:
@@ -75,10 +148,13 @@ def upload_to_s3(
         bucket_name: Name of the S3 bucket (Not the arn)
         credentials: Credential dictionary to authenticate with
         object_name: Hardcoded path to use in the S3 bucket.
+        s3_client: An existing client to reuse, a new one is created from the credentials if not given
+        checksum_sha256: Base64 SHA-256 of the file, S3 rejects the upload if it doesn't match
+        on_error: Called with the exception if the upload failed
     """
 
     # If we couldn't authenticate, stop trying here
-    if not credentials:
+    if not credentials and not s3_client:
         logging.error("Can't authenticate to AWS. Have you checked the .env file?")
 
     # If S3 object_name was not specified, use file_path with images/ prefix only
@@ -87,64 +163,362 @@ def upload_to_s3(
         object_name = f"images/{object_name}"
 
     try:
-        # Create S3 client with role credentials and reduced part size for multipart uploads
-        s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=credentials["access_key_id"],
-            aws_secret_access_key=credentials["secret_access_key"],
-            aws_session_token=credentials["session_token"],
-            config=boto3.session.Config(
-                s3={"multipart_threshold": 10 * 1024 * 1024}  # Only use multipart for files >10MB
-            ),
-        )
+        if s3_client is None:
+            s3_client = create_s3_client(credentials)
 
         # Upload the file
         file_size = os.path.getsize(file_path) / 1024
         logger.info(f"Uploading file to S3 ({file_size:.2f}KB): {file_path}")
 
-        s3_client.upload_file(
-            file_path,
-            bucket_name,
-            object_name,
-            ExtraArgs={"StorageClass": "STANDARD"},  # Use standard storage class
-        )
+        extra_args = {"StorageClass": "STANDARD"}  # Use standard storage class
+        if checksum_sha256:
+            extra_args["ChecksumSHA256"] = checksum_sha256
+        s3_client.upload_file(file_path, bucket_name, object_name, ExtraArgs=extra_args)
         logger.info(f"File uploaded to S3: s3://{bucket_name}/{object_name}")
         return True
-    except FileNotFoundError:
+    except FileNotFoundError as e:
         logger.error(f"File not found: {file_path}")
+        if on_error is not None:
+            on_error(e)
+        return False
+    except NoCredentialsError as e:
+        logger.error("AWS credentials not available or incorrect")
+        if on_error is not None:
+            on_error(e)
         return False
-    except NoCredentialsError:
+    except Exception as e:
+        logger.error(f"Error uploading to S3: {e}")
+        if on_error is not None:
+            on_error(e)
+        return False
+
+
+def upload_bytes_to_s3(
+    data: bytes,
+    bucket_name: str,
+    credentials: AWSCredentials,
+    object_name: str,
+    s3_client: Optional[BaseClient] = None,
+    checksum_sha256: Optional[str] = None,
+    on_error: ErrorHandler = None,
+) -> bool:
+    """Uploads an object from memory to an S3 bucket
+    Args:
+        data: Contents of the object
+        bucket_name: Name of the S3 bucket (Not the arn)
+        credentials: Credential dictionary to authenticate with
+        object_name: Path to use in the S3 bucket
+        s3_client: An existing client to reuse, a new one is created from the credentials if not given
+        checksum_sha256: Base64 SHA-256 of the data, S3 rejects the upload if it doesn't match
+        on_error: Called with the exception if the upload failed
+    """
+    if not credentials and not s3_client:
+        logging.error("Can't authenticate to AWS. Have you checked the .env file?")
+
+    try:
+        if s3_client is None:
+            s3_client = create_s3_client(credentials)
+
+        logger.info(f"Uploading object to S3 ({len(data) / 1024:.2f}KB): {object_name}")
+        extra_args = {"ChecksumSHA256": checksum_sha256} if checksum_sha256 else {}
+        s3_client.put_object(Bucket=bucket_name, Key=object_name, Body=data, StorageClass="STANDARD", **extra_args)
+        logger.info(f"Object uploaded to S3: s3://{bucket_name}/{object_name}")
+        return True
+    except NoCredentialsError as e:
         logger.error("AWS credentials not available or incorrect")
+        if on_error is not None:
+            on_error(e)
         return False
     except Exception as e:
         logger.error(f"Error uploading to S3: {e}")
+        if on_error is not None:
+            on_error(e)
+        return False
+
+
+def upload_stream_to_s3(
+    stream: BinaryIO,
+    bucket_name: str,
+    credentials: AWSCredentials,
+    object_name: str,
+    s3_client: Optional[BaseClient] = None,
+    on_error: ErrorHandler = None,
+) -> bool:
+    """Uploads an object read from a file object to an S3 bucket, in parts if it's large
+    Args:
+        stream: File object the contents are read from
+        bucket_name: Name of the S3 bucket (Not the arn)
+        credentials: Credential dictionary to authenticate with
+        object_name: Path to use in the S3 bucket
+        s3_client: An existing client to reuse, a new one is created from the credentials if not given
+        on_error: Called with the exception if the upload failed
+    """
+    if not credentials and not s3_client:
+        logging.error("Can't authenticate to AWS. Have you checked the .env file?")
+
+    try:
+        if s3_client is None:
+            s3_client = create_s3_client(credentials)
+
+        logger.info(f"Uploading stream to S3: {object_name}")
+        s3_client.upload_fileobj(stream, bucket_name, object_name, ExtraArgs={"StorageClass": "STANDARD"})
+        logger.info(f"Stream uploaded to S3: s3://{bucket_name}/{object_name}")
+        return True
+    except NoCredentialsError as e:
+        logger.error("AWS credentials not available or incorrect")
+        if on_error is not None:
+            on_error(e)
+        return False
+    except Exception as e:
+        logger.error(f"Error uploading to S3: {e}")
+        if on_error is not None:
+            on_error(e)
         return False
 
 
 class S3Manager:
-    """Object for managing S3 sessions and uploading files"""
+    """Object for managing S3 sessions and uploading files
+
+    A single S3 client is kept for the lifetime of the assumed role credentials,
+    which are only refreshed when they get close to expiring."""
 
     access_key_id: str
     secret_access_key: str
     role_arn: str
 
+    duration_seconds: int
+    """Length of each assumed role session in seconds"""
+
+    refresh_margin: int
+    """How many seconds before expiry the credentials are refreshed"""
+
+    max_pool_connections: int
+    """Size of the client's connection pool, should be at least the number of upload threads"""
+
+    breaker: CircuitBreaker | None
+    """Stops requests while the connection is down, None always tries"""
+
     credentials: AWSCredentials | None = None
 
-    def __init__(self, access_key_id: str, secret_access_key: str, role_arn: str) -> None:
+    _client: BaseClient | None = None
+    """S3 client built from the current credentials"""
+
+    def __init__(
+        self,
+        access_key_id: str,
+        secret_access_key: str,
+        role_arn: str,
+        duration_seconds: int = 3600,
+        refresh_margin: int = 300,
+        max_pool_connections: int = 10,
+        breaker: CircuitBreaker | None = None,
+    ) -> None:
         """
         Args:
             access_key_id: The access key ID
             secret_access_key: The access key secret
             role_arn: The ARN of the AWS role to assume
+            duration_seconds: Length of each assumed role session in seconds
+            refresh_margin: Seconds before expiry at which credentials are refreshed
+            max_pool_connections: Size of the client's connection pool
+            breaker: Circuit breaker that stops requests while the connection is down
         """
         self.access_key_id = access_key_id
         self.secret_access_key = secret_access_key
         self.role_arn = role_arn
+        self.duration_seconds = duration_seconds
+        self.refresh_margin = refresh_margin
+        self.max_pool_connections = max_pool_connections
+        self.breaker = breaker
+        self._lock = threading.Lock()
+
+    def credentials_valid(self, now: datetime | None = None) -> bool:
+        """Checks whether the cached credentials can still be used
+        Args:
+            now: The time to check against, defaults to the current time
+        Returns:
+            True if there are credentials that won't expire within the refresh margin
+        """
+        if not self.credentials:
+            return False
 
-    def assume_role(self) -> None:
-        """Assumes the role"""
-        self.credentials = assume_role(self.role_arn, self.access_key_id, self.secret_access_key)
+        expiration = self.credentials.get("expiration")
+        if expiration is None:
+            return True
 
-    def upload(self, file_path: Path, bucket_name: str, object_name: str | None = None) -> bool:
-        """Upload a file to S3"""
-        return upload_to_s3(file_path, bucket_name, self.credentials, object_name=object_name)  # type:ignore
+        if now is None:
+            now = datetime.now(timezone.utc)
+        return expiration - now > timedelta(seconds=self.refresh_margin)
+
+    def available(self) -> bool:
+        """Checks whether requests should be made, see CircuitBreaker.allow_request
+        Returns:
+            False while the circuit breaker is backing off after a failure
+        """
+        return self.breaker is None or self.breaker.allow_request()
+
+    def _record(self, success: bool, errors: List[Exception] | None = None) -> None:
+        """Passes the outcome of a request to the circuit breaker. Only connection and timeout
+        errors count as failures, anything else S3 refused still shows the connection is up
+        Args:
+            success: Whether the request succeeded
+            errors: What the request failed with
+        """
+        if self.breaker is None:
+            return
+        if not success and any(is_connection_error(error) for error in errors or []):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def assume_role(self, force: bool = False) -> None:
+        """Assumes the role, reusing the current credentials if they haven't expired
+        Args:
+            force: Assume the role again even if the credentials are still valid
+        """
+        with self._lock:
+            if not force and self.credentials_valid():
+                return
+            if not self.available():
+                return
+            errors: List[Exception] = []
+            credentials = assume_role(
+                self.role_arn,
+                self.access_key_id,
+                self.secret_access_key,
+                duration_seconds=self.duration_seconds,
+                on_error=errors.append,
+            )
+            self._record(credentials is not None, errors)
+            if credentials is None:
+                # Keep any old credentials, they may still be usable until they expire
+                return
+            self.credentials = credentials
+            self._client = None
+
+    @property
+    def client(self) -> BaseClient | None:
+        """The S3 client for the current credentials, None if the role hasn't been assumed"""
+        with self._lock:
+            if self._client is None and self.credentials:
+                self._client = create_s3_client(self.credentials, max_pool_connections=self.max_pool_connections)
+            return self._client
+
+    def upload(
+        self, file_path: Path, bucket_name: str, object_name: str | None = None, checksum_sha256: str | None = None
+    ) -> bool:
+        """Upload a file to S3, refreshing the credentials first if they are about to expire.
+        Nothing is sent while the circuit breaker is open"""
+        if not os.path.exists(file_path):
+            # Checked first, so a missing file never takes the circuit breaker's trial request
+            logger.error(f"File not found: {file_path}")
+            return False
+        if not self.available():
+            return False
+        if self.credentials and not self.credentials_valid():
+            self.assume_role()
+        errors: List[Exception] = []
+        uploaded = upload_to_s3(
+            file_path,
+            bucket_name,
+            self.credentials,  # type:ignore
+            object_name=object_name,
+            s3_client=self.client,
+            checksum_sha256=checksum_sha256,
+            on_error=errors.append,
+        )
+        self._record(uploaded, errors)
+        return uploaded
+
+    def upload_bytes(self, data: bytes, bucket_name: str, object_name: str, checksum_sha256: str | None = None) -> bool:
+        """Upload an object from memory to S3, see upload"""
+        if not self.available():
+            return False
+        if self.credentials and not self.credentials_valid():
+            self.assume_role()
+        errors: List[Exception] = []
+        uploaded = upload_bytes_to_s3(
+            data,
+            bucket_name,
+            self.credentials,  # type:ignore
+            object_name,
+            s3_client=self.client,
+            checksum_sha256=checksum_sha256,
+            on_error=errors.append,
+        )
+        self._record(uploaded, errors)
+        return uploaded
+
+    def upload_stream(self, stream: BinaryIO, bucket_name: str, object_name: str) -> bool:
+        """Upload an object read from a file object to S3, see upload"""
+        if not self.available():
+            return False
+        if self.credentials and not self.credentials_valid():
+            self.assume_role()
+        errors: List[Exception] = []
+        uploaded = upload_stream_to_s3(
+            stream,
+            bucket_name,
+            self.credentials,  # type:ignore
+            object_name,
+            s3_client=self.client,
+            on_error=errors.append,
+        )
+        self._record(uploaded, errors)
+        return uploaded
+
+    def list_etags(self, bucket_name: str, prefix: str) -> Dict[str, str] | None:
+        """Lists the objects under a prefix in as few requests as possible
+        Args:
+            bucket_name: Name of the S3 bucket (Not the arn)
+            prefix: Key prefix to list
+        Returns:
+            The ETag of each object by key, without quotes, or None if it couldn't be listed
+        """
+        if not self.available():
+            return None
+        self.assume_role()
+        client = self.client
+        if client is None:
+            return None
+        try:
+            etags = {}
+            for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket_name, Prefix=prefix):
+                for item in page.get("Contents", []):
+                    etags[item["Key"]] = item["ETag"].strip('"')
+        except Exception as e:
+            logger.error(f"Error listing s3://{bucket_name}/{prefix}: {e}")
+            self._record(False, [e])
+            return None
+        self._record(True)
+        return etags
+
+    def download_bytes(self, bucket_name: str, object_name: str) -> bytes | None:
+        """Downloads a small object into memory
+        Args:
+            bucket_name: Name of the S3 bucket (Not the arn)
+            object_name: Key of the object
+        Returns:
+            Contents of the object, empty if it doesn't exist, or None if it couldn't be downloaded
+        """
+        if not self.available():
+            return None
+        self.assume_role()
+        client = self.client
+        if client is None:
+            return None
+        try:
+            data = client.get_object(Bucket=bucket_name, Key=object_name)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                self._record(True)
+                return b""
+            logger.error(f"Error downloading s3://{bucket_name}/{object_name}: {e}")
+            self._record(False, [e])
+            return None
+        except Exception as e:
+            logger.error(f"Error downloading s3://{bucket_name}/{object_name}: {e}")
+            self._record(False, [e])
+            return None
+        self._record(True)
+        return data
@@ -1,7 +1,12 @@
+import json
 import logging
-from datetime import date, datetime, timedelta
+import math
+import time as clock
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
 from enum import Enum
-from typing import Callable, List, TypedDict
+from pathlib import Path
+from typing import Callable, Deque, List, TypedDict
 
 from raspberrycam.location import Location
 
@@ -43,12 +48,72 @@ class FdriScheduler:
     location: Location
     """Location of the device, used to calculate the sunrise/sunset time"""
 
-    def __init__(self, location: Location) -> None:
+    sunrise_offset: float
+    """Seconds after sunrise the device turns ON, negative is before sunrise"""
+
+    sunset_offset: float
+    """Seconds after sunset the device turns OFF, negative is before sunset"""
+
+    learn_offsets: bool
+    """Whether the offsets are adjusted from how well exposed the captures near sunrise and sunset are"""
+
+    learning_step: float
+    """Seconds the offsets move after a badly exposed capture"""
+
+    max_offset: float
+    """Largest offset in seconds from sunrise or sunset"""
+
+    offsets_file: Path | None
+    """JSON file the learned offsets are kept in between runs, None doesn't keep them"""
+
+    def __init__(
+        self,
+        location: Location,
+        sunrise_offset: float = 0.0,
+        sunset_offset: float = 0.0,
+        learn_offsets: bool = False,
+        learning_step: float = 300.0,
+        max_offset: float = 3600.0,
+        offsets_file: Path | None = None,
+    ) -> None:
         """
         Args:
             location: The temporal location of the device
+            sunrise_offset: Seconds after sunrise the device turns ON
+            sunset_offset: Seconds after sunset the device turns OFF
+            learn_offsets: Adjust the offsets from how well exposed the captures near sunrise and sunset are
+            learning_step: Seconds the offsets move after a badly exposed capture
+            max_offset: Largest offset in seconds from sunrise or sunset
+            offsets_file: JSON file the learned offsets are kept in, overriding the given offsets if it exists
         """
         self.location = location
+        self.sunrise_offset = sunrise_offset
+        self.sunset_offset = sunset_offset
+        self.learn_offsets = learn_offsets
+        self.learning_step = learning_step
+        self.max_offset = max_offset
+        self.offsets_file = offsets_file
+        self._load_offsets()
+
+    def _load_offsets(self) -> None:
+        """Reads the learned offsets from the offsets file"""
+        if self.offsets_file is None or not self.offsets_file.exists():
+            return
+        try:
+            offsets = json.loads(self.offsets_file.read_text())
+            self.sunrise_offset = float(offsets["sunrise"])
+            self.sunset_offset = float(offsets["sunset"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable schedule offsets in {self.offsets_file}: {e}")
+
+    def _save_offsets(self) -> None:
+        """Writes the learned offsets to the offsets file"""
+        if self.offsets_file is None:
+            return
+        try:
+            self.offsets_file.write_text(json.dumps({"sunrise": self.sunrise_offset, "sunset": self.sunset_offset}))
+        except OSError as e:
+            logger.warning(f"Failed to save schedule offsets to {self.offsets_file}: {e}")
 
     def get_schedule(self, time: date) -> ScheduleList:
         """Gets a schedule list for the date specified.
@@ -60,10 +125,42 @@ class FdriScheduler:
         stats = self.location.get_sun_stats(time)
 
         return [
-            {"time": stats["sunrise"], "state": ScheduleState.ON},
-            {"time": stats["sunset"], "state": ScheduleState.OFF},
+            {"time": stats["sunrise"] + timedelta(seconds=self.sunrise_offset), "state": ScheduleState.ON},
+            {"time": stats["sunset"] + timedelta(seconds=self.sunset_offset), "state": ScheduleState.OFF},
         ]
 
+    def record_exposure(self, time: datetime, usable: bool) -> None:
+        """Learns the offsets from a capture's exposure. A badly exposed capture near the nearest
+            of the ON or OFF times moves it a step further into the day, and a well exposed capture
+            within a step of either time lets it drift back a quarter of a step, following the seasons.
+            Bad exposures in the middle of the day, from fog, snow or a covered lens, are ignored
+        Args:
+            time: When the capture was taken
+            usable: Whether the capture was well exposed
+        """
+        if not self.learn_offsets:
+            return
+        stats = self.location.get_sun_stats(time)
+        morning = time < stats["noon"]
+        edge = self.get_schedule(time)[0 if morning else 1]["time"]
+        from_edge = abs((time - edge).total_seconds())
+        # Positive moves the ON time later or the OFF time earlier
+        if not usable and from_edge <= self.max_offset + self.learning_step:
+            inward = self.learning_step
+        elif usable and from_edge <= self.learning_step:
+            inward = -self.learning_step / 4
+        else:
+            return
+
+        if morning:
+            self.sunrise_offset = max(-self.max_offset, min(self.max_offset, self.sunrise_offset + inward))
+        else:
+            self.sunset_offset = max(-self.max_offset, min(self.max_offset, self.sunset_offset - inward))
+        logger.info(
+            f"Schedule offsets now {self.sunrise_offset:.0f}s after sunrise, {self.sunset_offset:.0f}s after sunset"
+        )
+        self._save_offsets()
+
     def get_next_on_time(self, time: datetime) -> datetime:
         """Gets next ON state after the provided datetime which may roll over into the
             next day
@@ -82,6 +179,41 @@ class FdriScheduler:
 
         raise RuntimeError("No next on time found")
 
+    def get_next_transition(self, time: datetime) -> ScheduleItem:
+        """Gets the next state change after the provided datetime, which may roll over
+            into the next day
+        Args:
+            time: The datetime to search after
+        Returns:
+            The time and the state the device changes to
+        """
+        for days in range(3):
+            for item in self.get_schedule((time + timedelta(days=days)).date()):
+                if item["time"] > time:
+                    return item
+
+        raise RuntimeError("No next transition found")
+
+    def sleep_until_next_transition(
+        self,
+        time: datetime,
+        wait: Callable[[float], bool] | None = None,
+        max_sleep: float | None = None,
+        tolerance: float = 30.0,
+    ) -> bool:
+        """Sleeps until the next state change, see sleep_until
+        Args:
+            time: The current time
+            wait: Function that sleeps for a number of seconds, returning True if interrupted
+            max_sleep: Longest single sleep before checking the clock, None sleeps straight through
+            tolerance: Seconds the wall clock may drift from the monotonic clock before waking early
+        Returns:
+            True if the state change was reached, False if woken early
+        """
+        transition = self.get_next_transition(time)
+        logger.info(f"Sleeping until {transition['state'].name} at {transition['time']}")
+        return sleep_until(transition["time"], wait=wait, max_sleep=max_sleep, tolerance=tolerance)
+
     def get_state(self, time: datetime) -> ScheduleState:
         """Returns the state at a given datetime
         Args:
@@ -100,3 +232,121 @@ class FdriScheduler:
             state = ScheduleState.OFF
 
         return state
+
+
+def _sleep(seconds: float) -> bool:
+    """Sleeps without being interruptible"""
+    clock.sleep(seconds)
+    return False
+
+
+def sleep_until(
+    deadline: datetime,
+    wait: Callable[[float], bool] | None = None,
+    max_sleep: float | None = None,
+    tolerance: float = 30.0,
+    wall_clock: Callable[[], float] = clock.time,
+    monotonic_clock: Callable[[], float] = clock.monotonic,
+) -> bool:
+    """Sleeps until a wall-clock deadline in as few wake ups as possible. Sleeps are measured
+    on the monotonic clock, so a jump in the wall clock (e.g. an NTP sync after booting without
+    a real time clock) shows up as the two clocks diverging and ends the sleep early
+    Args:
+        deadline: The time to wake at
+        wait: Function that sleeps for a number of seconds, returning True if interrupted
+        max_sleep: Longest single sleep before checking the clocks, None sleeps straight through
+        tolerance: Seconds the clocks may diverge before waking early
+        wall_clock: Wall clock in unix seconds
+        monotonic_clock: Monotonic clock in seconds
+    Returns:
+        True if the deadline was reached, False if the clock jumped or the wait was interrupted
+    """
+    if wait is None:
+        wait = _sleep
+    wall_start = wall_clock()
+    monotonic_start = monotonic_clock()
+
+    while True:
+        remaining = deadline.timestamp() - wall_clock()
+        if remaining <= 0:
+            return True
+        if wait(remaining if max_sleep is None else min(remaining, max_sleep)):
+            return False
+
+        jump = (wall_clock() - wall_start) - (monotonic_clock() - monotonic_start)
+        if abs(jump) > tolerance:
+            logger.warning(f"Wall clock jumped by {jump:.0f}s, waking early")
+            return False
+
+
+def next_capture_time(time: datetime, interval: int, after: datetime | None = None) -> datetime:
+    """Gets the next capture slot on the fixed-rate grid, slots are whole multiples of the
+        interval counted from the unix epoch so every camera uses the same wall-clock times
+    Args:
+        time: The earliest time the slot can be at
+        interval: Seconds between slots
+        after: The previous slot, the returned slot is always later than this one
+    Returns:
+        A timezone aware datetime of the next slot
+    """
+    timestamp = math.ceil(time.timestamp() / interval) * interval
+    if after is not None and timestamp <= after.timestamp():
+        timestamp = (math.floor(after.timestamp() / interval) + 1) * interval
+    return datetime.fromtimestamp(timestamp, tz=time.tzinfo or timezone.utc)
+
+
+class JitterStats:
+    """Running statistics of how late captures start compared to their scheduled slot"""
+
+    interval: int
+    """Seconds between slots"""
+
+    missed: int
+    """Total number of slots skipped because the previous capture overran"""
+
+    _lateness: Deque[float]
+    """Lateness in seconds of the most recent captures"""
+
+    def __init__(self, interval: int, window: int = 100) -> None:
+        """
+        Args:
+            interval: Seconds between slots
+            window: Number of recent captures the statistics are calculated over
+        """
+        self.interval = interval
+        self.missed = 0
+        self._lateness = deque(maxlen=window)
+        self._last_slot: datetime | None = None
+
+    def record(self, slot: datetime, actual: datetime) -> float:
+        """Records the start of a capture
+        Args:
+            slot: The time the capture was scheduled for
+            actual: The time the capture started
+        Returns:
+            How late the capture was in seconds
+        """
+        if self._last_slot is not None:
+            self.missed += max(0, round((slot - self._last_slot).total_seconds() / self.interval) - 1)
+        self._last_slot = slot
+
+        lateness = (actual - slot).total_seconds()
+        self._lateness.append(lateness)
+        return lateness
+
+    @property
+    def mean(self) -> float:
+        """Mean lateness in seconds"""
+        return sum(self._lateness) / len(self._lateness) if self._lateness else 0.0
+
+    @property
+    def max(self) -> float:
+        """Worst lateness in seconds"""
+        return max(self._lateness, default=0.0)
+
+    def summary(self) -> str:
+        """A one line description of the statistics for logging"""
+        return (
+            f"jitter over last {len(self._lateness)} captures: mean {self.mean * 1000:.1f}ms, "
+            f"max {self.max * 1000:.1f}ms, {self.missed} missed slots"
+        )
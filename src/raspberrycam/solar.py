@@ -0,0 +1,181 @@
+"""Vectorised sun event calculations for many sites and dates at once, using the NOAA
+solar equations (the same ones astral uses). Used for deployment and power planning,
+the camera itself uses Location.get_sun_stats"""
+
+import logging
+from datetime import date
+from typing import Dict, List, TypedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SUNRISE_ZENITH = 90.833
+"""Zenith of the sun's upper limb on the horizon, allowing for refraction"""
+
+CIVIL_ZENITH = 96.0
+"""Zenith of the sun at civil dawn and dusk"""
+
+
+class Site(TypedDict):
+    """Typed dictionary for a site to plan"""
+
+    site: str
+    lat: float
+    lon: float
+    interval: int
+
+
+class SitePlan(TypedDict):
+    """Typed dictionary of the expected totals for a site over the planning period"""
+
+    site: str
+    days: int
+    daylight_hours: float
+    captures: int
+    megabytes: float
+
+
+def _julian_century(julian_day: np.ndarray) -> np.ndarray:
+    return (julian_day - 2451545.0) / 36525.0
+
+
+def _declination_and_equation_of_time(julian_century: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Solar declination in degrees and equation of time in minutes"""
+    jc = julian_century
+    mean_long = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+    mean_anom = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    eccentricity = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+
+    centre = (
+        np.sin(mean_anom) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+        + np.sin(2 * mean_anom) * (0.019993 - 0.000101 * jc)
+        + np.sin(3 * mean_anom) * 0.000289
+    )
+    omega = np.radians(125.04 - 1934.136 * jc)
+    apparent_long = np.radians(np.degrees(mean_long) + centre - 0.00569 - 0.00478 * np.sin(omega))
+
+    mean_obliquity = 23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+    obliquity = np.radians(mean_obliquity + 0.00256 * np.cos(omega))
+    declination = np.degrees(np.arcsin(np.sin(obliquity) * np.sin(apparent_long)))
+
+    y = np.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * np.degrees(
+        y * np.sin(2 * mean_long)
+        - 2 * eccentricity * np.sin(mean_anom)
+        + 4 * eccentricity * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+        - 0.5 * y * y * np.sin(4 * mean_long)
+        - 1.25 * eccentricity * eccentricity * np.sin(2 * mean_anom)
+    )
+    return declination, equation_of_time
+
+
+def _cos_hour_angle(latitude: np.ndarray, declination: np.ndarray, zenith: float) -> np.ndarray:
+    """Cosine of the hour angle of the sun at the given zenith, below -1 if the sun stays
+    above it all day and above 1 if it never reaches it"""
+    lat = np.radians(latitude)
+    dec = np.radians(declination)
+    return np.cos(np.radians(zenith)) / (np.cos(lat) * np.cos(dec)) - np.tan(lat) * np.tan(dec)
+
+
+def _hour_angle(latitude: np.ndarray, declination: np.ndarray, zenith: float) -> np.ndarray:
+    """Hour angle in degrees of the sun at the given zenith, NaN if it never gets there"""
+    with np.errstate(invalid="ignore"):
+        return np.degrees(np.arccos(_cos_hour_angle(latitude, declination, zenith)))
+
+
+def _event_minutes(
+    latitude: np.ndarray, longitude: np.ndarray, julian_day: np.ndarray, zenith: float, rising: bool
+) -> np.ndarray:
+    """Minutes after UTC midnight of a rising or setting event, refined once at the event time"""
+    declination, equation_of_time = _declination_and_equation_of_time(_julian_century(julian_day + 0.5))
+    sign = -1 if rising else 1
+    minutes = 720 - 4 * longitude - equation_of_time + sign * 4 * _hour_angle(latitude, declination, zenith)
+
+    declination, equation_of_time = _declination_and_equation_of_time(_julian_century(julian_day + minutes / 1440))
+    return 720 - 4 * longitude - equation_of_time + sign * 4 * _hour_angle(latitude, declination, zenith)
+
+
+def _to_datetimes(days: np.ndarray, minutes: np.ndarray) -> np.ndarray:
+    """Converts minutes after midnight to datetime64, NaN becomes NaT"""
+    offsets = np.where(
+        np.isnan(minutes), np.timedelta64("NaT"), (np.nan_to_num(minutes) * 60e6).astype("timedelta64[us]")
+    )
+    return days.astype("datetime64[us]") + offsets
+
+
+def sun_events(latitudes: np.ndarray, longitudes: np.ndarray, dates: np.ndarray) -> Dict[str, np.ndarray]:
+    """Calculates dawn, sunrise, noon, sunset and dusk for every site and date at once
+    Args:
+        latitudes: Site latitudes in degrees, shape (sites,)
+        longitudes: Site longitudes in degrees, shape (sites,)
+        dates: UTC dates as datetime64[D], shape (dates,)
+    Returns:
+        A dictionary of UTC datetime64 arrays of shape (sites, dates), NaT where the event
+        doesn't happen (polar day or night)
+    """
+    latitude = np.asarray(latitudes, dtype=float)[:, None]
+    longitude = np.asarray(longitudes, dtype=float)[:, None]
+    days = np.asarray(dates, dtype="datetime64[D]")[None, :]
+    # Julian day of UTC midnight
+    julian_day = days.astype("int64") + 2440587.5
+
+    _, equation_of_time = _declination_and_equation_of_time(_julian_century(julian_day + 0.5 - longitude / 360))
+    noon = 720 - 4 * longitude - equation_of_time
+
+    return {
+        "dawn": _to_datetimes(days, _event_minutes(latitude, longitude, julian_day, CIVIL_ZENITH, rising=True)),
+        "sunrise": _to_datetimes(days, _event_minutes(latitude, longitude, julian_day, SUNRISE_ZENITH, rising=True)),
+        "noon": _to_datetimes(days, noon),
+        "sunset": _to_datetimes(days, _event_minutes(latitude, longitude, julian_day, SUNRISE_ZENITH, rising=False)),
+        "dusk": _to_datetimes(days, _event_minutes(latitude, longitude, julian_day, CIVIL_ZENITH, rising=False)),
+    }
+
+
+def daylight_seconds(latitudes: np.ndarray, longitudes: np.ndarray, dates: np.ndarray) -> np.ndarray:
+    """Calculates the time between sunrise and sunset for every site and date
+    Args:
+        latitudes: Site latitudes in degrees, shape (sites,)
+        longitudes: Site longitudes in degrees, shape (sites,)
+        dates: UTC dates as datetime64[D], shape (dates,)
+    Returns:
+        An array of seconds of shape (sites, dates), 0 for polar night and 86400 for polar day
+    """
+    latitude = np.asarray(latitudes, dtype=float)[:, None]
+    longitude = np.asarray(longitudes, dtype=float)[:, None]
+    days = np.asarray(dates, dtype="datetime64[D]")[None, :]
+    julian_day = days.astype("int64") + 2440587.5
+    # Declination at local solar noon
+    declination, _ = _declination_and_equation_of_time(_julian_century(julian_day + 0.5 - longitude / 360))
+
+    cos_hour_angle = _cos_hour_angle(latitude, declination, SUNRISE_ZENITH)
+    # The sun is up for twice the hour angle, at 4 minutes per degree
+    return 480 * np.degrees(np.arccos(np.clip(cos_hour_angle, -1, 1)))
+
+
+def plan_sites(sites: List[Site], start: date, days: int, image_kilobytes: float = 200) -> List[SitePlan]:
+    """Estimates daylight, captures and data volume for each site over a period
+    Args:
+        sites: The sites to plan, with their capture interval in seconds
+        start: First day of the period
+        days: Number of days in the period
+        image_kilobytes: Expected size of each image
+    Returns:
+        A plan for each site
+    """
+    dates = np.datetime64(start, "D") + np.arange(days)
+    daylight = daylight_seconds([site["lat"] for site in sites], [site["lon"] for site in sites], dates)
+    intervals = np.array([site["interval"] for site in sites], dtype=float)[:, None]
+    # The first capture is at sunrise and then one every interval until sunset
+    captures = np.where(daylight > 0, np.floor(daylight / intervals) + 1, 0).sum(axis=1)
+
+    return [
+        {
+            "site": site["site"],
+            "days": days,
+            "daylight_hours": round(float(daylight[i].sum()) / 3600, 1),
+            "captures": int(captures[i]),
+            "megabytes": round(float(captures[i]) * image_kilobytes / 1024, 1),
+        }
+        for i, site in enumerate(sites)
+    ]
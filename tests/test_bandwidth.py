@@ -0,0 +1,130 @@
+import os
+import struct
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import cv2
+import numpy as np
+
+from raspberrycam import jpeg
+from raspberrycam.bandwidth import RecompressionPolicy, ThroughputMeter, recompress_jpeg
+from raspberrycam.circuit import CircuitState
+from raspberrycam.config import load_config
+from raspberrycam.exif import EXIF_HEADER
+from raspberrycam.image import S3ImageManager
+
+
+def write_photo(path: Path, seed: int = 0) -> Path:
+    """Writes a detailed, hard to compress image at high quality"""
+    pixels = np.random.default_rng(seed).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    cv2.imwrite(str(path), cv2.GaussianBlur(pixels, (3, 3), 0), [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return path
+
+
+def test_throughput_meter() -> None:
+    meter = ThroughputMeter(alpha=0.5)
+    assert meter.rate is None
+    meter.record(1000, 1.0)
+    assert meter.rate == 1000
+    meter.record(3000, 1.0)
+    assert meter.rate == 2000
+    # Empty batches don't count
+    meter.record(0, 1.0)
+    assert meter.rate == 2000
+
+
+def test_recompression_targets() -> None:
+    policy = RecompressionPolicy(budget=10, keep_newest=2)
+    backlog = [
+        {"path": Path(f"{i}.jpg"), "captured": i, "size": 1000, "attempts": 0, "last_error": None} for i in range(6)
+    ]
+    # Uploads within the budget
+    assert policy.targets(backlog, bytes_per_second=600) == {}
+    # 4000 bytes left for the four oldest images once the newest two are sent
+    assert policy.targets(backlog, bytes_per_second=400) == {Path(f"{i}.jpg"): 500 for i in range(4)}
+    assert policy.targets(backlog[:2], bytes_per_second=1) == {}
+
+
+def test_recompress_jpeg(tmp_path: Path) -> None:
+    image = write_photo(tmp_path / "photo.jpg")
+    original_size = os.path.getsize(image)
+
+    size = recompress_jpeg(image, original_size // 10, min_quality=50, min_width=160)
+    assert size == os.path.getsize(image)
+    assert size < original_size // 5
+    assert cv2.imread(str(image)).shape[1] < 640
+
+    # Nothing to gain
+    assert recompress_jpeg(image, original_size) is None
+
+
+def test_recompress_jpeg_keeps_metadata(tmp_path: Path) -> None:
+    image = write_photo(tmp_path / "photo.jpg")
+    xmp = jpeg.app_segment(jpeg.APP1, b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta/>")
+    image.write_bytes(jpeg.splice(image.read_bytes(), [xmp]))
+
+    assert recompress_jpeg(image, os.path.getsize(image) // 10, min_quality=50, min_width=160)
+    data = image.read_bytes()
+    (segment,) = jpeg.find_segments(data, jpeg.APP1, b"http://ns.adobe.com/xap/1.0/\x00")
+    assert data[segment.start : segment.end] == xmp
+
+
+def test_recompress_jpeg_resizes_exif(tmp_path: Path) -> None:
+    image = write_photo(tmp_path / "photo.jpg")
+    # ImageWidth and ImageLength, then a pointer to an EXIF directory with PixelXDimension and PixelYDimension
+    ifd0 = struct.pack("<H", 3) + struct.pack("<HHII", 0x0100, 4, 1, 640) + struct.pack("<HHIHH", 0x0101, 3, 1, 480, 0)
+    ifd0 += struct.pack("<HHII", 0x8769, 4, 1, 50) + struct.pack("<I", 0)
+    exif = struct.pack("<H", 2) + struct.pack("<HHII", 0xA002, 4, 1, 640) + struct.pack("<HHII", 0xA003, 4, 1, 480)
+    tiff = b"II*\x00" + struct.pack("<I", 8) + ifd0 + exif + struct.pack("<I", 0)
+    image.write_bytes(jpeg.splice(image.read_bytes(), [jpeg.app_segment(jpeg.APP1, EXIF_HEADER + tiff)]))
+
+    assert recompress_jpeg(image, os.path.getsize(image) // 10, min_quality=50, min_width=160)
+    data = image.read_bytes()
+    height, width = cv2.imread(str(image)).shape[:2]
+    assert width < 640
+    (segment,) = jpeg.find_segments(data, jpeg.APP1, EXIF_HEADER)
+    tiff = data[segment.start + 4 + len(EXIF_HEADER) : segment.end]
+    assert struct.unpack_from("<I", tiff, 18) == (width,)
+    assert struct.unpack_from("<H", tiff, 30) == (height,)
+    assert struct.unpack_from("<I", tiff, 60) == (width,)
+    assert struct.unpack_from("<I", tiff, 72) == (height,)
+
+
+def test_recompress_backlog(tmp_path: Path, config_file: Path) -> None:
+    s3im = S3ImageManager(
+        "bucket", MagicMock(), tmp_path, load_config(config_file), recompression=RecompressionPolicy(keep_newest=1)
+    )
+    images = [write_photo(s3im.pending_directory / f"image_{i}.jpg", seed=i) for i in range(3)]
+    for image in images:
+        s3im.record_capture(image)
+    sizes = [os.path.getsize(image) for image in images]
+
+    # Nothing is measured yet
+    assert s3im.recompress_backlog() == 0
+
+    s3im.throughput.record(sum(sizes) // 7200, 1.0)
+    assert s3im.recompress_backlog() > 0
+    assert os.path.getsize(images[0]) < sizes[0]
+    assert os.path.getsize(images[-1]) == sizes[-1]
+    assert s3im.get_backlog_stats()["bytes"] == sum(os.path.getsize(image) for image in images)
+
+    # Recompressed images aren't re-encoded again, even if they are still over their share
+    assert all(entry["recompressed"] for entry in s3im.journal.pending()[:-1])
+    s3im.throughput.rate = 1
+    assert s3im.recompress_backlog() == 0
+
+
+def test_recompress_backlog_offline(tmp_path: Path, config_file: Path) -> None:
+    s3_manager = MagicMock()
+    s3_manager.breaker.state = CircuitState.OPEN
+    s3im = S3ImageManager(
+        "bucket", s3_manager, tmp_path, load_config(config_file), recompression=RecompressionPolicy(keep_newest=1)
+    )
+    images = [write_photo(s3im.pending_directory / f"image_{i}.jpg", seed=i) for i in range(3)]
+    for image in images:
+        s3im.record_capture(image)
+    s3im.throughput.record(1, 1.0)
+
+    # Nothing can be uploaded while the circuit breaker is open
+    assert s3im.recompress_backlog() == 0
+    assert not any(entry["recompressed"] for entry in s3im.journal.pending())
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from raspberrycam.batching import BatchPolicy, parse_window
+
+
+def test_parse_window() -> None:
+    start, end = parse_window("22:30 - 01:00")
+    assert (start.hour, start.minute) == (22, 30)
+    assert (end.hour, end.minute) == (1, 0)
+
+
+def test_immediate_policy() -> None:
+    policy = BatchPolicy()
+    assert policy.immediate
+
+    now = datetime(2025, 6, 6, 12, 0)
+    assert policy.reason({"images": 0, "bytes": 0, "oldest": None}, now) is None
+    assert policy.reason({"images": 1, "bytes": 100, "oldest": now.timestamp()}, now)
+
+
+def test_batch_limits() -> None:
+    policy = BatchPolicy(max_images=10, max_bytes=1000, max_age=3600)
+    assert not policy.immediate
+
+    now = datetime(2025, 6, 6, 12, 0)
+    fresh = now.timestamp() - 60
+    assert policy.reason({"images": 2, "bytes": 200, "oldest": fresh}, now) is None
+    assert "images" in policy.reason({"images": 10, "bytes": 200, "oldest": fresh}, now)
+    assert "KB" in policy.reason({"images": 2, "bytes": 1000, "oldest": fresh}, now)
+    assert "old" in policy.reason({"images": 2, "bytes": 200, "oldest": now.timestamp() - 3600}, now)
+
+
+def test_upload_windows() -> None:
+    policy = BatchPolicy(windows=["11:30-12:30", "23:00-01:00"])
+    backlog = {"images": 1, "bytes": 100, "oldest": None}
+
+    assert policy.reason(backlog, datetime(2025, 6, 6, 12, 0)) == "upload window"
+    assert policy.reason(backlog, datetime(2025, 6, 6, 12, 30)) is None
+    # Windows can run past midnight
+    assert policy.in_window(datetime(2025, 6, 6, 23, 30))
+    assert policy.in_window(datetime(2025, 6, 7, 0, 30))
+    assert not policy.in_window(datetime(2025, 6, 7, 1, 30))
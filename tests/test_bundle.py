@@ -0,0 +1,149 @@
+import io
+import os
+import tarfile
+from pathlib import Path
+from unittest.mock import patch
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from raspberrycam.bundle import MANIFEST_NAME, BundlePolicy, BundleReader, BundleStream
+from raspberrycam.config import load_config
+from raspberrycam.files import file_digests
+from raspberrycam.image import S3ImageManager
+from raspberrycam.journal import JournalEntry
+from raspberrycam.s3 import S3Manager
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/raspberrycam-uploader"
+BUCKET_NAME = "raspberrycam-test"
+
+
+def entry(path: Path, data: bytes, captured: float) -> JournalEntry:
+    path.write_bytes(data)
+    return {
+        "path": path,
+        "captured": captured,
+        "size": len(data),
+        "attempts": 0,
+        "last_error": None,
+        **file_digests(path),
+    }
+
+
+def test_bundle_stream(tmp_path: Path) -> None:
+    entries = [
+        entry(tmp_path / f"image_{i}.jpg", os.urandom(size), 1000 + i) for i, size in enumerate([1, 512, 70_001])
+    ]
+
+    bundle = BundleStream(entries)
+    with io.BufferedReader(bundle) as stream:
+        data = stream.read()
+    manifest = bundle.manifest
+    assert len(data) == manifest["size"]
+
+    # Every image can be sliced out of the bundle with its offset
+    for member, image in zip(manifest["members"], entries):
+        assert member["name"] == image["path"].name
+        assert data[member["offset"] : member["offset"] + member["size"]] == image["path"].read_bytes()
+
+    # And it's a normal tar with the manifest at the end
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == [image["path"].name for image in entries] + [MANIFEST_NAME]
+        assert tar.extractfile("image_2.jpg").read() == entries[2]["path"].read_bytes()
+        assert tar.getmember("image_1.jpg").mtime == 1001
+
+    # An image that grew after it was journaled fails the read instead of being cut short
+    with entries[0]["path"].open("ab") as f:
+        f.write(b"more")
+    bundle = BundleStream(entries)
+    with pytest.raises(IOError), io.BufferedReader(bundle) as stream:
+        stream.read()
+    assert bundle.changed == entries[0]["path"]
+
+
+def test_bundle_policy(tmp_path: Path) -> None:
+    entries = [
+        entry(tmp_path / f"image_{i}.jpg", b"x", captured) for i, captured in enumerate([0, 1800, 3600, 7200, 7300])
+    ]
+    groups = BundlePolicy(period=3600, min_images=2).groups(entries)
+    assert [[image["path"].name for image in group] for group in groups] == [
+        ["image_0.jpg", "image_1.jpg"],
+        ["image_3.jpg", "image_4.jpg"],
+    ]
+
+
+@pytest.fixture
+def aws(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    with mock_aws():
+        boto3.client("s3").create_bucket(
+            Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"}
+        )
+        yield
+
+
+def test_bundle_upload(aws: None, tmp_path: Path, config_file: Path) -> None:
+    config = load_config(config_file)
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    policy = BundlePolicy(period=10**9)
+    s3im = S3ImageManager(BUCKET_NAME, s3, tmp_path / "data", config, bundling=policy)
+
+    images = {}
+    for i in range(3):
+        image = s3im.pending_directory / f"image_{i}.jpg"
+        images[image.name] = os.urandom(1000 + i)
+        image.write_bytes(images[image.name])
+        s3im.record_capture(image)
+
+    results = s3im.upload_pending()
+    assert all(result["uploaded"] and result["deleted"] for result in results)
+    assert len({result["object_name"] for result in results}) == 1
+    assert s3im.get_pending_images() == []
+
+    object_name = results[0]["object_name"]
+    assert object_name.endswith("image_0_3.tar")
+    reader = BundleReader(s3.client, BUCKET_NAME, object_name)
+    assert [member["name"] for member in reader.manifest()["members"]] == list(images)
+    assert reader.read("image_1.jpg") == images["image_1.jpg"]
+    with pytest.raises(KeyError):
+        reader.read("missing.jpg")
+
+    extracted = reader.extract(tmp_path, ["image_2.jpg"])
+    assert extracted == [tmp_path / "image_2.jpg"]
+    assert extracted[0].read_bytes() == images["image_2.jpg"]
+
+    # Images found in an uploaded bundle aren't uploaded again
+    for name, data in images.items():
+        (s3im.pending_directory / name).write_bytes(data)
+        s3im.record_capture(s3im.pending_directory / name)
+    assert s3im.reconcile_uploads() == [s3im.pending_directory / name for name in images]
+    assert s3im.get_pending_images() == []
+
+
+def test_bundle_upload_failures(aws: None, tmp_path: Path, config_file: Path) -> None:
+    config = load_config(config_file)
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    s3im = S3ImageManager(BUCKET_NAME, s3, tmp_path, config, bundling=BundlePolicy(period=10**9), delete_cache=True)
+
+    images = []
+    for i in range(3):
+        image = s3im.pending_directory / f"image_{i}.jpg"
+        image.write_bytes(os.urandom(1000))
+        s3im.record_capture(image)
+        images.append(image)
+
+    # Rewritten with the same size after it was journaled, the bundle fails and nothing is deleted
+    images[1].write_bytes(os.urandom(1000))
+    results = s3im.upload_pending()
+    assert not any(result["uploaded"] or result["deleted"] for result in results)
+    assert s3im.journal.get(images[1])["sha256"] == file_digests(images[1])["sha256"]
+
+    # The tar was uploaded but not its manifest, the images are kept even though the cache isn't
+    with patch.object(s3, "upload_bytes", return_value=False):
+        results = s3im.upload_pending()
+    assert not any(result["uploaded"] or result["deleted"] for result in results)
+    assert s3im.get_pending_images() == images
+
+    results = s3im.upload_pending()
+    assert all(result["uploaded"] and result["deleted"] for result in results)
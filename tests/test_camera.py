@@ -0,0 +1,109 @@
+import time
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from raspberrycam.camera import CaptureProfile, FakeBackend, LibCamera, SessionCamera
+
+
+def test_session_camera(tmp_path: Path) -> None:
+    backend = FakeBackend()
+    cam = SessionCamera(256, 256, backend=backend, manage_power=False)
+    assert not cam.is_open
+
+    # The session is opened once and kept between captures
+    for i in range(3):
+        cam.capture_image(tmp_path / f"{i}.jpg", vflip=True, hflip=True)
+        assert (tmp_path / f"{i}.jpg").exists()
+    assert backend.opens == 1
+    assert cam.is_open
+
+    # Changing the orientation needs a new session
+    cam.capture_image(tmp_path / "flipped.jpg", vflip=False, hflip=True)
+    assert backend.opens == 2
+
+    cam.power_off()
+    assert not cam.is_open
+    assert not backend.is_open
+
+
+def test_session_camera_idle_timeout(tmp_path: Path) -> None:
+    backend = FakeBackend()
+    cam = SessionCamera(256, 256, backend=backend, idle_timeout=0.05, manage_power=False)
+
+    cam.capture_image(tmp_path / "first.jpg")
+    assert cam.is_open
+    time.sleep(0.2)
+    assert not cam.is_open
+
+    cam.capture_image(tmp_path / "second.jpg")
+    assert backend.opens == 2
+    assert (tmp_path / "second.jpg").exists()
+
+
+@patch("raspberrycam.camera.unload_camera_module")
+@patch("raspberrycam.camera.load_camera_module")
+def test_session_camera_reloads_after_idle(load: MagicMock, unload: MagicMock, tmp_path: Path) -> None:
+    events = []
+    load.side_effect = lambda: events.append("load")
+    unload.side_effect = lambda: events.append("unload")
+    backend = FakeBackend()
+    open_backend = backend.open
+    backend.open = lambda *args: events.append("open") or open_backend(*args)
+    cam = SessionCamera(256, 256, backend=backend, idle_timeout=0.01)
+
+    cam.capture_image(tmp_path / "first.jpg")
+    deadline = time.monotonic() + 5
+    while "unload" not in events and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # The modules are loaded again before the session reopens
+    cam.capture_image(tmp_path / "second.jpg")
+    assert events[:4] == ["open", "unload", "load", "open"]
+    assert (tmp_path / "second.jpg").exists()
+
+
+def test_capture_profile() -> None:
+    assert CaptureProfile().to_args() == []
+
+    profile = CaptureProfile(timeout=500, immediate=True, shutter=10000, gain=1.0, awbgains="1.5,1.2", denoise="off")
+    assert profile.to_args() == [
+        "--timeout",
+        "500",
+        "--immediate",
+        "--shutter",
+        "10000",
+        "--gain",
+        "1.0",
+        "--awbgains",
+        "1.5,1.2",
+        "--denoise",
+        "off",
+    ]
+
+
+@patch("raspberrycam.camera.subprocess.call")
+def test_libcamera_profile(mock_call: MagicMock, tmp_path: Path) -> None:
+    image = tmp_path / "test.jpg"
+    mock_call.side_effect = lambda cmd: image.write_bytes(b"\xff\xd8\xff\xd9")
+
+    cam = LibCamera(95, 1024, 768, profile=CaptureProfile(timeout=100, nopreview=True))
+    cam.capture_image(image, vflip=True, hflip=False)
+
+    cmd = mock_call.call_args.args[0]
+    assert cmd[0] == "rpicam-still"
+    assert cmd[cmd.index("--timeout") + 1] == "100"
+    assert "--nopreview" in cmd and "--vflip" in cmd and "--hflip" not in cmd
+    assert cam.last_capture_seconds is not None
+    assert cam.settings() == {"width": 1024, "height": 768, "quality": 95, "timeout": 100, "nopreview": True}
+
+
+@patch("raspberrycam.camera.subprocess.run")
+def test_libcamera_capture_bytes(mock_run: MagicMock) -> None:
+    cam = LibCamera(90, 1024, 768)
+    mock_run.return_value = MagicMock(returncode=0, stdout=b"\xff\xd8\xff\xd9")
+    assert cam.capture_bytes() == b"\xff\xd8\xff\xd9"
+    cmd = mock_run.call_args.args[0]
+    assert cmd[cmd.index("-o") + 1] == "-"
+
+    mock_run.return_value = MagicMock(returncode=1, stdout=b"", stderr=b"no cameras available")
+    assert cam.capture_bytes() is None
@@ -0,0 +1,92 @@
+import threading
+
+from raspberrycam.circuit import CircuitBreaker, CircuitState
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_circuit_breaker() -> None:
+    clock = FakeClock()
+    breaker = CircuitBreaker(base_delay=10, max_delay=60, jitter=0, clock=clock)
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot() == {"state": CircuitState.OPEN, "failures": 1, "retry_in": 10}
+
+    # After the backoff one trial request is let through
+    clock.now = 10
+    assert breaker.allow_request()
+    assert breaker.state == CircuitState.HALF_OPEN
+
+    # Failing again doubles the backoff, up to the maximum
+    breaker.record_failure()
+    assert breaker.snapshot()["retry_in"] == 20
+    for _ in range(5):
+        clock.now += 60
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.snapshot()["retry_in"] == 60
+
+    clock.now += 60
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.snapshot() == {"state": CircuitState.CLOSED, "failures": 0, "retry_in": 0}
+
+
+def test_circuit_breaker_probe() -> None:
+    clock = FakeClock()
+    online = False
+    breaker = CircuitBreaker(base_delay=10, jitter=0.5, probe=lambda: online, clock=clock)
+
+    breaker.record_failure()
+    assert 5 <= breaker.snapshot()["retry_in"] <= 15
+
+    # A failed probe backs off again without making a request
+    clock.now = 20
+    assert not breaker.allow_request()
+    assert breaker.failures == 2
+
+    online = True
+    clock.now = 100
+    assert breaker.allow_request()
+
+
+def test_circuit_breaker_single_trial() -> None:
+    clock = FakeClock()
+    breaker = CircuitBreaker(base_delay=10, jitter=0, trial_timeout=100, clock=clock)
+
+    # Every worker of a parallel batch failing only counts once
+    for _ in range(4):
+        breaker.record_failure()
+    assert breaker.failures == 1
+
+    # Only one thread makes the trial request, and it can check again while making it
+    clock.now = 10
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+    other = []
+    thread = threading.Thread(target=lambda: other.append(breaker.allow_request()))
+    thread.start()
+    thread.join()
+    assert other == [False]
+
+    # Failures of requests that aren't the trial don't count either
+    thread = threading.Thread(target=breaker.record_failure)
+    thread.start()
+    thread.join()
+    assert breaker.state == CircuitState.HALF_OPEN
+
+    # A trial that never reports back is given up on
+    clock.now = 110
+    thread = threading.Thread(target=lambda: other.append(breaker.allow_request()))
+    thread.start()
+    thread.join()
+    assert other == [False, True]
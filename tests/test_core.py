@@ -0,0 +1,378 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+from unittest.mock import MagicMock
+
+import cv2
+import numpy as np
+from dateutil.tz import tzlocal
+
+from raspberrycam import jpeg
+from raspberrycam.batching import BatchPolicy
+from raspberrycam.camera import CameraInterface, InMemoryCamera
+from raspberrycam.config import load_config
+from raspberrycam.core import Raspberrycam
+from raspberrycam.exif import XMP_HEADER, MetadataWriter
+from raspberrycam.files import staging_path
+from raspberrycam.filters import FrameAction
+from raspberrycam.image import InMemoryImage
+from raspberrycam.location import Location
+from raspberrycam.power import DeepSleepPolicy, SimulatedPower
+from raspberrycam.raspberrypi import GovernorController
+from raspberrycam.scheduler import FdriScheduler, ScheduleState
+
+
+class MockImageManager(MagicMock):
+    pass
+
+
+class MockCamera(MagicMock):
+    pass
+
+
+def test_raspberrycam() -> None:
+    """Will it run? -style test for the core interface"""
+    location = Location(55.8626453, -3.2031049)
+    sched = FdriScheduler(location)
+    cam = Raspberrycam(sched, MockCamera(256, 256), MockImageManager())
+
+    assert isinstance(cam, Raspberrycam)
+
+
+def test_uploads_do_not_delay_captures(tmp_path: Path) -> None:
+    """A slow upload shouldn't hold up the next capture"""
+    scheduler = MagicMock()
+    scheduler.get_state.return_value = ScheduleState.ON
+
+    uploading = threading.Event()
+    release = threading.Event()
+    done = threading.Event()
+
+    def capture_image(filepath: Path, **kwargs) -> None:
+        filepath.write_text("\n")
+        captures = camera.capture_image.call_count
+        # The upload is held until captures have carried on past it
+        if uploading.is_set() and captures >= 10:
+            release.set()
+        if captures == 15:
+            app._stop_event.set()
+            done.set()
+
+    camera = MockCamera()
+    camera.capture_image.side_effect = capture_image
+
+    names = (tmp_path / f"image_{i}.jpg" for i in range(1000))
+    image_manager = MockImageManager()
+    image_manager.get_pending_image_path.side_effect = lambda captured: next(names)
+    image_manager.get_pending_images.return_value = []
+
+    uploaded = []
+
+    def slow_upload(images: List[Path], debug: bool = False) -> list:
+        uploading.set()
+        release.wait(5)
+        uploaded.extend(images)
+        return [{"image": image, "object_name": image.name, "uploaded": True, "deleted": True} for image in images]
+
+    image_manager.upload_images.side_effect = slow_upload
+
+    app = Raspberrycam(scheduler, camera, image_manager, capture_interval=0.01, debug=True)
+    thread = threading.Thread(target=app.run, daemon=True)
+    thread.start()
+    assert done.wait(5)
+    thread.join(timeout=5)
+    app.stop(timeout=5)
+
+    captures = camera.capture_image.call_count
+    # Captures kept going while uploads were in progress, and were batched together
+    assert captures == 15
+    assert image_manager.upload_images.call_count < captures
+    assert uploaded == [tmp_path / f"image_{i}.jpg" for i in range(captures)]
+
+
+def test_aligned_captures(tmp_path: Path) -> None:
+    """Aligned captures start on whole multiples of the interval"""
+    scheduler = MagicMock()
+    scheduler.get_state.return_value = ScheduleState.ON
+
+    camera = MockCamera()
+    camera.capture_image.side_effect = lambda filepath, **kwargs: (
+        camera.capture_image.call_count == 2 and app._stop_event.set()
+    )
+    image_manager = MockImageManager()
+    image_manager.get_pending_image_path.return_value = tmp_path / "missing.jpg"
+    image_manager.get_pending_images.return_value = []
+
+    app = Raspberrycam(scheduler, camera, image_manager, capture_interval=1, align_captures=True, debug=True)
+    thread = threading.Thread(target=app.run, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    app.stop(timeout=5)
+
+    assert camera.capture_image.call_count == 2
+    assert app.jitter.max < 0.5
+    assert app._last_slot.microsecond == 0
+
+
+def test_batched_uploads(tmp_path: Path) -> None:
+    """Images are uploaded together once the batch policy is met"""
+    scheduler = MagicMock()
+    scheduler.get_state.return_value = ScheduleState.ON
+
+    camera = MockCamera()
+    camera.capture_image.side_effect = lambda filepath, **kwargs: filepath.write_text("\n")
+
+    names = (tmp_path / f"image_{i}.jpg" for i in range(1000))
+    pending = []
+    image_manager = MockImageManager()
+    image_manager.get_pending_image_path.side_effect = lambda captured: next(names)
+    image_manager.get_pending_images.return_value = []
+    image_manager.record_capture.side_effect = lambda image, **kwargs: pending.append(image)
+    image_manager.get_backlog_stats.side_effect = lambda: {"images": len(pending), "bytes": 0, "oldest": None}
+
+    batches = []
+    done = threading.Event()
+
+    def upload(images: List[Path], debug: bool = False) -> list:
+        batches.append(images)
+        pending.clear()
+        if len(batches) == 2:
+            done.set()
+        return [{"image": image, "object_name": image.name, "uploaded": True, "deleted": True} for image in images]
+
+    image_manager.upload_images.side_effect = upload
+
+    policy = BatchPolicy(max_images=3)
+    app = Raspberrycam(scheduler, camera, image_manager, capture_interval=0.01, batch_policy=policy, debug=True)
+    thread = threading.Thread(target=app.run, daemon=True)
+    thread.start()
+    assert done.wait(5)
+    app.stop(timeout=5)
+    thread.join(timeout=5)
+
+    assert len(batches) >= 2
+    assert all(len(batch) == 3 for batch in batches)
+    assert app.radio_on_seconds > 0
+
+
+def test_deep_sleep(tmp_path: Path) -> None:
+    """At night everything waiting is uploaded before the device halts"""
+    image = tmp_path / "image.jpg"
+    image.write_text("\n")
+
+    next_on = datetime.now(tzlocal()) + timedelta(hours=8)
+    scheduler = MagicMock()
+    scheduler.get_state.return_value = ScheduleState.OFF
+    scheduler.get_next_on_time.return_value = next_on
+
+    image_manager = MockImageManager()
+    image_manager.get_pending_images.return_value = [image]
+    image_manager.get_backlog_stats.return_value = {"images": 1, "bytes": 2, "oldest": None}
+    image_manager.upload_images.return_value = [{"image": image, "object_name": "", "uploaded": True, "deleted": True}]
+
+    power = SimulatedPower()
+    # Hold the upload back so the flush has to do it
+    policy = BatchPolicy(max_images=100)
+    app = Raspberrycam(
+        scheduler,
+        MockCamera(),
+        image_manager,
+        batch_policy=policy,
+        deep_sleep=DeepSleepPolicy(),
+        power=power,
+        governor=GovernorController(debug=True),
+    )
+    scheduler.sleep_until_next_transition.side_effect = lambda *args, **kwargs: app._stop_event.set()
+    app.run()
+    app.stop(timeout=5)
+
+    image_manager.upload_images.assert_called_once()
+    assert power.wakeups == [next_on - timedelta(seconds=300)]
+    assert power.shutdowns == 1
+
+
+def test_memory_capture(tmp_path: Path) -> None:
+    """Images captured to memory are uploaded without being written to disk, unless the upload fails"""
+    scheduler = MagicMock()
+    scheduler.get_state.return_value = ScheduleState.ON
+
+    camera = MockCamera(spec=InMemoryCamera)
+    camera.capture_bytes.return_value = b"\xff\xd8\xff\xd9"
+    image_manager = MockImageManager()
+    image_manager.get_pending_images.return_value = []
+    image_manager.get_image_name.side_effect = (f"image_{i}.jpg" for i in range(1000))
+
+    uploaded: List[InMemoryImage] = []
+    done = threading.Event()
+
+    def upload_capture(image: InMemoryImage, debug: bool = False) -> list:
+        uploaded.append(image)
+        if len(uploaded) == 4:
+            app._stop_event.set()
+            done.set()
+        # The first upload fails and is written to disk
+        kept = len(uploaded) == 1
+        path = tmp_path / image.name
+        return [{"image": path, "object_name": image.name, "uploaded": not kept, "deleted": not kept}]
+
+    image_manager.upload_capture.side_effect = upload_capture
+    image_manager.upload_images.return_value = []
+
+    app = Raspberrycam(scheduler, camera, image_manager, capture_interval=0.01, memory_capture=True, debug=True)
+    thread = threading.Thread(target=app.run, daemon=True)
+    thread.start()
+    assert done.wait(5)
+    thread.join(timeout=5)
+    app.stop(timeout=5)
+
+    camera.capture_image.assert_not_called()
+    assert len(uploaded) >= 4
+    assert all(image.data == b"\xff\xd8\xff\xd9" for image in uploaded)
+    # Only the failed upload went through the disk batch
+    image_manager.upload_images.assert_called_with([tmp_path / "image_0.jpg"], debug=True)
+
+
+def test_capture_embeds_metadata(tmp_path: Path, config_file: Path) -> None:
+    """Captures get their metadata spliced in, and are still kept if it can't be"""
+    location = Location(55.8626453, -3.2031049)
+    scheduler = MagicMock()
+    scheduler.location = location
+
+    ok, encoded = cv2.imencode(".jpg", np.zeros((48, 64, 3), dtype=np.uint8))
+    frames = iter([encoded.tobytes(), b"not a jpeg"])
+    camera = MockCamera()
+    camera.capture_image.side_effect = lambda filepath, **kwargs: filepath.write_bytes(next(frames))
+    camera.settings.return_value = {"width": 64, "height": 48}
+
+    names = (tmp_path / f"image_{i}.jpg" for i in range(2))
+    image_manager = MockImageManager()
+    image_manager.get_pending_image_path.side_effect = lambda captured: next(names)
+
+    writer = MetadataWriter(load_config(config_file), location)
+    app = Raspberrycam(scheduler, camera, image_manager, metadata_writer=writer, debug=True)
+
+    image = app.capture()
+    data = image.read_bytes()
+    assert np.array_equal(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), cv2.imdecode(encoded, 1))
+    assert jpeg.find_segments(data, jpeg.APP1, XMP_HEADER)
+    assert not staging_path(image).exists()
+
+    image = app.capture()
+    assert image.read_bytes() == b"not a jpeg"
+    assert image_manager.record_capture.call_count == 2
+
+
+def test_uploader_survives_errors(tmp_path: Path) -> None:
+    """A failing upload or journal keeps the batch and the upload thread alive"""
+    image = tmp_path / "image.jpg"
+    image_manager = MockImageManager()
+    image_manager.get_pending_images.side_effect = [[], sqlite3.OperationalError("database is locked"), []]
+
+    attempts = []
+    failed = threading.Event()
+    done = threading.Event()
+
+    def upload(images: List[Path], debug: bool = False) -> list:
+        attempts.append(list(images))
+        if len(attempts) == 1:
+            failed.set()
+            raise OSError("disk I/O error")
+        done.set()
+        return [{"image": image, "object_name": image.name, "uploaded": True, "deleted": True} for image in images]
+
+    image_manager.upload_images.side_effect = upload
+
+    app = Raspberrycam(MagicMock(), MockCamera(), image_manager, debug=True)
+    app.start_uploader()
+    app.upload_queue.put(image)
+    assert failed.wait(5)
+    # Reading the journal for images that overflowed the queue fails too
+    app._overflow.set()
+    app.upload_queue.put(tmp_path / "next.jpg")
+    assert done.wait(5)
+    app.stop(timeout=5)
+
+    assert not app._upload_thread.is_alive()
+    # The failed batch was tried again with the next capture
+    assert attempts[:2] == [[image], [image, tmp_path / "next.jpg"]]
+
+
+def test_stop_with_full_queue() -> None:
+    """Stopping doesn't wait for space in a full upload queue"""
+    image_manager = MockImageManager()
+    image_manager.get_pending_images.return_value = []
+    app = Raspberrycam(MagicMock(), MockCamera(), image_manager, upload_queue_size=1, debug=True)
+    app._upload_thread = MagicMock()
+    app.upload_queue.put(Path("image.jpg"))
+
+    app.stop(timeout=1)
+    app._upload_thread.join.assert_called_once_with(1)
+
+
+def test_night_sleep() -> None:
+    """At night the loop sleeps once, straight through to the next transition"""
+    scheduler = MagicMock()
+    scheduler.get_state.return_value = ScheduleState.OFF
+    image_manager = MockImageManager()
+    image_manager.get_pending_images.return_value = []
+
+    app = Raspberrycam(scheduler, MockCamera(), image_manager, governor=GovernorController(debug=True), debug=True)
+    scheduler.sleep_until_next_transition.side_effect = lambda *args, **kwargs: app._stop_event.set()
+    app.run()
+    app.stop(timeout=5)
+
+    scheduler.sleep_until_next_transition.assert_called_once()
+    assert scheduler.sleep_until_next_transition.call_args.kwargs == {"wait": app._stop_event.wait}
+
+
+def test_memory_capture_needs_support() -> None:
+    """A camera that can only capture to a file falls back to capturing to disk"""
+    app = Raspberrycam(MagicMock(), MockCamera(spec=CameraInterface), MockImageManager(), memory_capture=True)
+    assert not app.memory_capture
+
+
+def test_capture_with_full_disk(tmp_path: Path) -> None:
+    """A capture that can't be stored is dropped and the backlog evicted, instead of stopping the camera"""
+    camera = MockCamera()
+    camera.capture_image.side_effect = lambda filepath, **kwargs: filepath.write_bytes(b"image")
+    image_manager = MockImageManager()
+    image_manager.get_pending_image_path.return_value = tmp_path / "image.jpg"
+    image_manager.record_capture.side_effect = OSError(28, "No space left on device")
+
+    app = Raspberrycam(MagicMock(), camera, image_manager, debug=True)
+    assert app.capture() is None
+    image_manager.remove_image.assert_any_call(tmp_path / "image.jpg")
+    image_manager.enforce_quota.assert_called_once_with(disk_full=True)
+    assert app.upload_queue.empty()
+
+
+def test_downgraded_capture(tmp_path: Path) -> None:
+    """A frame downgraded to a thumbnail is stored with the thumbnails"""
+    camera = MockCamera()
+    camera.capture_image.side_effect = lambda filepath, **kwargs: filepath.write_bytes(b"image")
+    (tmp_path / "thumbnails").mkdir()
+    image_manager = MockImageManager()
+    image_manager.get_pending_image_path.return_value = tmp_path / "image.jpg"
+    image_manager.thumbnail_path.side_effect = lambda image: tmp_path / "thumbnails" / image.name
+    pipeline = MagicMock()
+    pipeline.process.return_value = {"action": FrameAction.THUMBNAIL, "reason": "duplicate"}
+
+    app = Raspberrycam(MagicMock(), camera, image_manager, frame_pipeline=pipeline, debug=True)
+    image = app.capture()
+    assert image == tmp_path / "thumbnails" / "image.jpg"
+    assert image.read_bytes() == b"image"
+    assert not (tmp_path / "image.jpg").exists()
+    assert image_manager.record_capture.call_args.args == (image,)
+
+
+def test_manifest_synced_per_batch() -> None:
+    """The capture manifest is uploaded once for the images drained together, not once per image"""
+    image_manager = MockImageManager()
+    image_manager.upload_capture.return_value = []
+    app = Raspberrycam(MagicMock(), MockCamera(spec=InMemoryCamera), image_manager, memory_capture=True, debug=True)
+
+    app._upload_from_memory([InMemoryImage(f"image_{i}.jpg", b"") for i in range(3)])
+    assert image_manager.upload_capture.call_count == 3
+    image_manager.sync_manifest.assert_called_once_with(debug=True)
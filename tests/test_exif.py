@@ -0,0 +1,95 @@
+import struct
+from datetime import datetime, timezone
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from raspberrycam import jpeg
+from raspberrycam.config import load_config
+from raspberrycam.exif import EXIF_HEADER, XMP_HEADER, XMP_NAMESPACE, MetadataWriter, build_exif
+from raspberrycam.location import Location
+from raspberrycam.metadata import make_metadata
+
+METADATA = make_metadata(
+    datetime(2026, 6, 1, 12, 30, 15, tzinfo=timezone.utc),
+    41.2,
+    {"width": 64, "height": 48, "shutter": 10000, "gain": 2.0},
+)
+
+
+def read_ifd(tiff: bytes, offset: int) -> dict:
+    """Reads the fields of a little-endian TIFF directory as raw values"""
+    (count,) = struct.unpack_from("<H", tiff, offset)
+    fields = {}
+    for i in range(count):
+        tag, field_type, n, value = struct.unpack_from("<HHI4s", tiff, offset + 2 + 12 * i)
+        size = n * {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1}[field_type]
+        if size > 4:
+            value = tiff[struct.unpack("<I", value)[0] :][:size]
+        fields[tag] = value[:size]
+    return fields
+
+
+def rationals(value: bytes) -> list:
+    return [a / b for a, b in struct.iter_unpack("<II", value)]
+
+
+def test_build_exif() -> None:
+    site = {"catchment": "TEST", "site": "SITE", "direction": "E", "latitude": 55.5, "longitude": -3.25}
+    payload = build_exif(METADATA, site)
+    assert payload.startswith(EXIF_HEADER)
+
+    tiff = payload[len(EXIF_HEADER) :]
+    assert tiff[:4] == b"II*\x00"
+    ifd0 = read_ifd(tiff, struct.unpack_from("<I", tiff, 4)[0])
+    assert ifd0[0x010E] == b"catchment=TEST site=SITE direction=E\x00"
+
+    exif = read_ifd(tiff, struct.unpack("<I", ifd0[0x8769])[0])
+    assert exif[0x9003] == b"2026:06:01 12:30:15\x00"
+    assert exif[0x9011] == b"+00:00\x00"
+    assert rationals(exif[0x829A]) == [0.01]
+    assert struct.unpack("<H", exif[0x8827]) == (200,)
+
+    gps = read_ifd(tiff, struct.unpack("<I", ifd0[0x8825])[0])
+    assert gps[0x0001] == b"N\x00"
+    assert rationals(gps[0x0002]) == [55, 30, 0]
+    assert gps[0x0003] == b"W\x00"
+    assert rationals(gps[0x0004]) == [3, 15, 0]
+
+
+def test_metadata_writer(config_file: Path) -> None:
+    config = load_config(config_file)
+    writer = MetadataWriter(config, Location(55.8626453, -3.2031049))
+    pixels = np.random.default_rng(0).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    ok, encoded = cv2.imencode(".jpg", pixels)
+    data = encoded.tobytes()
+
+    embedded = writer.embed(data, METADATA)
+    # The image data is untouched
+    assert embedded.endswith(data[list(jpeg.segments(data))[-1].start :])
+    assert np.array_equal(cv2.imdecode(np.frombuffer(embedded, np.uint8), cv2.IMREAD_COLOR), cv2.imdecode(encoded, 1))
+    # JFIF stays first and EXIF comes before XMP
+    markers = [segment.marker for segment in jpeg.segments(embedded)]
+    assert markers[:3] == [jpeg.APP0, jpeg.APP1, jpeg.APP1]
+    (exif,) = jpeg.find_segments(embedded, jpeg.APP1, EXIF_HEADER)
+    (xmp,) = jpeg.find_segments(embedded, jpeg.APP1, XMP_HEADER)
+    assert exif.start < xmp.start
+    packet = embedded[xmp.start + 4 + len(XMP_HEADER) : xmp.end].decode()
+    assert XMP_NAMESPACE in packet
+    assert f'pcam:Site="{config.site}"' in packet
+    assert f'pcam:Catchment="{config.catchment}"' in packet
+    assert 'exif:DateTimeOriginal="2026-06-01T12:30:15+00:00"' in packet
+    assert 'pcam:SunElevation="41.2"' in packet
+
+    # Embedding again keeps the EXIF and replaces the XMP
+    later = make_metadata(datetime(2026, 6, 2, tzinfo=timezone.utc), None, {})
+    again = writer.embed(embedded, later)
+    assert again.endswith(data[list(jpeg.segments(data))[-1].start :])
+    (kept,) = jpeg.find_segments(again, jpeg.APP1, EXIF_HEADER)
+    assert again[kept.start : kept.end] == embedded[exif.start : exif.end]
+    (xmp,) = jpeg.find_segments(again, jpeg.APP1, XMP_HEADER)
+    assert kept.start < xmp.start
+    packet = again[xmp.start : xmp.end]
+    assert b"2026-06-02T00:00:00+00:00" in packet
+    assert b"SunElevation" not in packet
@@ -0,0 +1,35 @@
+import base64
+import hashlib
+from pathlib import Path
+
+from raspberrycam.files import bytes_digests, commit, file_digests, remove_staging, staging_path, write_atomic
+
+
+def test_staging(tmp_path: Path) -> None:
+    image = tmp_path / "image.jpg"
+    staging = staging_path(image)
+    assert staging == tmp_path / ".image.jpg"
+
+    staging.write_bytes(b"x")
+    commit(image)
+    assert image.read_bytes() == b"x"
+    assert not staging.exists()
+
+    write_atomic(image, b"xyz")
+    assert image.read_bytes() == b"xyz"
+
+    # Left behind by a crash part way through writing
+    staging.write_bytes(b"x")
+    assert remove_staging(tmp_path) == 1
+    assert list(tmp_path.iterdir()) == [image]
+
+
+def test_digests(tmp_path: Path) -> None:
+    data = b"\xff\xd8" + bytes(range(256)) * 10_000 + b"\xff\xd9"
+    image = tmp_path / "image.jpg"
+    image.write_bytes(data)
+
+    digests = file_digests(image)
+    assert digests == bytes_digests(data)
+    assert digests["md5"] == hashlib.md5(data).hexdigest()
+    assert base64.b64decode(digests["sha256"]) == hashlib.sha256(data).digest()
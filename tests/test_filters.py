@@ -0,0 +1,77 @@
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from raspberrycam.filters import DuplicateFilter, FrameAction, FramePipeline, difference_hash, load_preview
+
+
+def write_scene(path: Path, phase: float = 0.0, noise: float = 0.0, seed: int = 0) -> Path:
+    """Writes a smooth test scene, with optional sensor noise"""
+    y, x = np.mgrid[0:480, 0:640]
+    scene = 128 + 60 * np.sin(x / 40 + phase) + 50 * np.cos(y / 55 - phase)
+    scene += np.random.default_rng(seed).normal(0, noise, scene.shape)
+    cv2.imwrite(str(path), np.clip(scene, 0, 255).astype(np.uint8))
+    return path
+
+
+def test_difference_hash(tmp_path: Path) -> None:
+    preview = load_preview(write_scene(tmp_path / "scene.jpg"))
+    assert preview.shape == (60, 80)
+
+    noisy = load_preview(write_scene(tmp_path / "noisy.jpg", noise=3, seed=1))
+    moved = load_preview(write_scene(tmp_path / "moved.jpg", phase=2.0))
+    assert difference_hash(preview).shape == (64,)
+    assert np.count_nonzero(difference_hash(preview) != difference_hash(noisy)) < 4
+    assert np.count_nonzero(difference_hash(preview) != difference_hash(moved)) >= 4
+
+
+def test_duplicate_filter(tmp_path: Path) -> None:
+    pipeline = FramePipeline([DuplicateFilter(threshold=4, max_skipped=2)])
+
+    assert pipeline.process(write_scene(tmp_path / "0.jpg"))["action"] == FrameAction.KEEP
+    # Same scene twice more, both dropped
+    for i in range(1, 3):
+        image = write_scene(tmp_path / f"{i}.jpg", noise=2, seed=i)
+        assert pipeline.process(image)["action"] == FrameAction.DROP
+        assert not image.exists()
+    # Kept after max_skipped duplicates in a row so the series is never empty
+    assert pipeline.process(write_scene(tmp_path / "3.jpg", noise=2, seed=3))["action"] == FrameAction.KEEP
+    # A changed scene is always kept
+    assert pipeline.process(write_scene(tmp_path / "4.jpg", phase=2.0))["action"] == FrameAction.KEEP
+    assert (tmp_path / "4.jpg").exists()
+
+
+def test_duplicate_thumbnails(tmp_path: Path) -> None:
+    pipeline = FramePipeline.from_config({"thumbnail_width": 160, "duplicates": {"action": "thumbnail"}})
+
+    pipeline.process(write_scene(tmp_path / "first.jpg"))
+    image = write_scene(tmp_path / "second.jpg", noise=2)
+    assert pipeline.process(image)["action"] == FrameAction.THUMBNAIL
+    assert cv2.imread(str(image)).shape == (120, 160, 3)
+
+
+def test_unreadable_frames_kept(tmp_path: Path) -> None:
+    image = tmp_path / "fake.jpg"
+    image.write_text("Pretend I'm an image")
+    assert FramePipeline([DuplicateFilter()]).process(image)["action"] == FrameAction.KEEP
+    assert image.exists()
+
+
+def test_exposure_filter(tmp_path: Path) -> None:
+    pipeline = FramePipeline.from_config({"exposure": {"action": "flag"}, "duplicates": {}})
+
+    dark = tmp_path / "dark.jpg"
+    cv2.imwrite(str(dark), np.full((480, 640), 5, dtype=np.uint8))
+    verdict = pipeline.process(dark)
+    assert verdict["action"] == FrameAction.FLAG
+    assert not verdict["usable"]
+    assert dark.exists()
+
+    blown_out = tmp_path / "blown_out.jpg"
+    cv2.imwrite(str(blown_out), np.full((480, 640), 255, dtype=np.uint8))
+    assert pipeline.process(blown_out)["action"] == FrameAction.FLAG
+
+    # Badly exposed frames never became the duplicate reference
+    verdict = pipeline.process(write_scene(tmp_path / "scene.jpg"))
+    assert verdict == {"action": FrameAction.KEEP, "reason": "first frame", "usable": True}
@@ -1,12 +1,18 @@
 import os
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import cv2
+import numpy as np
 import pytest
 from dotenv import load_dotenv
 
 from raspberrycam.config import load_config
-from raspberrycam.image import ImageManager, S3ImageManager
+from raspberrycam.files import file_digests
+from raspberrycam.image import ImageManager, InMemoryImage, S3ImageManager
+from raspberrycam.metadata import make_metadata
+from raspberrycam.quota import DiskQuota
 from raspberrycam.s3 import S3Manager
 
 load_dotenv()
@@ -52,16 +58,27 @@ def test_upload_deletion(mock_upload: MagicMock, tmp_path: Path, config_file: Pa
     mock_upload.return_value = False
     with open(filepath, "w") as out:
         out.write("\n")
+    s3im.record_capture(filepath)
     s3im.upload_pending()
 
-    # Default behaviour is to delete the image, in whatever case
+    # Default behaviour is to delete the image when the upload fails
     with pytest.raises(AssertionError):
         assert os.path.exists(filepath)
 
+    # Unless it wasn't tried because uploads are backing off while offline
+    with open(filepath, "w") as out:
+        out.write("\n")
+    s3im.record_capture(filepath)
+    with patch.object(s3, "available", return_value=False):
+        s3im.upload_pending()
+    assert os.path.exists(filepath)
+    s3im.remove_image(filepath)
+
     # Check we could still use the cache if explicitly wanted
     s3im = S3ImageManager(AWS_BUCKET_NAME, s3, tmp_path, config, delete_cache=False)
     with open(filepath, "w") as out:
         out.write("\n")
+    s3im.record_capture(filepath)
     s3im.upload_pending()
     assert os.path.exists(filepath)
 
@@ -69,6 +86,152 @@ def test_upload_deletion(mock_upload: MagicMock, tmp_path: Path, config_file: Pa
     mock_upload.return_value = True
     with open(filepath, "w") as out:
         out.write("\n")
+    s3im.record_capture(filepath)
     s3im.upload_pending()
 
     assert not os.path.exists(filepath)
+
+
+@patch("raspberrycam.s3.upload_to_s3")
+def test_upload_concurrent(mock_upload: MagicMock, tmp_path: Path, config_file: Path) -> None:
+    config = load_config(config_file)
+    s3 = S3Manager(role_arn=AWS_ROLE_ARN, access_key_id=AWS_ACCESS_KEY_ID, secret_access_key=AWS_SECRET_ACCESS_KEY)
+    s3im = S3ImageManager(AWS_BUCKET_NAME, s3, tmp_path, config, delete_cache=False, upload_workers=4)
+
+    # Every other upload fails
+    mock_upload.side_effect = lambda file_path, *args, **kwargs: int(file_path.stem[-1]) % 2 == 0
+
+    images = []
+    for i in range(10):
+        image = s3im.pending_directory / f"image_{i}.jpg"
+        image.write_text("\n")
+        images.append(image)
+
+    results = s3im.upload_images(images)
+    assert [result["image"] for result in results] == images
+    for result in results:
+        assert result["object_name"].endswith(result["image"].name)
+        assert result["uploaded"] == result["deleted"]
+        assert result["image"].exists() != result["uploaded"]
+    assert sum(result["uploaded"] for result in results) == 5
+
+
+@patch("raspberrycam.s3.upload_to_s3")
+def test_thumbnails_first(mock_upload: MagicMock, tmp_path: Path, config_file: Path) -> None:
+    config = load_config(config_file)
+    s3 = S3Manager(role_arn=AWS_ROLE_ARN, access_key_id=AWS_ACCESS_KEY_ID, secret_access_key=AWS_SECRET_ACCESS_KEY)
+    s3im = S3ImageManager(AWS_BUCKET_NAME, s3, tmp_path, config, thumbnail_width=64, upload_workers=2)
+    mock_upload.return_value = True
+
+    images = []
+    for i in range(3):
+        image = s3im.pending_directory / f"image_{i}.jpg"
+        cv2.imwrite(str(image), np.full((240, 320, 3), i * 50, dtype=np.uint8))
+        s3im.record_capture(image)
+        images.append(image)
+        assert cv2.imread(str(s3im.thumbnail_path(image))).shape == (48, 64, 3)
+
+    # Thumbnails are pending ahead of the images but don't count towards the backlog
+    thumbnails = [s3im.thumbnail_path(image) for image in images]
+    assert s3im.get_pending_images() == thumbnails + images
+    assert s3im.get_backlog_stats()["images"] == 3
+
+    results = s3im.upload_images(images)
+    assert [result["image"] for result in results] == thumbnails + images
+    assert ["type=PCAM_THUMB/" in result["object_name"] for result in results] == [True] * 3 + [False] * 3
+    assert s3im.get_pending_images() == []
+
+
+def test_upload_capture(tmp_path: Path, config_file: Path) -> None:
+    config = load_config(config_file)
+    s3 = MagicMock()
+    s3im = S3ImageManager(AWS_BUCKET_NAME, s3, tmp_path, config, thumbnail_width=64, delete_cache=False)
+    ok, encoded = cv2.imencode(".jpg", np.zeros((240, 320, 3), dtype=np.uint8))
+    image = InMemoryImage("memory.jpg", encoded.tobytes())
+
+    # Uploaded straight from memory, thumbnail first, without touching the disk
+    s3.upload_bytes.return_value = True
+    results = s3im.upload_capture(image)
+    assert [result["object_name"].split("/")[3] for result in results] == ["type=PCAM_THUMB", "type=PCAM"]
+    assert s3.upload_bytes.call_args.args[0] == image.data
+    assert all(result["uploaded"] and result["deleted"] for result in results)
+    assert s3im.get_pending_images() == []
+
+    # Written to disk to be uploaded later when the upload fails
+    s3.upload_bytes.return_value = False
+    results = s3im.upload_capture(image)
+    assert not any(result["deleted"] for result in results)
+    assert s3im.get_pending_images() == [s3im.thumbnail_directory / "memory.jpg", s3im.pending_directory / "memory.jpg"]
+    assert (s3im.pending_directory / "memory.jpg").read_bytes() == image.data
+
+    # Spilled images count towards the quota like any other capture
+    s3im.quota = DiskQuota(max_bytes=len(image.data), keep_newest=1)
+    s3im.upload_capture(InMemoryImage("memory_2.jpg", image.data))
+    assert not (s3im.pending_directory / "memory.jpg").exists()
+    assert s3im.get_pending_images()[-1] == s3im.pending_directory / "memory_2.jpg"
+
+    # A frame downgraded to a thumbnail is only uploaded as one
+    s3.upload_bytes.return_value = True
+    results = s3im.upload_capture(InMemoryImage("downgraded.jpg", image.data, thumbnail=True))
+    assert [result["object_name"].split("/")[3] for result in results] == ["type=PCAM_THUMB"]
+    s3.upload_bytes.return_value = False
+    s3im.upload_capture(InMemoryImage("downgraded.jpg", image.data, thumbnail=True))
+    assert (s3im.thumbnail_directory / "downgraded.jpg").read_bytes() == image.data
+    assert not (s3im.pending_directory / "downgraded.jpg").exists()
+    # Recording one doesn't make a thumbnail of the thumbnail
+    s3im.record_capture(s3im.thumbnail_directory / "downgraded.jpg")
+    assert (s3im.thumbnail_directory / "downgraded.jpg").read_bytes() == image.data
+
+
+def test_reconcile_uploads(tmp_path: Path, config_file: Path) -> None:
+    config = load_config(config_file)
+    s3 = MagicMock()
+    s3im = S3ImageManager(AWS_BUCKET_NAME, s3, tmp_path, config, thumbnail_width=64)
+
+    images = []
+    for i in range(3):
+        image = s3im.pending_directory / f"image_{i}.jpg"
+        cv2.imwrite(str(image), np.full((240, 320, 3), i * 50, dtype=np.uint8))
+        s3im.record_capture(image)
+        images.append(image)
+
+    # The first image was uploaded before a crash, the second was only partly uploaded
+    etags = {
+        s3im.partition_path(images[0]): file_digests(images[0])["md5"],
+        s3im.partition_path(images[1]): "0" * 32,
+    }
+    s3.list_etags.side_effect = lambda bucket, prefix: {k: v for k, v in etags.items() if k.startswith(prefix)}
+    assert s3im.reconcile_uploads() == [images[0]]
+    assert s3im.get_pending_images() == [s3im.thumbnail_path(image) for image in images] + images[1:]
+
+    # Nothing is removed while offline
+    s3.list_etags.side_effect = None
+    s3.list_etags.return_value = None
+    assert s3im.reconcile_uploads() == []
+
+
+def test_partition_by_capture_time(tmp_path: Path, config_file: Path) -> None:
+    config = load_config(config_file)
+    s3im = S3ImageManager(AWS_BUCKET_NAME, MagicMock(), tmp_path, config)
+
+    # Named in UTC, so a capture just after midnight local time in summer is still the previous day
+    captured = datetime(2026, 6, 2, 0, 30, tzinfo=timezone(timedelta(hours=1)))
+    image = s3im.get_pending_image_path(captured)
+    assert image.name.endswith("_20260601_233000.jpg")
+    assert "/date=2026-06-01/" in s3im.partition_path(image)
+    assert "/date=2026-06-01/" in s3im.partition_path(s3im.thumbnail_path(image))
+
+    # Images named without a capture time use the metadata recorded with them
+    image = s3im.pending_directory / "memory.jpg"
+    image.write_bytes(b"\xff\xd8\xff\xd9")
+    s3im.record_capture(image, metadata=make_metadata(captured - timedelta(days=3), 10.0, {}))
+    assert s3im.journal.get(image)["metadata"]["sun_elevation"] == 10.0
+    assert "/date=2026-05-29/" in s3im.partition_path(image)
+
+    # Names from before they were in UTC are local time, so the journal is trusted over the name
+    legacy = s3im.pending_directory / f"{config.catchment}_{config.site}_01_PCAM_{config.direction}_20260602_003000.jpg"
+    legacy.write_bytes(b"\xff\xd8\xff\xd9")
+    s3im.record_capture(legacy, metadata=make_metadata(captured, None, {}))
+    assert "/date=2026-06-01/" in s3im.partition_path(legacy)
+    s3im.journal.add(legacy, captured=captured.timestamp())
+    assert s3im.image_capture_time(legacy) == captured
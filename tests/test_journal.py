@@ -0,0 +1,80 @@
+from pathlib import Path
+
+from raspberrycam.files import file_digests
+from raspberrycam.journal import UploadJournal
+
+
+def test_journal(tmp_path: Path) -> None:
+    journal = UploadJournal(tmp_path / "uploads.db")
+    assert len(journal) == 0
+
+    images = []
+    for i, name in enumerate(["b.jpg", "a.jpg", "c.jpg"]):
+        image = tmp_path / name
+        image.write_bytes(b"x" * (i + 1))
+        journal.add(image, captured=1000 + i)
+        images.append(image)
+
+    # Pending images come back in capture order, not name order
+    assert [entry["path"] for entry in journal.pending()] == images
+    assert [entry["path"] for entry in journal.pending(limit=1)] == images[:1]
+    assert journal.total_size() == 6
+
+    journal.record_failure(images[0], "timed out")
+    entry = journal.pending(limit=1)[0]
+    assert entry["attempts"] == 1
+    assert entry["last_error"] == "timed out"
+
+    journal.remove(images[1])
+    assert len(journal) == 2
+
+    # The journal persists between runs
+    journal.close()
+    journal = UploadJournal(tmp_path / "uploads.db")
+    assert [entry["path"] for entry in journal.pending()] == [images[0], images[2]]
+
+
+def test_journal_reconcile(tmp_path: Path) -> None:
+    pending = tmp_path / "pending"
+    pending.mkdir()
+    journal = UploadJournal(tmp_path / "uploads.db")
+
+    kept = pending / "kept.jpg"
+    kept.write_bytes(b"x")
+    journal.add(kept)
+
+    gone = pending / "gone.jpg"
+    gone.write_bytes(b"x")
+    journal.add(gone)
+    gone.unlink()
+
+    # Written while the app wasn't running, and an empty half-written file
+    (pending / "new.jpg").write_bytes(b"x")
+    (pending / "empty.jpg").touch()
+
+    journal.reconcile(pending)
+    assert {entry["path"].name for entry in journal.pending()} == {"kept.jpg", "new.jpg"}
+
+
+def test_journal_digests(tmp_path: Path) -> None:
+    pending = tmp_path / "pending"
+    pending.mkdir()
+    journal = UploadJournal(tmp_path / "uploads.db")
+
+    image = pending / "a.jpg"
+    image.write_bytes(b"x")
+    journal.add(image, digests=file_digests(image))
+    assert journal.get(image)["md5"] == file_digests(image)["md5"]
+    assert journal.get(pending / "missing.jpg") is None
+
+    # Rewriting the file updates its size and hashes
+    image.write_bytes(b"xyz")
+    journal.update_file(image, file_digests(image))
+    entry = journal.get(image)
+    assert entry["size"] == 3
+    assert entry["sha256"] == file_digests(image)["sha256"]
+
+    # Staging files are half written and never journaled
+    (pending / ".b.jpg").write_bytes(b"x")
+    journal.reconcile(pending)
+    assert [entry["path"] for entry in journal.pending()] == [image]
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+import pytest
+
+from raspberrycam import jpeg
+
+
+def test_segments_and_dimensions() -> None:
+    ok, encoded = cv2.imencode(".jpg", np.zeros((48, 64, 3), dtype=np.uint8))
+    data = encoded.tobytes()
+
+    markers = [segment.marker for segment in jpeg.segments(data)]
+    assert jpeg.SOI not in markers
+    assert markers[-1] == jpeg.SOS
+    assert jpeg.dimensions(data) == (64, 48)
+    # Only the header is needed
+    assert jpeg.dimensions(data[:1000]) == (64, 48)
+
+    assert jpeg.dimensions(b"not a jpeg") is None
+    with pytest.raises(ValueError):
+        list(jpeg.segments(b"not a jpeg"))
+
+
+def test_splice() -> None:
+    ok, encoded = cv2.imencode(".jpg", np.zeros((48, 64, 3), dtype=np.uint8))
+    data = encoded.tobytes()
+    comment = jpeg.app_segment(jpeg.APP1, b"test\x00first")
+
+    spliced = jpeg.splice(data, [comment])
+    assert len(spliced) == len(data) + len(comment)
+    # Inserted after the JFIF segment
+    (segment,) = jpeg.find_segments(spliced, jpeg.APP1, b"test\x00")
+    assert spliced[segment.start : segment.end] == comment
+    assert [s.marker for s in jpeg.segments(spliced)][:2] == [jpeg.APP0, jpeg.APP1]
+
+    replacement = jpeg.app_segment(jpeg.APP1, b"test\x00second")
+    replaced = jpeg.splice(spliced, [replacement], removed=[segment])
+    assert replaced == jpeg.splice(data, [replacement])
+
+    with pytest.raises(ValueError):
+        jpeg.app_segment(jpeg.APP1, bytes(jpeg.MAX_PAYLOAD + 1))
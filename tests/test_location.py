@@ -1,4 +1,6 @@
-from datetime import datetime
+from datetime import date, datetime, timezone
+
+from dateutil.tz import tzlocal
 
 from raspberrycam.location import Location
 
@@ -13,3 +15,36 @@ def test_get_sun_stats() -> None:
     assert "sunrise" in stats and "sunset" in stats
     # We could go on to check for specific times
     # But would just be testing astral...
+
+
+def test_sun_table() -> None:
+    location = Location(55.8626453, -3.2031049)
+    table = location.sun_table
+
+    morning = location.get_sun_stats(datetime(2025, 6, 6, 2, 0, tzinfo=tzlocal()))
+    evening = location.get_sun_stats(datetime(2025, 6, 6, 22, 0, tzinfo=tzlocal()))
+    assert morning == evening
+    assert (table.misses, table.hits) == (1, 1)
+
+    # Matches the uncached calculation
+    uncached = Location._get_sun_stats(location, datetime(2025, 6, 6, tzinfo=tzlocal()))
+    assert morning["sunrise"] == uncached["sunrise"] and morning["sunset"] == uncached["sunset"]
+
+    # Dates and datetimes are separate entries, and the table is bounded
+    location.get_sun_stats(date(2025, 6, 6))
+    assert table.misses == 2
+    for day in range(1, 32):
+        location.get_sun_stats(date(2025, 7, day))
+    assert len(table._table) == table.maxsize
+
+    # A table with no size calculates every time
+    location = Location(55.8626453, -3.2031049, cache_size=0)
+    location.get_sun_stats(date(2025, 6, 6))
+    location.get_sun_stats(date(2025, 6, 6))
+    assert location.sun_table.misses == 2
+
+
+def test_sun_elevation() -> None:
+    location = Location(55.8626453, -3.2031049)
+    assert location.sun_elevation(datetime(2025, 6, 21, 12, 0, tzinfo=timezone.utc)) > 50
+    assert location.sun_elevation(datetime(2025, 6, 21, 0, 0, tzinfo=timezone.utc)) < 0
@@ -0,0 +1,111 @@
+import json
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import boto3
+import cv2
+import numpy as np
+import pytest
+from moto import mock_aws
+
+from raspberrycam import jpeg
+from raspberrycam.config import load_config
+from raspberrycam.image import S3ImageManager
+from raspberrycam.manifest import CaptureManifest, make_record
+from raspberrycam.s3 import S3Manager
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/raspberrycam-uploader"
+BUCKET_NAME = "raspberrycam-test"
+KEY = "catchment=C/site=S/compound=01/type=PCAM/direction=E/date=2026-06-01/image.jpg"
+
+
+@pytest.fixture
+def aws(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    with mock_aws():
+        boto3.client("s3").create_bucket(
+            Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"}
+        )
+        yield
+
+
+def jpeg_bytes(value: int) -> bytes:
+    return cv2.imencode(".jpg", np.full((240, 320, 3), value, dtype=np.uint8))[1].tobytes()
+
+
+def test_make_record() -> None:
+    data = jpeg_bytes(100)
+    # The dimensions only need the header
+    header = data[: next(segment.end for segment in jpeg.segments(data) if segment.marker == jpeg.SOS)]
+    record = make_record(KEY, "image.jpg", len(data), 1780000000, "abc=", header, offset=512)
+    assert record["type"] == "PCAM"
+    assert record["captured"] == "2026-05-28T20:26:40+00:00"
+    assert record["size"] == len(data)
+    assert (record["width"], record["height"]) == (320, 240)
+    assert record["offset"] == 512
+    assert "width" not in make_record(KEY, "image.jpg", len(data), 1780000000, None, header[:20])
+
+
+def test_manifest_sync(aws: None, tmp_path: Path) -> None:
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    client = boto3.client("s3")
+    manifest_key = "manifests/2026-06-01.jsonl"
+    # Uploaded before the local manifest was lost
+    earlier = make_record(KEY.replace("image.jpg", "earlier.jpg"), "earlier.jpg", 1000, 1780290000, None)
+    client.put_object(Bucket=BUCKET_NAME, Key=manifest_key, Body=json.dumps(earlier) + "\n")
+
+    manifest = CaptureManifest(tmp_path)
+    manifest.append(make_record(KEY, "image.jpg", 1000, 1780300000, None))
+    assert manifest.sync(s3, BUCKET_NAME, lambda day: f"manifests/{day}.jsonl") == ["2026-06-01"]
+    body = client.get_object(Bucket=BUCKET_NAME, Key=manifest_key)["Body"].read().decode()
+    assert [json.loads(line)["name"] for line in body.splitlines()] == ["earlier.jpg", "image.jpg"]
+
+    # Nothing changed, nothing uploaded
+    assert manifest.sync(s3, BUCKET_NAME, lambda day: f"manifests/{day}.jsonl") == []
+
+    # Days that weren't uploaded before a restart are uploaded again
+    manifest = CaptureManifest(tmp_path, keep_days=100_000)
+    assert manifest.sync(s3, BUCKET_NAME, lambda day: f"manifests/{day}.jsonl") == ["2026-06-01"]
+
+    # Captures are still recorded while the uploaded manifest is downloaded
+    manifest = CaptureManifest(tmp_path, keep_days=100_000)
+    appended = []
+
+    def download_bytes(bucket_name: str, key: str) -> bytes:
+        thread = threading.Thread(target=manifest.append, args=(make_record(KEY, "later.jpg", 1000, 1780310000, None),))
+        thread.start()
+        thread.join(timeout=5)
+        appended.append(not thread.is_alive())
+        return body.encode()
+
+    with patch.object(s3, "download_bytes", side_effect=download_bytes):
+        assert manifest.sync(s3, BUCKET_NAME, lambda day: f"manifests/{day}.jsonl") == ["2026-06-01"]
+    assert appended == [True]
+    assert [record["name"] for record in manifest.records("2026-06-01")][-1] == "later.jpg"
+
+    # Old local manifests are deleted
+    CaptureManifest(tmp_path, keep_days=0)
+    assert list(tmp_path.glob("*.jsonl")) == []
+
+
+def test_uploads_are_recorded(aws: None, tmp_path: Path, config_file: Path) -> None:
+    config = load_config(config_file)
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    manifest = CaptureManifest(tmp_path / "manifests")
+    s3im = S3ImageManager(BUCKET_NAME, s3, tmp_path / "data", config, thumbnail_width=64, capture_manifest=manifest)
+
+    for i in range(2):
+        image = s3im.pending_directory / f"image_{i}.jpg"
+        image.write_bytes(jpeg_bytes(i * 100))
+        s3im.record_capture(image)
+    results = s3im.upload_pending()
+
+    records = manifest.records(next(manifest.directory.glob("*.jsonl")).stem)
+    assert [record["key"] for record in records] == [result["object_name"] for result in results]
+    assert [record["type"] for record in records] == ["PCAM_THUMB"] * 2 + ["PCAM"] * 2
+    assert [(record["width"], record["height"]) for record in records[2:]] == [(320, 240)] * 2
+
+    day = records[0]["key"].split("date=")[1][:10]
+    body = boto3.client("s3").get_object(Bucket=BUCKET_NAME, Key=s3im.capture_manifest_key(day))["Body"].read()
+    assert [json.loads(line) for line in body.decode().splitlines()] == records
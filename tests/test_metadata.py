@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta, timezone
+
+from raspberrycam.metadata import capture_time, make_metadata, name_time
+
+
+def test_make_metadata() -> None:
+    # Captured at 00:30 British Summer Time, which is still the previous day in UTC
+    captured = datetime(2026, 6, 2, 0, 30, tzinfo=timezone(timedelta(hours=1)))
+    metadata = make_metadata(captured, -12.3456, {"width": 1024})
+    assert metadata == {"captured": "2026-06-01T23:30:00+00:00", "sun_elevation": -12.35, "camera": {"width": 1024}}
+    assert capture_time(metadata) == captured
+
+
+def test_name_time() -> None:
+    expected = datetime(2026, 6, 1, 23, 30, tzinfo=timezone.utc)
+    assert name_time("SE_CARGN_01_PCAM_E_20260601_233000.jpg") == expected
+    # Bundles are named after their first image
+    assert name_time("SE_CARGN_01_PCAM_E_20260601_233000_12.tar") == expected
+    assert name_time("memory.jpg") is None
+    assert name_time("SE_CARGN_01_PCAM_E_20261399_999999.jpg") is None
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+
+from raspberrycam.power import DeepSleepPolicy, SimulatedPower
+
+
+def test_deep_sleep_decision() -> None:
+    policy = DeepSleepPolicy(wake_margin=300, min_sleep=3600, idle_watts=2.0, halted_watts=0.3, boot_joules=120)
+    now = datetime(2025, 6, 6, 22, 0, tzinfo=timezone.utc)
+
+    # A long night is worth halting for, waking before the ON time
+    next_on = now + timedelta(hours=6)
+    decision = policy.decide(now, next_on)
+    assert decision["sleep"]
+    assert decision["wake_time"] == next_on - timedelta(seconds=300)
+    assert decision["idle_joules"] == 2.0 * 6 * 3600
+    assert decision["deep_sleep_joules"] < decision["idle_joules"]
+
+    # Too short to bother
+    assert not policy.decide(now, now + timedelta(minutes=30))["sleep"]
+
+    # Booting costs more than it saves
+    expensive = DeepSleepPolicy(min_sleep=0, idle_watts=0.5, halted_watts=0.3, boot_joules=10000)
+    decision = expensive.decide(now, next_on)
+    assert not decision["sleep"]
+    assert "more energy" in decision["reason"]
+
+
+def test_simulated_power() -> None:
+    power = SimulatedPower()
+    wake_time = datetime(2025, 6, 7, 3, 0, tzinfo=timezone.utc)
+    power.schedule_wakeup(wake_time)
+    power.shutdown()
+    assert power.wakeups == [wake_time]
+    assert power.shutdowns == 1
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from raspberrycam.config import load_config
+from raspberrycam.image import ImageManager
+from raspberrycam.journal import JournalEntry
+from raspberrycam.quota import DiskQuota, KeepDailyNoon, OldestFirst, ThinOut
+
+
+def entries(times: list, size: int = 100) -> list[JournalEntry]:
+    return [
+        {"path": Path(f"{i}.jpg"), "captured": time.timestamp(), "size": size, "attempts": 0, "last_error": None}
+        for i, time in enumerate(times)
+    ]
+
+
+def test_eviction_policies() -> None:
+    start = datetime(2025, 6, 6, 6)
+    backlog = entries([start + timedelta(hours=i) for i in range(8)])
+
+    assert OldestFirst().select(backlog, 250) == [Path("0.jpg"), Path("1.jpg"), Path("2.jpg")]
+    assert ThinOut().select(backlog, 250) == [Path("1.jpg"), Path("3.jpg"), Path("5.jpg")]
+    # A second pass thins what's left after every other image has gone
+    assert ThinOut().select(backlog, 500) == [Path(f"{i}.jpg") for i in [1, 3, 5, 7, 2]]
+
+    # 06:00 to 13:00 on one day and 06:00 to 13:00 on the next, 12:00 is kept until last
+    backlog = entries([start + timedelta(days=day, hours=i) for day in range(2) for i in range(8)])
+    selected = KeepDailyNoon().select(backlog, 1600)
+    assert Path("6.jpg") not in selected[:14] and Path("14.jpg") not in selected[:14]
+    assert selected[14:] == [Path("6.jpg"), Path("14.jpg")]
+
+
+def test_disk_quota() -> None:
+    quota = DiskQuota(max_bytes=500, low_water=0.8, keep_newest=2)
+    backlog = entries([datetime(2025, 6, 6, i) for i in range(6)])
+    assert quota.select(backlog[:5], 500) == []
+    # Evicted down to 400 bytes
+    assert quota.select(backlog, 600) == [Path("0.jpg"), Path("1.jpg")]
+    # The newest images are never evicted
+    assert quota.select(backlog[:2], 600) == []
+
+    with pytest.raises(ValueError):
+        DiskQuota(max_bytes=1, policy="newest")
+
+
+def test_image_manager_quota(tmp_path: Path, config_file: Path) -> None:
+    im = ImageManager(tmp_path, load_config(config_file), quota=DiskQuota(max_bytes=1000, low_water=0.5))
+    images = []
+    for i in range(5):
+        image = im.pending_directory / f"image_{i}.jpg"
+        image.write_bytes(b"\0" * 300)
+        im.record_capture(image)
+        images.append(image)
+
+    # Over the quota on the fourth image, evicted down to 500 bytes
+    assert [image.exists() for image in images] == [False, False, False, True, True]
+    assert im.get_pending_images() == images[3:]
+
+    # The disk filling up first evicts as if the backlog had just gone over its quota
+    assert im.enforce_quota() == []
+    assert im.enforce_quota(disk_full=True) == [images[3]]
+    assert im.get_pending_images() == images[4:]
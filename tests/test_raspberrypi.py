@@ -0,0 +1,57 @@
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from raspberrycam.raspberrypi import GovernorController, GovernorMode
+
+
+@pytest.fixture
+def sysfs(tmp_path: Path) -> Path:
+    """A fake /sys/devices/system/cpu with four CPUs"""
+    for cpu in range(4):
+        cpufreq = tmp_path / f"cpu{cpu}" / "cpufreq"
+        cpufreq.mkdir(parents=True)
+        (cpufreq / "scaling_governor").write_text("ondemand\n")
+    (tmp_path / "cpuidle").mkdir()
+    return tmp_path
+
+
+def governors(sysfs: Path) -> set:
+    return {path.read_text() for path in sysfs.glob("cpu*/cpufreq/scaling_governor")}
+
+
+def test_governor_controller(sysfs: Path) -> None:
+    governor = GovernorController(sysfs_root=sysfs)
+    assert len(governor.governor_files()) == 4
+    assert governor.mode == GovernorMode.ONDEMAND
+
+    governor.set(GovernorMode.PERFORMANCE)
+    assert governors(sysfs) == {"performance"}
+    assert governor.read() == GovernorMode.PERFORMANCE
+
+    # Setting the same mode again doesn't touch the files
+    with patch.object(Path, "write_text") as mock_write:
+        governor.set(GovernorMode.PERFORMANCE)
+        mock_write.assert_not_called()
+
+
+def test_governor_boost(sysfs: Path) -> None:
+    governor = GovernorController(sysfs_root=sysfs)
+    with governor.boost():
+        assert governors(sysfs) == {"performance"}
+    assert governors(sysfs) == {"ondemand"}
+    assert governor.mode == GovernorMode.ONDEMAND
+
+
+@patch("raspberrycam.raspberrypi.subprocess.run")
+def test_governor_privileged_fallback(mock_run: MagicMock, sysfs: Path) -> None:
+    governor = GovernorController(sysfs_root=sysfs)
+    with patch.object(Path, "write_text", side_effect=PermissionError):
+        governor.set(GovernorMode.POWERSAVE)
+
+    args = mock_run.call_args.args[0]
+    assert args[:2] == ["sudo", "tee"]
+    assert len(args) == 6
+    assert mock_run.call_args.kwargs["input"] == "powersave"
+    assert governor.mode == GovernorMode.POWERSAVE
@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable
+from unittest.mock import patch
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from moto import mock_aws
+
+from raspberrycam.circuit import CircuitBreaker, CircuitState
+from raspberrycam.files import file_digests
+from raspberrycam.s3 import S3Manager, is_connection_error
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/raspberrycam-uploader"
+BUCKET_NAME = "raspberrycam-test"
+
+
+@pytest.fixture
+def aws(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    with mock_aws():
+        boto3.client("s3").create_bucket(
+            Bucket=BUCKET_NAME, CreateBucketConfiguration={"LocationConstraint": "eu-west-2"}
+        )
+        yield
+
+
+def test_credentials_are_reused(aws: None) -> None:
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    assert not s3.credentials_valid()
+    assert s3.client is None
+
+    s3.assume_role()
+    credentials = s3.credentials
+    client = s3.client
+    assert s3.credentials_valid()
+    assert credentials["expiration"] is not None
+
+    # Valid credentials and their client are kept
+    s3.assume_role()
+    assert s3.credentials is credentials
+    assert s3.client is client
+
+    # Credentials inside the refresh margin are replaced, along with the client
+    credentials["expiration"] = datetime.now(timezone.utc) + timedelta(seconds=s3.refresh_margin - 1)
+    assert not s3.credentials_valid()
+    s3.assume_role()
+    assert s3.credentials is not credentials
+    assert s3.client is not client
+
+
+def test_upload_reuses_client(aws: None, tmp_path: Path) -> None:
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    s3.assume_role()
+    client = s3.client
+
+    for name in ["a.jpg", "b.jpg"]:
+        image = tmp_path / name
+        image.write_bytes(b"\xff\xd8\xff\xd9")
+        assert s3.upload(image, BUCKET_NAME, f"images/{name}")
+        assert s3.client is client
+
+    listing = boto3.client("s3").list_objects_v2(Bucket=BUCKET_NAME, Prefix="images/")
+    assert [item["Key"] for item in listing["Contents"]] == ["images/a.jpg", "images/b.jpg"]
+
+
+def test_upload_circuit_breaker(tmp_path: Path) -> None:
+    breaker = CircuitBreaker(base_delay=60)
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN, breaker=breaker)
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"\xff\xd8\xff\xd9")
+
+    def refused(*args, on_error: Callable[[Exception], None], **kwargs) -> bool:
+        on_error(ClientError({"Error": {"Code": "AccessDenied"}}, "PutObject"))
+        return False
+
+    def unreachable(*args, on_error: Callable[[Exception], None], **kwargs) -> bool:
+        on_error(EndpointConnectionError(endpoint_url="https://s3.amazonaws.com"))
+        return False
+
+    # S3 refusing a request isn't a connection problem
+    with patch("raspberrycam.s3.upload_to_s3", side_effect=refused):
+        assert not s3.upload(image, BUCKET_NAME)
+        assert breaker.state == CircuitState.CLOSED
+
+    with patch("raspberrycam.s3.upload_to_s3", side_effect=unreachable) as mock_upload:
+        assert not s3.upload(image, BUCKET_NAME)
+        assert breaker.state == CircuitState.OPEN
+
+        # Nothing else is sent until the backoff has passed
+        assert not s3.upload(image, BUCKET_NAME)
+        assert mock_upload.call_count == 1
+
+
+def test_upload_bytes(aws: None) -> None:
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    s3.assume_role()
+    assert s3.upload_bytes(b"\xff\xd8\xff\xd9", BUCKET_NAME, "images/memory.jpg")
+
+    body = boto3.client("s3").get_object(Bucket=BUCKET_NAME, Key="images/memory.jpg")["Body"].read()
+    assert body == b"\xff\xd8\xff\xd9"
+
+
+def test_checksum_and_etags(aws: None, tmp_path: Path) -> None:
+    s3 = S3Manager(access_key_id="testing", secret_access_key="testing", role_arn=ROLE_ARN)
+    s3.assume_role()
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"\xff\xd8\xff\xd9")
+    digests = file_digests(image)
+
+    assert s3.upload(image, BUCKET_NAME, "images/a.jpg", checksum_sha256=digests["sha256"])
+    # The checksum is sent for S3 to verify the contents against
+    with patch.object(s3.client, "put_object", wraps=s3.client.put_object) as put_object:
+        assert s3.upload_bytes(b"\xff\xd8\xff\xd9", BUCKET_NAME, "images/b.jpg", checksum_sha256=digests["sha256"])
+    assert put_object.call_args.kwargs["ChecksumSHA256"] == digests["sha256"]
+
+    assert s3.list_etags(BUCKET_NAME, "images/") == {
+        "images/a.jpg": digests["md5"],
+        "images/b.jpg": digests["md5"],
+    }
+    assert s3.list_etags(BUCKET_NAME, "other/") == {}
+
+
+def test_is_connection_error() -> None:
+    assert is_connection_error(EndpointConnectionError(endpoint_url="https://s3.amazonaws.com"))
+    assert not is_connection_error(ClientError({"Error": {"Code": "BadDigest"}}, "PutObject"))
+    # Transfers raise their own exception from the original one
+    try:
+        try:
+            raise ReadTimeoutError(endpoint_url="https://s3.amazonaws.com")
+        except ReadTimeoutError as e:
+            raise RuntimeError("Upload failed") from e
+    except RuntimeError as e:
+        assert is_connection_error(e)
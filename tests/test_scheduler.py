@@ -1,9 +1,10 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
 from dateutil.tz import tzlocal
 
 from raspberrycam.location import Location
-from raspberrycam.scheduler import FdriScheduler, ScheduleState
+from raspberrycam.scheduler import FdriScheduler, JitterStats, ScheduleState, next_capture_time, sleep_until
 
 
 def test_scheduler() -> None:
@@ -29,3 +30,131 @@ def test_scheduler() -> None:
     dt = datetime(2025, 6, 6, 2, 0, 0, 0, tzinfo=tzlocal())
     state = sched.get_state(dt)
     assert state == ScheduleState.OFF
+
+
+def test_next_capture_time() -> None:
+    dt = datetime(2025, 6, 6, 10, 3, 27, tzinfo=timezone.utc)
+    assert next_capture_time(dt, 300) == datetime(2025, 6, 6, 10, 5, tzinfo=timezone.utc)
+
+    # A time on a boundary is its own slot, unless that slot has already been used
+    slot = datetime(2025, 6, 6, 10, 5, tzinfo=timezone.utc)
+    assert next_capture_time(slot, 300) == slot
+    assert next_capture_time(slot, 300, after=slot) == slot + timedelta(minutes=5)
+
+    # Slots missed while a capture overran are skipped rather than caught up
+    late = datetime(2025, 6, 6, 10, 17, 1, tzinfo=timezone.utc)
+    assert next_capture_time(late, 300, after=slot) == datetime(2025, 6, 6, 10, 20, tzinfo=timezone.utc)
+
+
+def test_jitter_stats() -> None:
+    jitter = JitterStats(300)
+    slot = datetime(2025, 6, 6, 10, 5, tzinfo=timezone.utc)
+
+    assert jitter.record(slot, slot + timedelta(milliseconds=20)) == 0.02
+    jitter.record(slot + timedelta(minutes=15), slot + timedelta(minutes=15, milliseconds=40))
+
+    assert jitter.missed == 2
+    assert abs(jitter.mean - 0.03) < 1e-9
+    assert abs(jitter.max - 0.04) < 1e-9
+    assert "2 missed slots" in jitter.summary()
+
+
+def test_next_transition() -> None:
+    sched = FdriScheduler(Location(55.8626453, -3.2031049))
+
+    night = datetime(2025, 6, 6, 1, 0, tzinfo=timezone.utc)
+    transition = sched.get_next_transition(night)
+    assert transition["state"] == ScheduleState.ON
+    assert transition["time"].date() == night.date()
+
+    day = datetime(2025, 6, 6, 12, 0, tzinfo=timezone.utc)
+    assert sched.get_next_transition(day)["state"] == ScheduleState.OFF
+
+    evening = datetime(2025, 6, 6, 23, 0, tzinfo=timezone.utc)
+    transition = sched.get_next_transition(evening)
+    assert transition["state"] == ScheduleState.ON
+    assert transition["time"].date() == (evening + timedelta(days=1)).date()
+
+
+class FakeClocks:
+    """Wall and monotonic clocks that only move when waited on"""
+
+    def __init__(self) -> None:
+        self.wall = 1_000_000.0
+        self.monotonic = 0.0
+        self.waits = []
+
+    def wait(self, seconds: float) -> bool:
+        self.waits.append(seconds)
+        self.wall += seconds
+        self.monotonic += seconds
+        return False
+
+
+def test_sleep_until() -> None:
+    clocks = FakeClocks()
+    deadline = datetime.fromtimestamp(clocks.wall + 8 * 3600, tz=timezone.utc)
+    kwargs = {"wall_clock": lambda: clocks.wall, "monotonic_clock": lambda: clocks.monotonic}
+
+    # One wake up for the whole night
+    assert sleep_until(deadline, wait=clocks.wait, **kwargs)
+    assert clocks.waits == [8 * 3600]
+
+    # Or one per max_sleep
+    clocks = FakeClocks()
+    deadline = datetime.fromtimestamp(clocks.wall + 8 * 3600, tz=timezone.utc)
+    assert sleep_until(deadline, wait=clocks.wait, max_sleep=3600, **kwargs)
+    assert len(clocks.waits) == 8
+
+
+def test_sleep_until_clock_jump() -> None:
+    clocks = FakeClocks()
+    deadline = datetime.fromtimestamp(clocks.wall + 8 * 3600, tz=timezone.utc)
+
+    def wait(seconds: float) -> bool:
+        clocks.wait(seconds)
+        # The clock is corrected by an hour during the first sleep
+        if len(clocks.waits) == 1:
+            clocks.wall += 3600
+        return False
+
+    assert not sleep_until(
+        deadline, wait=wait, max_sleep=3600, wall_clock=lambda: clocks.wall, monotonic_clock=lambda: clocks.monotonic
+    )
+    assert len(clocks.waits) == 1
+
+    # An interrupted wait also ends the sleep
+    assert not sleep_until(datetime.now(timezone.utc) + timedelta(hours=1), wait=lambda seconds: True)
+
+
+def test_learned_offsets(tmp_path: Path) -> None:
+    location = Location(55.8626453, -3.2031049)
+    offsets_file = tmp_path / "offsets.json"
+    sched = FdriScheduler(location, learn_offsets=True, learning_step=300, max_offset=600, offsets_file=offsets_file)
+    day = datetime(2025, 6, 6, 12, tzinfo=timezone.utc)
+    stats = location.get_sun_stats(day)
+
+    # Dark captures after sunrise push the ON time later, up to max_offset
+    for minutes in range(3):
+        sched.record_exposure(stats["sunrise"] + timedelta(minutes=minutes), usable=False)
+    assert sched.sunrise_offset == 600
+    assert sched.get_schedule(day)[0]["time"] == stats["sunrise"] + timedelta(seconds=600)
+
+    # A dark capture in the evening brings the OFF time earlier
+    sched.record_exposure(stats["sunset"] - timedelta(minutes=1), usable=False)
+    assert sched.sunset_offset == -300
+    # Any capture in the middle of the day changes nothing, a good one at the edge lets it drift back
+    sched.record_exposure(stats["noon"], usable=True)
+    assert sched.sunset_offset == -300
+    sched.record_exposure(stats["noon"], usable=False)
+    sched.record_exposure(stats["noon"] - timedelta(minutes=1), usable=False)
+    assert (sched.sunrise_offset, sched.sunset_offset) == (600, -300)
+    sched.record_exposure(stats["sunset"] - timedelta(seconds=320), usable=True)
+    assert sched.sunset_offset == -225
+
+    # The offsets are kept between runs
+    assert FdriScheduler(location, offsets_file=offsets_file).sunrise_offset == 600
+    # Not learning by default
+    sched = FdriScheduler(location)
+    sched.record_exposure(stats["sunrise"], usable=False)
+    assert sched.sunrise_offset == 0
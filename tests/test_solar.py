@@ -0,0 +1,49 @@
+from datetime import date, timedelta
+
+import numpy as np
+from astral import Observer
+from astral.sun import sun
+
+from raspberrycam.solar import daylight_seconds, plan_sites, sun_events
+
+SITES = [(55.8626453, -3.2031049), (51.8626453, -0.2031049), (57.1, -5.5), (50.2, -5.1)]
+
+
+def test_sun_events_match_astral() -> None:
+    dates = np.datetime64("2025-01-01") + np.arange(0, 365, 7)
+    events = sun_events([lat for lat, _ in SITES], [lon for _, lon in SITES], dates)
+    assert events["sunrise"].shape == (len(SITES), len(dates))
+
+    for i, (lat, lon) in enumerate(SITES):
+        observer = Observer(latitude=lat, longitude=lon)
+        for j, day in enumerate(dates):
+            expected = sun(observer, date=day.astype(date))
+            for event in ["dawn", "sunrise", "noon", "sunset", "dusk"]:
+                actual = events[event][i, j].astype("datetime64[s]").astype(object)
+                difference = abs(actual - expected[event].replace(tzinfo=None))
+                assert difference < timedelta(minutes=1), (lat, lon, day, event)
+
+
+def test_polar_daylight() -> None:
+    dates = np.array(["2025-06-21", "2025-12-21"], dtype="datetime64[D]")
+    daylight = daylight_seconds([78.2], [15.6], dates)
+    assert daylight[0, 0] == 86400
+    assert daylight[0, 1] == 0
+
+    events = sun_events([78.2], [15.6], dates)
+    assert np.isnat(events["sunrise"]).all()
+
+
+def test_plan_sites() -> None:
+    sites = [
+        {"site": "CARGN", "lat": 55.8626453, "lon": -3.2031049, "interval": 3600},
+        {"site": "TEST", "lat": 51.8626453, "lon": -0.2031049, "interval": 300},
+    ]
+    plan = plan_sites(sites, date(2025, 1, 1), 365, image_kilobytes=200)
+
+    assert [row["site"] for row in plan] == ["CARGN", "TEST"]
+    # Every site gets about half a year of daylight
+    for row in plan:
+        assert 4300 < row["daylight_hours"] < 4600
+    assert plan[1]["captures"] > 10 * plan[0]["captures"]
+    assert plan[0]["megabytes"] == round(plan[0]["captures"] * 200 / 1024, 1)